@@ -7,6 +7,12 @@ class VMOperationPayload(BaseModel):
     action: Literal["start", "stop", "restart"]
     zone: str = Field(..., example="us-central1-a")
     project_id: str
+    # Check the VM's live status instead of the cached one before acting
+    force_refresh: bool = False
+
+
+class VMOperationBatch(BaseModel):
+    operations: List[VMOperationPayload]
 
 
 class NodePoolConfig(BaseModel):
@@ -32,10 +38,7 @@ class NodePoolSizeTag(BaseModel):
     updated_by: Optional[str] = None  # User who updated the tag, e.g., "
 
 
-class MaintenanceWindowRequest(BaseModel):
-    project_id: str
-    location: str  # e.g., "us-central1"
-    cluster_id: str
+class MaintenanceWindow(BaseModel):
     frequency: Annotated[str, Field(description="Only 'WEEKLY' is allowed")]
     byday: List[str]  # e.g., ["MO", "TH"]
     start_time: str  # Format "HH:MM"
@@ -43,6 +46,19 @@ class MaintenanceWindowRequest(BaseModel):
     updated_on: Optional[str] = None  # ISO format date string, e.g., "2023-10-01T12:00:00Z"
     updated_by: Optional[str] = None  # User who updated the tag, e.g., "
 
+class MaintenanceWindowRequest(MaintenanceWindow):
+    project_id: str
+    location: str  # e.g., "us-central1"
+    cluster_id: str
+
+class MaintenanceCluster(BaseModel):
+    project_id: str
+    location: str
+    cluster_id: str
+
+class MultiClusterMaintenanceWindowRequest(MaintenanceWindow):
+    clusters: List[MaintenanceCluster]
+
 class ScheduleTag(BaseModel):
     days: List[int] = Field(..., example=[1, 2, 3, 4, 5])
     starttime: str = Field(..., example="06:00:00")
@@ -0,0 +1,133 @@
+import datetime
+import threading
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+import structlog
+
+from app.schedule import BusinessHours, parse_business_hours, parse_size_config, schedule_key, week_start, windows
+
+logger = structlog.get_logger()
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+
+def compile_intervals(hours: BusinessHours, start_of_week: datetime.datetime) -> np.ndarray:
+    """
+    Compile business hours into [start, end) UTC minute-of-week intervals for
+    the week beginning at `start_of_week`. Timezone offsets (including DST)
+    are resolved here, once, rather than per evaluation.
+    """
+    end_of_week = start_of_week + datetime.timedelta(days=7)
+    intervals = []
+    for start, end in windows(hours, start_of_week):
+        start, end = max(start, start_of_week), min(end, end_of_week)
+        if start < end:
+            intervals.append((
+                int((start - start_of_week).total_seconds()) // 60,
+                int((end - start_of_week).total_seconds()) // 60,
+            ))
+    return np.array(sorted(intervals), dtype=np.int32).reshape(-1, 2)
+
+
+def intervals_to_bitmap(intervals: np.ndarray) -> np.ndarray:
+    """Expand minute-of-week intervals into a boolean array of MINUTES_PER_WEEK."""
+    bitmap = np.zeros(MINUTES_PER_WEEK, dtype=bool)
+    for start, end in intervals:
+        bitmap[start:end] = True
+    return bitmap
+
+
+class FleetState(NamedTuple):
+    keys: List[Tuple[str, str]]  # (kind, doc_id)
+    in_hours: np.ndarray         # bool, one per resource
+    sizes: np.ndarray            # int32 (n, 3) min/max/desired in effect; -1 for VMs
+
+
+class FleetSchedule:
+    """
+    Compiled business hours for every VM and node pool schedule.
+
+    Each document is parsed once when it is stored or loaded (as a
+    ScheduleIndex listener). Identical schedules share one compiled
+    minute-of-week bitmap per UTC week, and node pool size strings are packed
+    into an int32 array of shape (n, 2, 3): business/off hours x
+    min/max/desired. Answering "what should every resource be at time T" is
+    then a couple of NumPy indexing operations with no per-row Python.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._hours = {}
+        self._arrays = None
+        self._generation = 0
+
+    def apply_change(self, kind: str, doc_id: str, doc):
+        """Compile (or drop) one schedule document."""
+        key = (kind, doc_id)
+        compiled = None
+        if doc is not None:
+            try:
+                hours = parse_business_hours(doc["business_hours"])
+                if kind == "nodepool":
+                    sizes = (parse_size_config(doc["business_hours_config"]), parse_size_config(doc["off_hours_config"]))
+                else:
+                    sizes = ((-1, -1, -1), (-1, -1, -1))
+                compiled = (schedule_key(hours), sizes)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error("schedule_invalid", document_id=doc_id, error=e)
+        with self._lock:
+            if compiled is None:
+                self._rows.pop(key, None)
+            else:
+                self._hours[compiled[0]] = hours
+                self._rows[key] = compiled
+            self._generation += 1
+
+    def attach(self, index):
+        """Compile everything already in `index` and follow its changes."""
+        index.listeners.append(self.apply_change)
+        for kind in ("vm", "nodepool"):
+            for doc_id, doc in index.items(kind):
+                self.apply_change(kind, doc_id, doc)
+
+    def _build(self, start_of_week: datetime.datetime):
+        with self._lock:
+            rows = list(self._rows.items())
+            hours = dict(self._hours)
+            generation = self._generation
+        schedule_keys = sorted({compiled[0] for _, compiled in rows})
+        positions = {k: i for i, k in enumerate(schedule_keys)}
+        bitmaps = np.zeros((len(schedule_keys), MINUTES_PER_WEEK), dtype=bool)
+        for i, k in enumerate(schedule_keys):
+            bitmaps[i] = intervals_to_bitmap(compile_intervals(hours[k], start_of_week))
+        keys = [key for key, _ in rows]
+        schedule_index = np.array([positions[compiled[0]] for _, compiled in rows], dtype=np.int32)
+        sizes = np.array([compiled[1] for _, compiled in rows], dtype=np.int32).reshape(-1, 2, 3)
+        return start_of_week, generation, keys, bitmaps, schedule_index, sizes
+
+    def desired_state(self, at: datetime.datetime = None) -> FleetState:
+        """Evaluate every schedule at `at` (default: now) in one vectorized pass."""
+        at = at or datetime.datetime.now(datetime.timezone.utc)
+        start_of_week = week_start(at)
+        arrays = self._arrays
+        if arrays is None or arrays[0] != start_of_week or arrays[1] != self._generation:
+            arrays = self._arrays = self._build(start_of_week)
+        _, _, keys, bitmaps, schedule_index, sizes = arrays
+        minute = int((at - start_of_week).total_seconds()) // 60
+        if not keys:
+            return FleetState(keys, np.zeros(0, dtype=bool), np.zeros((0, 3), dtype=np.int32))
+        in_hours = bitmaps[schedule_index, minute]
+        current = np.where(in_hours[:, None], sizes[:, 0, :], sizes[:, 1, :])
+        return FleetState(keys, in_hours, current)
+
+
+_fleet = None
+
+
+def get_fleet() -> FleetSchedule:
+    global _fleet
+    if _fleet is None:
+        _fleet = FleetSchedule()
+    return _fleet
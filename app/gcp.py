@@ -1,116 +1,406 @@
-from google.cloud import compute_v1
 import structlog
-from google.auth import default
-from google.cloud import firestore
 import app.dataclass as dataclass
 from fastapi import HTTPException
-from time import sleep
-from google.cloud import container_v1
-from google.protobuf.timestamp_pb2 import Timestamp
+from typing import TYPE_CHECKING
+import asyncio
 import datetime
+import math
 import os
+import time
+import orjson
 import pytz
-from app.utils.config_loader import load_config
-load_config()
+from pydantic import ValidationError
+from app.schedule import parse_business_hours, parse_size_config
+from app.operations import get_tracker
+from app.utils import clients, metrics
+from app.utils.limits import RateLimited
+from app.vm_status import get_status_cache
+from app.utils.dedup import get_cache
+from app.utils.executor import run_blocking
+from app.utils.ndjson import dumps_line
+from app.utils.keyed import KeyedExecutor
+from app.utils.retry import backoff_delays
+
+# The GCP SDK modules are heavy to import; they are loaded inside the
+# functions that need them so a cold start only pays for what it uses.
+if TYPE_CHECKING:
+    from google.cloud import container_v1
+    from google.protobuf.timestamp_pb2 import Timestamp
 
 
 logger = structlog.get_logger()
-credentials, _ = default()
-compute_client = compute_v1.InstancesClient()
-firestore_db = firestore.Client(database=os.getenv("FIRESTORE_DB"), project=os.getenv("PROJECT_ID"))
 vm_schedule_collection_name = "vm-instance-schedule"
+nodepool_schedule_collection_name = "gke-nodepool-scheduler"
+
+# Callbacks notified as (kind, doc_id, doc_data) whenever a schedule document
+# is stored ("vm" / "nodepool") or deleted (doc_data is None). Used by the
+# in-process scheduler to pick up changes without re-reading the collections.
+schedule_listeners = []
+
+def _notify_schedule_change(kind: str, doc_id: str, doc_data):
+    for listener in schedule_listeners:
+        try:
+            listener(kind, doc_id, doc_data)
+        except Exception as e:
+            logger.error("schedule_listener_failed", error=e)
 
 def perform_vm_operation(project_id: str, zone: str, instance_name: str, action: str):
     if action == "start":
-        return compute_client.start(project=project_id, zone=zone, instance=instance_name)
+        return clients.call("compute", "start", project=project_id, zone=zone, instance=instance_name)
     elif action == "stop":
-        return compute_client.stop(project=project_id, zone=zone, instance=instance_name)
+        return clients.call("compute", "stop", project=project_id, zone=zone, instance=instance_name)
     elif action == "restart":
-        return compute_client.restart(project=project_id, zone=zone, instance=instance_name)
+        return clients.call("compute", "restart", project=project_id, zone=zone, instance=instance_name)
     else:
         raise ValueError(f"Unsupported action: {action}")
 
-def set_nodepool_desired_size(client: container_v1.ClusterManagerClient, name: str, desired_size: int):
+_resource_executor = None
+
+
+def resource_executor() -> KeyedExecutor:
+    """Executor that serializes and coalesces commands per VM / node pool."""
+    global _resource_executor
+    if _resource_executor is None:
+        _resource_executor = KeyedExecutor(window=float(os.getenv("COALESCE_WINDOW_SECONDS", "0.25")))
+    return _resource_executor
+
+
+async def run_vm_command(payload: dataclass.VMOperationPayload):
+    """
+    Run one VM command unless the cached VM status shows it would not change
+    anything (a start for a running VM, a stop for a stopped one).
+    Returns (operation, None) when the API was called and (None, status)
+    when the command was skipped.
+    """
+    status_cache = get_status_cache()
+    current = await status_cache.is_noop(
+        payload.project_id, payload.zone, payload.vm_name, payload.action, payload.force_refresh
+    )
+    if current is not None:
+        logger.info("vm_operation_skipped", action=payload.action, vm_name=payload.vm_name, status=current)
+        return None, current
+    operation = await run_blocking(
+        perform_vm_operation,
+        project_id=payload.project_id,
+        zone=payload.zone,
+        instance_name=payload.vm_name,
+        action=payload.action
+    )
+    status_cache.mark_requested(payload.project_id, payload.zone, payload.vm_name, payload.action)
+    return operation, None
+
+
+@metrics.instrument
+async def vm_operation(payload: dataclass.VMOperationPayload, message_id: str = None):
+    """
+    Run a VM start/stop/restart requested through Pub/Sub.
+    The returned zone operation is followed to completion by the operation
+    tracker; its status is available by messageId.
+    """
+    ran, outcome = await resource_executor().submit(
+        get_vm_doc_id(payload.project_id, payload.vm_name),
+        payload,
+        lambda: run_vm_command(payload)
+    )
+    if ran is not payload:
+        # Replaced by a newer command for this VM before it was sent
+        logger.info("vm_operation_superseded", action=payload.action, vm_name=payload.vm_name, superseded_by=ran.action)
+        return {"status": "VM operation superseded", "superseded_by": ran.action}
+    operation, current = outcome
+    if operation is None:
+        return {"status": "VM operation skipped", "reason": f"VM is already {current}"}
+    get_tracker().register(message_id, payload.project_id, payload.zone, payload.vm_name, payload.action, operation)
+    logger.info("vm_operation_requested", action=payload.action, vm_name=payload.vm_name, project_id=payload.project_id)
+    return {"status": "VM operation initiated", "operation": getattr(operation, "name", None)}
+
+# Process-wide concurrency caps for batch VM operations, so one large batch
+# (or several at once) cannot flood a single project's or zone's quota.
+_project_semaphores = {}
+_zone_semaphores = {}
+
+
+def _semaphore(semaphores: dict, key, env_var: str, default: str) -> asyncio.Semaphore:
+    if key not in semaphores:
+        semaphores[key] = asyncio.Semaphore(int(os.getenv(env_var, default)))
+    return semaphores[key]
+
+
+@metrics.instrument
+async def vm_operation_batch(batch: dataclass.VMOperationBatch, message_id: str = None):
+    """
+    Run a batch of VM operations concurrently, capped per project and per zone.
+    Failures are reported per VM instead of failing the whole batch.
+    """
+    async def run_one(op: dataclass.VMOperationPayload):
+        result = {"vm_name": op.vm_name, "zone": op.zone, "project_id": op.project_id, "action": op.action}
+        project_semaphore = _semaphore(_project_semaphores, op.project_id, "BATCH_PROJECT_CONCURRENCY", "20")
+        zone_semaphore = _semaphore(_zone_semaphores, (op.project_id, op.zone), "BATCH_ZONE_CONCURRENCY", "10")
+        doc_id = get_vm_doc_id(op.project_id, op.vm_name)
+
+        async def call():
+            async with project_semaphore, zone_semaphore:
+                return await run_vm_command(op)
+
+        async def run():
+            # Raises on failure, so only items that went through are recorded
+            ran, outcome = await resource_executor().submit(doc_id, op, call)
+            if ran is not op:
+                return {"status": "superseded", "superseded_by": ran.action}
+            operation, current = outcome
+            if operation is None:
+                return {"status": "skipped", "reason": f"VM is already {current}"}
+            get_tracker().register(message_id, op.project_id, op.zone, op.vm_name, op.action, operation)
+            return {"status": "initiated", "operation": getattr(operation, "name", None)}
+
+        try:
+            # Recorded per (message, VM, action): when the batch is redelivered
+            # because other items were rate limited, a restart that already
+            # went through is not sent again
+            item_id = f"{message_id}/{doc_id}/{op.action}" if message_id else None
+            result.update(await get_cache().run(item_id, run))
+        except RateLimited as e:
+            _mark_rate_limited(result, e)
+        except Exception as e:
+            logger.error("vm_operation_failed", action=op.action, vm_name=op.vm_name, project_id=op.project_id, error=e)
+            result["status"] = "failed"
+            result["error"] = str(e)
+        return result
+
+    logger.info("vm_batch_started", operations=len(batch.operations))
+    results = await asyncio.gather(*(run_one(op) for op in batch.operations))
+    failed = sum(1 for r in results if r["status"] == "failed")
+    return _batch_response(results, {
+        "status": "partial_failure" if failed else "VM operations initiated",
+        "succeeded": len(results) - failed,
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "superseded": sum(1 for r in results if r["status"] == "superseded"),
+        "failed": failed,
+        "results": results,
+    })
+
+
+def _mark_rate_limited(result: dict, error: RateLimited):
+    logger.warning("batch_item_rate_limited", item=result, retry_after=error.retry_after)
+    result["status"] = "rate_limited"
+    result["error"] = error.detail
+    result["retry_after"] = error.retry_after
+
+
+def _batch_response(results, response: dict) -> dict:
+    """
+    Return the batch response, or raise it as a 429 when any item was rate
+    limited so Pub/Sub redelivers the message later. Items that went through
+    are not repeated on redelivery: VM items are recorded per message in the
+    dedup cache, and maintenance windows already in place are skipped.
+    """
+    retry_after = [r["retry_after"] for r in results if r["status"] == "rate_limited"]
+    if not retry_after:
+        return response
+    response = {**response, "status": "rate_limited", "rate_limited": len(retry_after),
+                "succeeded": response["succeeded"] - len(retry_after)}
+    raise HTTPException(status_code=429, detail=response,
+                        headers={"Retry-After": str(max(1, math.ceil(max(retry_after))))})
+
+async def wait_for_cluster_operation(project_id: str, location: str, operation: "container_v1.Operation"):
+    """
+    Poll a GKE operation with exponential backoff until it is done.
+    """
+    from google.cloud import container_v1
+    name = f"projects/{project_id}/locations/{location}/operations/{operation.name}"
+    deadline = time.monotonic() + float(os.getenv("NODEPOOL_OPERATION_TIMEOUT", "600"))
+    for delay in backoff_delays(initial=1.0, maximum=15.0):
+        if operation.status == container_v1.Operation.Status.DONE:
+            if operation.error.code:
+                raise RuntimeError(f"Operation {operation.name} failed: {operation.error.message}")
+            logger.info("cluster_operation_done", operation=operation.name)
+            return operation
+        if time.monotonic() + delay > deadline:
+            break
+        await asyncio.sleep(delay)
+        operation = await run_blocking(clients.call, "container", "get_operation", name=name)
+    raise HTTPException(status_code=504, detail=f"Timed out waiting for operation {operation.name}")
+
+
+@metrics.instrument
+async def set_nodepool_desired_size(name: str, desired_size: int):
     """
     Set the desired size of the node pool using the gRPC client.
+    The cluster rejects the request while another operation is running, so
+    retry with backoff on FailedPrecondition.
     """
+    from google.api_core.exceptions import FailedPrecondition
+    from google.cloud import container_v1
     attempts = 0
     max_retries = 3
+    delays = backoff_delays(initial=2.0, maximum=20.0)
     while attempts < max_retries:
-        sleep(5)  # Wait for the cluster to stabilize
         try:
             resize_request = container_v1.SetNodePoolSizeRequest(
                 name=name,
                 node_count=desired_size
             )
-            logger.info(f"Trying to update desired size to {desired_size} for node pool: {name}")
-            resize_response = client.set_node_pool_size(request=resize_request)
-            logger.info(f"Node pool resized to {desired_size} nodes")
+            logger.info("node_pool_resize_requested", node_pool=name, desired_size=desired_size)
+            resize_response = await run_blocking(clients.call, "container", "set_node_pool_size", request=resize_request)
+            logger.info("node_pool_resized", node_pool=name, desired_size=desired_size)
             return "Success"
-        except Exception as e:
-            logger.error(f"Error resizing node pool: {e}")
+        except FailedPrecondition as e:
+            logger.error("node_pool_resize_busy", node_pool=name, error=e)
+            metrics.RETRIES.labels(operation="set_node_pool_size").inc()
             attempts += 1
+            if attempts < max_retries:
+                await asyncio.sleep(next(delays))
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Not a busy cluster, so retrying would not help
+            logger.error("node_pool_resize_failed", node_pool=name, error=e)
+            raise HTTPException(status_code=500, detail=f"Failed to resize node pool: {str(e)}")
     raise HTTPException(status_code=500, detail="Failed to resize node pool after multiple attempts")
 
 
-def nodepool_setsize(config: dataclass.NodePoolConfig):
+@metrics.instrument
+async def nodepool_setsize(config: dataclass.NodePoolConfig):
+    """
+    Configure the node pool for a GKE cluster.
+    Commands for the same node pool run one at a time; a pending one is
+    replaced by a newer config.
+    """
+    ran, result = await resource_executor().submit(get_nodepool_doc_id(config), config, lambda: _nodepool_setsize(config))
+    if ran is not config:
+        logger.info("node_pool_configure_superseded", node_pool=config.nodepool_id, cluster_id=config.cluster_id)
+        return {"status": "superseded", "reason": "Replaced by a newer configuration for this node pool"}
+    return result
+
+
+# Recently fetched node pool state, keyed by node pool resource name:
+# name -> (fetched_at, NodePool, per-zone target sizes or None)
+_node_pool_cache = {}
+
+
+def _fetch_node_pool_state(name: str, with_sizes: bool):
     """
-    Configure the node pool for a GKE cluster 
+    Fetch a node pool and, if asked, the target size of each of its managed
+    instance groups (node counts are per zone).
     """
+    node_pool = clients.call("container", "get_node_pool", name=name)
+    sizes = None
+    if with_sizes:
+        sizes = []
+        for url in node_pool.instance_group_urls:
+            # .../projects/{project}/zones/{zone}/instanceGroupManagers/{name}
+            parts = url.split("/")
+            manager = clients.call(
+                "instance_group_managers", "get",
+                project=parts[-5], zone=parts[-3], instance_group_manager=parts[-1]
+            )
+            sizes.append(manager.target_size)
+    return node_pool, sizes
+
+
+async def get_node_pool_state(name: str, with_sizes: bool):
+    """Return (NodePool, sizes), served from a short-lived cache when possible."""
+    cached = _node_pool_cache.get(name)
+    ttl = float(os.getenv("NODEPOOL_CACHE_TTL_SECONDS", "30"))
+    if cached is not None and time.monotonic() - cached[0] < ttl and (cached[2] is not None or not with_sizes):
+        return cached[1], cached[2]
+    node_pool, sizes = await run_blocking(_fetch_node_pool_state, name, with_sizes)
+    _node_pool_cache[name] = (time.monotonic(), node_pool, sizes)
+    return node_pool, sizes
+
+
+def nodepool_changes(config: dataclass.NodePoolConfig, node_pool, sizes) -> dict:
+    """Compare a NodePoolConfig with the live node pool; True means the field must change."""
+    autoscaling = node_pool.autoscaling
+    if config.enable_autoscaling:
+        autoscaling_differs = not (
+            autoscaling.enabled
+            and autoscaling.min_node_count == config.min_nodes
+            and autoscaling.max_node_count == config.max_nodes
+        )
+    else:
+        autoscaling_differs = autoscaling.enabled
+    changes = {"autoscaling": autoscaling_differs}
+    if config.desired_node_count is not None:
+        changes["node_count"] = not sizes or any(size != config.desired_node_count for size in sizes)
+    return changes
+
+
+async def _nodepool_setsize(config: dataclass.NodePoolConfig):
+    """
+    Configure the node pool for a GKE cluster.
+    The live node pool is compared with the config first and only the
+    fields that differ are changed; each change starts a cluster operation
+    that blocks the next one for minutes.
+    """
+    from google.cloud import container_v1
     try:
-        client = container_v1.ClusterManagerClient()
         name = f"projects/{config.project_id}/locations/{config.zone}/clusters/{config.cluster_id}/nodePools/{config.nodepool_id}"
-        logger.info(f"Configuring node pool: {name}")
-        logger.info(f"Node pool config: {config}")
+        logger.info("node_pool_configure", node_pool=name, config=config)
 
         if config.enable_autoscaling:
             if config.min_nodes is None or config.max_nodes is None:
-                logger.error("min_nodes and max_nodes are required when autoscaling is enabled")
+                logger.error("node_pool_config_invalid", node_pool=name, reason="min_nodes and max_nodes are required when autoscaling is enabled")
                 raise HTTPException(status_code=400, detail="min_nodes and max_nodes are required when autoscaling is enabled")
+        elif config.desired_node_count is None:
+            raise HTTPException(status_code=400, detail="desired_node_count is required when autoscaling is disabled")
 
+        try:
+            node_pool, sizes = await get_node_pool_state(name, config.desired_node_count is not None)
+            changes = nodepool_changes(config, node_pool, sizes)
+        except HTTPException:
+            # Rate limited or circuit open: applying every change blindly
+            # would only send more calls to a throttled or failing API
+            raise
+        except Exception as e:
+            logger.error("node_pool_state_unavailable", node_pool=name, error=e)
+            changes = {"autoscaling": True}
+            if config.desired_node_count is not None:
+                changes["node_count"] = True
+        skipped = [field for field, differs in changes.items() if not differs]
+        if skipped:
+            logger.info("node_pool_fields_unchanged", node_pool=name, skipped=skipped)
+
+        if changes["autoscaling"]:
+            _node_pool_cache.pop(name, None)
             autoscaling_request = container_v1.SetNodePoolAutoscalingRequest(
                 name=name,
                 autoscaling=container_v1.NodePoolAutoscaling(
                     enabled=True,
                     min_node_count=config.min_nodes,
                     max_node_count=config.max_nodes
-                )
+                ) if config.enable_autoscaling else container_v1.NodePoolAutoscaling(enabled=False)
             )
-            autoscaling_response = client.set_node_pool_autoscaling(request=autoscaling_request)
-            resize_response = None
+            autoscaling_response = await run_blocking(clients.call, "container", "set_node_pool_autoscaling", request=autoscaling_request)
+            if changes.get("node_count"):
+                await wait_for_cluster_operation(config.project_id, config.zone, autoscaling_response)
 
-            if config.desired_node_count is not None:
-                resize_response = set_nodepool_desired_size(client, name, config.desired_node_count)
+        resize_response = None
+        if changes.get("node_count"):
+            _node_pool_cache.pop(name, None)
+            resize_response = await set_nodepool_desired_size(name, config.desired_node_count)
 
+        if config.enable_autoscaling:
             return {
                 "status": "autoscaler_configured",
                 "autoscaler_response": "Success",
+                "skipped": skipped,
             }
+        return {
+            "status": "autoscaler_disabled_and_resized",
+            "autoscaler_response": "Success",
+            "resize_response": resize_response or "Unchanged",
+            "skipped": skipped,
+        }
 
-        else:
-            if config.desired_node_count is None:
-                raise HTTPException(status_code=400, detail="desired_node_count is required when autoscaling is disabled")
-
-            disable_autoscaling_request = container_v1.SetNodePoolAutoscalingRequest(
-                name=name,
-                autoscaling=container_v1.NodePoolAutoscaling(enabled=False)
-            )
-            autoscaling_response = client.set_node_pool_autoscaling(request=disable_autoscaling_request)
-
-            resize_response = set_nodepool_desired_size(client, name, config.desired_node_count)
-
-            return {
-                "status": "autoscaler_disabled_and_resized",
-                "autoscaler_response": autoscaling_response,
-                "resize_response": resize_response
-            }
-
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error updating node pool: {e}")
+        logger.error("node_pool_update_failed", project_id=config.project_id, nodepool_id=config.nodepool_id, error=e)
         raise HTTPException(status_code=500, detail=f"Error updating node pool: {str(e)}")
 
 
-def make_timestamp(hour: int, minute: int) -> Timestamp:
+def make_timestamp(hour: int, minute: int) -> "Timestamp":
+    from google.protobuf.timestamp_pb2 import Timestamp
     now = datetime.datetime.now(datetime.timezone.utc)
     dt = datetime.datetime(
         year=now.year,
@@ -124,78 +414,200 @@ def make_timestamp(hour: int, minute: int) -> Timestamp:
     ts.FromDatetime(dt)
     return ts
 
-def schedule_maintenance(req: dataclass.MaintenanceWindowRequest):
-    client = container_v1.ClusterManagerClient()
+def maintenance_window(req: dataclass.MaintenanceWindow) -> "container_v1.RecurringTimeWindow":
+    """Build the recurring maintenance window described by a request."""
+    from google.cloud import container_v1
+    hours, minutes = map(int, req.start_time.split(":"))
+    end_hour = (hours + req.duration_hours) % 24
+
+    # Create start and end timestamps
+    start_ts = make_timestamp(hours, minutes)
+    end_ts = make_timestamp(end_hour, minutes)
+    logger.info("maintenance_window", start=start_ts.ToDatetime(), end=end_ts.ToDatetime(), recurrence=f"FREQ={req.frequency};BYDAY={','.join(req.byday)}")
+    return container_v1.RecurringTimeWindow(
+        window=container_v1.TimeWindow(
+            start_time=start_ts,
+            end_time=end_ts,
+        ),
+        recurrence=f"FREQ={req.frequency};BYDAY={','.join(req.byday)}"
+    )
 
-    # Parse time
-    try:
-        hours, minutes = map(int, req.start_time.split(":"))
-        end_hour = (hours + req.duration_hours) % 24
-
-        # Create start and end timestamps
-        start_ts = make_timestamp(hours, minutes)
-        end_ts = make_timestamp(end_hour, minutes)
-        logger.info(f"Scheduling maintenance from {start_ts.ToDatetime()} to {end_ts.ToDatetime()}")
-        recurring_window = container_v1.RecurringTimeWindow(
-            window=container_v1.TimeWindow(
-                start_time=start_ts,
-                end_time=end_ts,
-            ),
-            recurrence=f"FREQ={req.frequency};BYDAY={','.join(req.byday)}"
-        )
-        cluster = client.get_cluster(
-        name=f"projects/{req.project_id}/locations/{req.location}/clusters/{req.cluster_id}"
-        )
+
+def _window_key(recurring_window):
+    """Time of day and recurrence of a window; the dates make_timestamp picks do not matter."""
+    window = recurring_window.window
+    start, end = window.start_time, window.end_time
+    return (
+        recurring_window.recurrence,
+        start.time() if start else None,
+        end.time() if end else None,
+    )
+
+
+def set_cluster_maintenance_window(name: str, recurring_window: "container_v1.RecurringTimeWindow", cluster=None) -> str:
+    """
+    Set a cluster's recurring maintenance window.
+
+    The policy update is guarded by the cluster's maintenance_policy
+    resource_version. If the cluster changed since `cluster` was fetched
+    (or another operation holds it) the cluster is fetched again and the
+    update retried with backoff. Returns "unchanged" when the window is
+    already in place, otherwise "success".
+    """
+    from google.api_core.exceptions import Conflict, FailedPrecondition
+    from google.cloud import container_v1
+    retries = int(os.getenv("MAINTENANCE_CONFLICT_RETRIES", "3"))
+    delays = backoff_delays(initial=1.0, maximum=10.0)
+    for attempt in range(retries + 1):
+        if cluster is None:
+            cluster = clients.call("container", "get_cluster", name=name)
+        if _window_key(cluster.maintenance_policy.window.recurring_window) == _window_key(recurring_window):
+            logger.info("maintenance_window_unchanged", cluster=name)
+            return "unchanged"
         resource_version = cluster.maintenance_policy.resource_version
-        logger.info(f"Current resource version: {resource_version}")
+        logger.info("maintenance_policy_version", cluster=name, resource_version=resource_version)
         maintenance_policy = container_v1.MaintenancePolicy(
             window=container_v1.MaintenanceWindow(
             recurring_window=recurring_window
             ),
             resource_version=resource_version
         )
-        
         request = container_v1.SetMaintenancePolicyRequest(
-            name=f"projects/{req.project_id}/locations/{req.location}/clusters/{req.cluster_id}",
+            name=name,
             maintenance_policy=maintenance_policy
         )
-        response = client.set_maintenance_policy(request=request)
-        logger.info(f"Maintenance scheduled successfully: {response}")
-        return {"status": "success"}
+        try:
+            response = clients.call("container", "set_maintenance_policy", request=request)
+            logger.info("maintenance_window_set", cluster=name)
+            return "success"
+        except (Conflict, FailedPrecondition) as e:
+            if attempt == retries:
+                raise
+            logger.error("maintenance_policy_conflict", cluster=name, attempt=attempt, error=e)
+            metrics.RETRIES.labels(operation="set_maintenance_policy").inc()
+            cluster = None
+            time.sleep(next(delays))
+
+
+@metrics.instrument
+def schedule_maintenance(req: dataclass.MaintenanceWindowRequest):
+    try:
+        status = set_cluster_maintenance_window(
+            f"projects/{req.project_id}/locations/{req.location}/clusters/{req.cluster_id}",
+            maintenance_window(req),
+        )
+        return {"status": status}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error scheduling maintenance: {e}")
+        logger.error("maintenance_failed", project_id=req.project_id, cluster_id=req.cluster_id, error=e)
         raise HTTPException(status_code=500, detail=f"Error scheduling maintenance: {str(e)}")
 
+
+def _list_project_clusters(project_id: str) -> dict:
+    """Fetch every cluster of a project in one call, keyed by resource name."""
+    response = clients.call("container", "list_clusters", parent=f"projects/{project_id}/locations/-")
+    return {
+        f"projects/{project_id}/locations/{cluster.location}/clusters/{cluster.name}": cluster
+        for cluster in response.clusters
+    }
+
+
+@metrics.instrument
+async def schedule_maintenance_batch(req: dataclass.MultiClusterMaintenanceWindowRequest):
+    """
+    Set the same maintenance window on many clusters.
+    Cluster metadata is fetched with one list_clusters call per project and
+    reused for the first attempt; clusters are updated concurrently, at most
+    MAINTENANCE_CONCURRENCY at a time. Failures are reported per cluster.
+    """
+    try:
+        recurring_window = maintenance_window(req)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid maintenance window: {e}")
+
+    async def fetch(project_id: str):
+        try:
+            return project_id, await run_blocking(_list_project_clusters, project_id)
+        except Exception as e:
+            logger.error("cluster_list_failed", project_id=project_id, error=e)
+            return project_id, {}
+
+    known = dict(await asyncio.gather(*(fetch(p) for p in {c.project_id for c in req.clusters})))
+    semaphore = asyncio.Semaphore(int(os.getenv("MAINTENANCE_CONCURRENCY", "10")))
+
+    async def apply(target: dataclass.MaintenanceCluster):
+        result = {"project_id": target.project_id, "location": target.location, "cluster_id": target.cluster_id}
+        name = f"projects/{target.project_id}/locations/{target.location}/clusters/{target.cluster_id}"
+        try:
+            async with semaphore:
+                result["status"] = await run_blocking(
+                    set_cluster_maintenance_window, name, recurring_window, known[target.project_id].get(name)
+                )
+        except RateLimited as e:
+            _mark_rate_limited(result, e)
+        except Exception as e:
+            logger.error("maintenance_failed", cluster=name, error=e)
+            result["status"] = "failed"
+            result["error"] = str(e)
+        return result
+
+    logger.info("maintenance_batch_started", clusters=len(req.clusters))
+    results = await asyncio.gather(*(apply(c) for c in req.clusters))
+    failed = sum(1 for r in results if r["status"] == "failed")
+    return _batch_response(results, {
+        "status": "partial_failure" if failed else "success",
+        "succeeded": len(results) - failed,
+        "unchanged": sum(1 for r in results if r["status"] == "unchanged"),
+        "failed": failed,
+        "results": results,
+    })
+
 def get_vm_doc_id(project_id, instance_name) -> str:
     """Generate Firestore document ID for a VM instance."""
     return f"{project_id}-vmid-{instance_name}"
 
+def validate_schedule(business_hours: dict, *size_configs: str):
+    """Reject schedules the scheduler could not evaluate before they are stored."""
+    try:
+        parse_business_hours(business_hours)
+        for size_config in size_configs:
+            parse_size_config(size_config)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schedule: {e}")
+
+def vm_schedule_doc(tag: dataclass.ScheduleTag):
+    """Validate a VM schedule tag and build its (doc_id, document)."""
+    validate_schedule({"days": tag.days, "starttime": tag.starttime, "endtime": tag.endtime, "timezone": tag.timezone})
+    doc_id = get_vm_doc_id(tag.project_id, tag.instance_name)
+    doc_data = {
+        "business_hours": {
+            "days": tag.days,
+            "starttime": tag.starttime,
+            "endtime": tag.endtime,
+            "timezone": tag.timezone.lower()
+        },
+        "vm_name": tag.instance_name,
+        "zone": tag.zone,
+        "project_id": tag.project_id,
+        "updated_on": datetime.datetime.now(pytz.timezone("Asia/Singapore")).isoformat(),
+        "updated_by": tag.updated_by or "system",  # Default to 'system' if not provided
+    }
+    return doc_id, doc_data
+
+@metrics.instrument
 def store_vm_schedule_tag(tag: dataclass.ScheduleTag):
     """Store VM instance schedule in Firestore."""
     #db = firestore.Client()
     #collection_name = "vm-instance-schedule" 
-    logger.info(f"Storing VM schedule tag in collection: {vm_schedule_collection_name}")
+    doc_id, doc_data = vm_schedule_doc(tag)
 
     try:
-        doc_id = get_vm_doc_id(tag.project_id, tag.instance_name)
-        doc_ref = firestore_db.collection(vm_schedule_collection_name).document(doc_id)
-
-        doc_data = {
-            "business_hours": {
-                "days": tag.days,
-                "starttime": tag.starttime,
-                "endtime": tag.endtime,
-                "timezone": tag.timezone.lower()
-            },
-            "vm_name": tag.instance_name,
-            "zone": tag.zone,
-            "project_id": tag.project_id,
-            "updated_on": datetime.datetime.now(pytz.timezone("Asia/Singapore")).isoformat(),
-            "updated_by": tag.updated_by or "system",  # Default to 'system' if not provided
-        }
-
-        doc_ref.set(doc_data)
-        logger.info(f"Stored VM schedule tag under doc_id: {doc_id} data: {doc_data}")
+        with clients.limited("firestore", "set") as db:
+            db.collection(vm_schedule_collection_name).document(doc_id).set(doc_data)
+        metrics.count_firestore("write", vm_schedule_collection_name)
+        logger.info("vm_schedule_stored", collection=vm_schedule_collection_name, document_id=doc_id, document=doc_data)
+        _notify_schedule_change("vm", doc_id, doc_data)
 
         return {
             "message": f"Schedule info stored for {tag.instance_name}",
@@ -203,89 +615,260 @@ def store_vm_schedule_tag(tag: dataclass.ScheduleTag):
             "collection": vm_schedule_collection_name
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error storing VM schedule tag: {e}")
+        logger.error("vm_schedule_store_failed", instance_name=tag.instance_name, error=e)
         raise HTTPException(status_code=500, detail=f"Error storing VM schedule tag: {str(e)}")
 
 def get_nodepool_doc_id(tag: dataclass.NodePoolSizeTag) -> str:
     # Compose unique doc id from identifiers
     return f"{tag.project_id}-clid-{tag.cluster_id}-nid-{tag.nodepool_id}"
 
+def nodepool_schedule_doc(tag: dataclass.NodePoolSizeTag):
+    """Validate a node pool size tag and build its (doc_id, document)."""
+    validate_schedule(tag.business_hours, tag.business_hours_config, tag.off_hours_config)
+    doc_id = get_nodepool_doc_id(tag)
+    # Convert pydantic model to dict
+    doc_data = {
+        "business_hours": tag.business_hours,
+        "cluster_id": tag.cluster_id,
+        "nodepool_id": tag.nodepool_id,
+        "project_id": tag.project_id,
+        "zone": tag.zone,
+        "enable_autoscaling": tag.enable_autoscaling,
+        "business_hours_config": tag.business_hours_config,  # e.g., "3,6,4"
+        "off_hours_config": tag.off_hours_config,  # e.g., "0,0,0"
+        "updated_on": datetime.datetime.now(pytz.timezone("Asia/Singapore")).isoformat(),
+        "updated_by": tag.updated_by or "system",  # Default to 'system' if not provided
+    }
+    return doc_id, doc_data
+
+@metrics.instrument
 def store_nodepool_size_tag(tag: dataclass.NodePoolSizeTag):
     # Initialize Firestore client
-    collection_name = "gke-nodepool-scheduler"
-    logger.info(f"Storing nodepool size tag in collection: {collection_name}")
+    collection_name = nodepool_schedule_collection_name
+    doc_id, doc_data = nodepool_schedule_doc(tag)
     try:
-        doc_id = get_nodepool_doc_id(tag)
-        doc_ref = firestore_db.collection(collection_name).document(doc_id)
-
-        # Convert pydantic model to dict
-        doc_data = {
-            "business_hours": tag.business_hours,
-            "cluster_id": tag.cluster_id,
-            "nodepool_id": tag.nodepool_id,
-            "project_id": tag.project_id,
-            "zone": tag.zone,
-            "enable_autoscaling": tag.enable_autoscaling,
-            "business_hours_config": tag.business_hours_config,  # e.g., "3,6,4"
-            "off_hours_config": tag.off_hours_config,  # e.g., "0,0,0"
-            "updated_on": datetime.datetime.now(pytz.timezone("Asia/Singapore")).isoformat(),
-            "updated_by": tag.updated_by or "system",  # Default to 'system' if not provided
-        }
-        doc_ref.set(doc_data)
+        with clients.limited("firestore", "set") as db:
+            db.collection(collection_name).document(doc_id).set(doc_data)
+        metrics.count_firestore("write", collection_name)
+        _notify_schedule_change("nodepool", doc_id, doc_data)
+        logger.info("nodepool_schedule_stored", collection=collection_name, document_id=doc_id)
         return {
             "message": f"Schedule info stored for {tag.nodepool_id}",
             "document_id": doc_id,
             "collection": collection_name
         }
-        logger.info(f"Stored nodepool info for doc_id: {doc_id}")
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error storing nodepool size tag: {e}")
+        logger.error("nodepool_schedule_store_failed", nodepool_id=tag.nodepool_id, error=e)
         raise HTTPException(status_code=500, detail=f"Error storing nodepool size tag: {str(e)}")
 
+def _schedule_record(line: bytes):
+    """Parse one NDJSON import line into (kind, collection, doc_id, document)."""
+    record = orjson.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Record must be a JSON object")
+    if "nodepool_id" in record:
+        doc_id, doc_data = nodepool_schedule_doc(dataclass.NodePoolSizeTag.model_validate(record))
+        return "nodepool", nodepool_schedule_collection_name, doc_id, doc_data
+    if "instance_name" in record:
+        doc_id, doc_data = vm_schedule_doc(dataclass.ScheduleTag.model_validate(record))
+        return "vm", vm_schedule_collection_name, doc_id, doc_data
+    raise ValueError("Record is neither a ScheduleTag nor a NodePoolSizeTag")
+
+def _bulk_write_chunk(writer, chunk, failed: dict):
+    """Queue a chunk on the BulkWriter and block until it is written."""
+    with clients.limited("firestore", "bulk_write"):
+        for line_no, kind, doc_ref, doc_data in chunk:
+            writer.set(doc_ref, doc_data)
+        writer.flush()
+    for line_no, kind, doc_ref, doc_data in chunk:
+        metrics.count_firestore("write", doc_ref.parent.id)
+        if doc_ref.path not in failed:
+            _notify_schedule_change(kind, doc_ref.id, doc_data)
+
+@metrics.instrument
+async def import_schedules(lines) -> dict:
+    """
+    Bulk import ScheduleTag / NodePoolSizeTag records from NDJSON lines.
+    Records are validated as they stream in and written through a Firestore
+    BulkWriter in chunks; each chunk is flushed before more input is read,
+    which bounds memory and applies backpressure to the upload. Invalid
+    records and failed writes are reported per line.
+    """
+    chunk_size = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+    max_errors = 1000
+    # Building the client (first use) and the writer block; keep them off the loop
+    db = await run_blocking(clients.get, "firestore")
+    writer = await run_blocking(db.bulk_writer)
+    errors = []
+    failed = {}
+    line_of = {}
+    received = 0
+    invalid = 0
+
+    def report(line_no, document_id, error):
+        if len(errors) < max_errors:
+            errors.append({"line": line_no, "document_id": document_id, "error": error})
+
+    def on_write_error(failure, bulk_writer) -> bool:
+        if failure.attempts < 5:
+            return True
+        path = failure.operation.reference.path
+        failed[path] = failure.message
+        report(line_of.get(path), failure.operation.reference.id, failure.message)
+        return False
+
+    writer.on_write_error(on_write_error)
+    chunk = []
+    line_no = 0
+    try:
+        async for line in lines:
+            line_no += 1
+            if not line.strip():
+                continue
+            received += 1
+            try:
+                kind, collection, doc_id, doc_data = _schedule_record(line)
+            except HTTPException as e:
+                invalid += 1
+                report(line_no, None, e.detail)
+                continue
+            except (ValueError, ValidationError) as e:
+                invalid += 1
+                report(line_no, None, str(e))
+                continue
+            doc_ref = db.collection(collection).document(doc_id)
+            chunk.append((line_no, kind, doc_ref, doc_data))
+            if len(chunk) >= chunk_size:
+                line_of = {item[2].path: item[0] for item in chunk}
+                await run_blocking(_bulk_write_chunk, writer, chunk, failed)
+                chunk = []
+        if chunk:
+            line_of = {item[2].path: item[0] for item in chunk}
+            await run_blocking(_bulk_write_chunk, writer, chunk, failed)
+    finally:
+        await run_blocking(writer.close)
+
+    logger.info("schedules_imported", received=received, invalid=invalid, write_failures=len(failed))
+    return {
+        "received": received,
+        "written": received - invalid - len(failed),
+        "failed": invalid + len(failed),
+        "errors": errors,
+        "errors_truncated": len(errors) >= max_errors,
+    }
+
+# Collections readable through the export API, with the query parameters
+# each one can be filtered on and the document field they map to.
+EXPORTS = {
+    "vm-schedules": (vm_schedule_collection_name, {"project_id": "project_id", "zone": "zone"}),
+    "nodepool-schedules": (nodepool_schedule_collection_name, {"project_id": "project_id", "zone": "zone", "cluster_id": "cluster_id"}),
+    "tasks": ("tasks", {"task_id": "TaskID"}),
+    "task-approvals": ("taskApproval", {"task_id": "TaskID", "approver_email": "ApproverEmail"}),
+}
+
+def _export_page(collection: str, filters: dict, fields, page_size: int, cursor):
+    """Read one page of a collection, ordered by document id, after `cursor`."""
+    from google.cloud.firestore_v1.base_query import FieldFilter
+    with clients.limited("firestore", "run_query") as db:
+        query = db.collection(collection)
+        for field, value in filters.items():
+            query = query.where(filter=FieldFilter(field, "==", value))
+        if fields:
+            query = query.select(fields)
+        query = query.order_by("__name__").limit(page_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        docs = list(query.stream())
+    metrics.count_firestore("read", collection, len(docs))
+    return docs
+
+@metrics.instrument
+async def export_documents(name: str, filters: dict, fields=None, page_size: int = 500):
+    """
+    Stream a collection as NDJSON using cursor pagination. Only one page is
+    held in memory at a time, and the first page is sent as soon as it is read.
+    """
+    collection, allowed = EXPORTS[name]
+    unknown = set(filters) - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unsupported filters for {name}: {sorted(unknown)}")
+    field_filters = {allowed[param]: value for param, value in filters.items()}
+    logger.info("export_started", collection=collection, filters=field_filters)
+
+    async def stream():
+        cursor = None
+        while True:
+            page = await run_blocking(_export_page, collection, field_filters, fields, page_size, cursor)
+            for doc in page:
+                yield dumps_line({"id": doc.id, **doc.to_dict()})
+            if len(page) < page_size:
+                return
+            cursor = page[-1]
+
+    return stream()
+
+@metrics.instrument
 def delete_nodepool_tag(tag: dataclass.NodePoolDelete):
     """Delete a node pool size tag from Firestore."""
-    collection_name = "gke-nodepool-scheduler"
-    logger.info(f"Deleting nodepool size tag in collection: {collection_name}")
+    collection_name = nodepool_schedule_collection_name
     try:
         doc_id = get_nodepool_doc_id(tag)
-        doc_ref = firestore_db.collection(collection_name).document(doc_id)
-        doc_ref.delete()
-        logger.info(f"Deleted nodepool size tag with doc_id: {doc_id}")
+        with clients.limited("firestore", "delete") as db:
+            db.collection(collection_name).document(doc_id).delete()
+        metrics.count_firestore("delete", collection_name)
+        logger.info("nodepool_schedule_deleted", collection=collection_name, document_id=doc_id)
+        _notify_schedule_change("nodepool", doc_id, None)
         return {"message": f"Node pool size tag deleted for {tag.nodepool_id}", "document_id": doc_id}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error deleting nodepool size tag: {e}")
+        logger.error("nodepool_schedule_delete_failed", nodepool_id=tag.nodepool_id, error=e)
         raise HTTPException(status_code=500, detail=f"Error deleting nodepool size tag: {str(e)}")
     
+@metrics.instrument
 def delete_vm_schedule(tag: dataclass.VMScheduleDelete):
     """Delete a node pool size tag from Firestore."""
-    logger.info(f"Deleting nodepool size tag in collection: {vm_schedule_collection_name}")
     try:
         doc_id = get_vm_doc_id(tag.project_id, tag.instance_name)
-        doc_ref = firestore_db.collection(vm_schedule_collection_name).document(doc_id)
-        doc_ref.delete()
-        logger.info(f"Deleted VM schedule with doc_id: {doc_id}")
+        with clients.limited("firestore", "delete") as db:
+            db.collection(vm_schedule_collection_name).document(doc_id).delete()
+        metrics.count_firestore("delete", vm_schedule_collection_name)
+        logger.info("vm_schedule_deleted", collection=vm_schedule_collection_name, document_id=doc_id)
+        _notify_schedule_change("vm", doc_id, None)
         return {"message": f"VM Schedule deleted for {tag.instance_name}", "document_id": doc_id}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error deleting nodepool size tag: {e}")
+        logger.error("vm_schedule_delete_failed", instance_name=tag.instance_name, error=e)
         raise HTTPException(status_code=500, detail=f"Error deleting nodepool size tag: {str(e)}")
     
+def get_approval_doc_id(task_id: str, approver_email: str) -> str:
+    """Generate Firestore document ID for a task approval."""
+    return f"{task_id}-{approver_email.lower()}"
+
+# Firestore allows at most 500 writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+@metrics.instrument
 def task_store_db(payload: dataclass.TaskPayload):
-    """Store task payload in Firestore."""
+    """
+    Store task payload in Firestore.
+    The task and its approvals are written in one WriteBatch (chunked for very
+    large approver lists, with the task document in the last chunk so it only
+    appears once all approvals exist). Approval IDs are deterministic, so a
+    retried message overwrites instead of duplicating.
+    """
     task_collection_name = "tasks"
     apporval_collection_name = "taskApproval"
-    logger.info(f"Storing task data in collection: {task_collection_name}")
     try:
-        # 1. Write to "Tasks" collection
-        task_doc = {
-            "TaskID": payload.task_id,
-            "TaskName": payload.task_name,
-            "Parameters": payload.parameters,
-            "Status": "Pending Approval"
-        }
-        firestore_db.collection(task_collection_name).document(payload.task_id).set(task_doc)
-        # 2. Write to "TaskApproval" collection (one per approver)
-        logger.info(f"Storing task approval data in collection: {apporval_collection_name}")
+        db = clients.get("firestore")
+        approvals = {}
+        # 1. Write to "TaskApproval" collection (one per approver)
         for approver in payload.approvers:
             approval_doc = {
                 "TaskID": payload.task_id,
@@ -295,42 +878,127 @@ def task_store_db(payload: dataclass.TaskPayload):
                 "ApproverEmail": approver.email,
                 "Status": "Pending"
             }
-            firestore_db.collection(apporval_collection_name).add(approval_doc)
+            approvals[get_approval_doc_id(payload.task_id, approver.email)] = approval_doc
+        writes = [
+            (db.collection(apporval_collection_name).document(doc_id), approval_doc)
+            for doc_id, approval_doc in approvals.items()
+        ]
+        # 2. Write to "Tasks" collection, with counters kept up to date by task_approve
+        task_doc = {
+            "TaskID": payload.task_id,
+            "TaskName": payload.task_name,
+            "Parameters": payload.parameters,
+            "Status": "Pending Approval",
+            "ApproverCount": len(approvals),
+            "PendingCount": len(approvals),
+            "ApprovedCount": 0,
+            "RejectedCount": 0
+        }
+        writes.append((db.collection(task_collection_name).document(payload.task_id), task_doc))
+
+        logger.info("task_storing", task_id=payload.task_id, approvals=len(approvals))
+        for i in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            with clients.limited("firestore", "batch_commit"):
+                batch = db.batch()
+                for doc_ref, doc in writes[i:i + FIRESTORE_BATCH_LIMIT]:
+                    batch.set(doc_ref, doc)
+                batch.commit()
+        metrics.count_firestore("write", apporval_collection_name, len(approvals))
+        metrics.count_firestore("write", task_collection_name)
 
         return {"message": "Task and approvals stored successfully."}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error storing task: {str(e)}")
     
+# Task document counter field for each approval status
+APPROVAL_COUNTERS = {"pending": "PendingCount", "approved": "ApprovedCount", "rejected": "RejectedCount"}
+
+@metrics.instrument
 def task_approve(payload: dataclass.TaskApprovals):
-    """Store task payload in Firestore."""
+    """
+    Record an approval and update the task's approval counters.
+    The approval document and the task counters are read and written in one
+    Firestore transaction, so completion is known from a single read and
+    concurrent approvals cannot race.
+    """
+    from google.cloud import firestore
+
     if payload.action not in {"approved", "rejected"}:
             raise HTTPException(status_code=400, detail="Invalid action")
     status = "Approved" if payload.action == "approved" else "Rejected"
     collection_name= "taskApproval"
     task_col = "tasks"
+
+    @firestore.transactional
+    def apply(transaction, approval_ref, task_ref):
+        approval = approval_ref.get(transaction=transaction)
+        task = task_ref.get(transaction=transaction)
+        if not approval.exists:
+            return None
+        if not task.exists:
+            raise HTTPException(status_code=404, detail="No matching task found")
+        task_data = task.to_dict()
+        previous = approval.get("Status").lower()
+        if previous == payload.action:
+            return task_data.get("Status")
+
+        updates = {
+            APPROVAL_COUNTERS[previous]: task_data.get(APPROVAL_COUNTERS[previous], 0) - 1,
+            APPROVAL_COUNTERS[payload.action]: task_data.get(APPROVAL_COUNTERS[payload.action], 0) + 1,
+        }
+        if payload.action == "approved" and updates["ApprovedCount"] == task_data.get("ApproverCount"):
+            # Step 3: Update the tasks collection with Status = "Approved"
+            updates["Status"] = "Approved"
+        transaction.update(approval_ref, {"Status": status})
+        transaction.update(task_ref, updates)
+        return updates.get("Status", task_data.get("Status"))
+
     try:
-        approvals_ref = firestore_db.collection(collection_name)
+        with clients.limited("firestore", "transaction") as db:
+            approval_ref = db.collection(collection_name).document(get_approval_doc_id(payload.task_id, payload.approver_email))
+            task_ref = db.collection(task_col).document(payload.task_id)
+            logger.info("task_approval_updating", approval_id=approval_ref.id, status=status)
+            task_status = apply(db.transaction(), approval_ref, task_ref)
+        metrics.count_firestore("read", collection_name)
+        metrics.count_firestore("read", task_col)
+        if task_status is not None:
+            metrics.count_firestore("write", collection_name)
+            metrics.count_firestore("write", task_col)
+        if task_status is None:
+            # Tasks stored before approvals had deterministic ids
+            return _task_approve_by_query(payload, status)
+        if task_status == "Approved":
+            logger.info("task_approved", task_id=payload.task_id)
+        return {"message": f"Task approval updated to {status} for task {payload.task_id} by {payload.approver_email}"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("task_approval_failed", task_id=payload.task_id, error=e)
+        raise HTTPException(status_code=500, detail=f"Error updating task approval: {str(e)}")
+
+def _task_approve_by_query(payload: dataclass.TaskApprovals, status: str):
+    """Approve a task whose approval documents have auto-generated ids."""
+    collection_name= "taskApproval"
+    task_col = "tasks"
+    with clients.limited("firestore", "query_update") as db:
+        approvals_ref = db.collection(collection_name)
         query = approvals_ref.where("TaskID", "==", payload.task_id).where("ApproverEmail", "==", payload.approver_email)
-        docs = query.stream()
-        matched = False
+        docs = list(query.stream())
         for doc in docs:
-            matched = True
-            logger.info(f"Updating doc {doc.id} with status: {status}")
+            logger.info("task_approval_updating", approval_id=doc.id, status=status)
             doc.reference.update({"Status": status})
-        if not matched:
-            raise HTTPException(status_code=404, detail="No matching task approval found")
-        if payload.action == "approved":
-            all_docs = approvals_ref.where("TaskID", "==", payload.task_id).stream()
+    if not docs:
+        raise HTTPException(status_code=404, detail="No matching task approval found")
+    if payload.action == "approved":
+        with clients.limited("firestore", "query_update") as db:
+            all_docs = db.collection(collection_name).where("TaskID", "==", payload.task_id).stream()
             statuses = [doc.to_dict().get("Status", "").lower() for doc in all_docs]
-            logger.info(f"Statuses for task {payload.task_id}: {statuses}")
+            logger.info("task_approval_statuses", task_id=payload.task_id, statuses=statuses)
             if statuses and all(s == "approved" for s in statuses):
-                # Step 3: Update the tasks collection with Status = "Approved"
-                task_doc_ref = firestore_db.collection(task_col).document(payload.task_id)
-                task_doc_ref.update({"Status": "Approved"})
-                logger.info(f"All approvals done. Task {payload.task_id} marked as Approved in tasks collection")
-        return {"message": f"Task approval updated to {status} for task {payload.task_id} by {payload.approver_email}"}
-    
-    except Exception as e:
-        logger.error(f"Error updating task approval: {e}")
-        raise HTTPException(status_code=500, detail=f"Error updating task approval: {str(e)}")
\ No newline at end of file
+                db.collection(task_col).document(payload.task_id).update({"Status": "Approved"})
+                logger.info("task_approved", task_id=payload.task_id)
+    return {"message": f"Task approval updated to {status} for task {payload.task_id} by {payload.approver_email}"}
@@ -0,0 +1,361 @@
+import asyncio
+import datetime
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+
+import structlog
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from app.utils import clients, metrics
+from app.utils.config_loader import load_config
+from app.utils.executor import run_blocking
+from app.utils.retry import backoff_delays
+
+logger = structlog.get_logger()
+
+# Jobs in these states are not finished; once their lease has expired any
+# instance may take them over.
+UNFINISHED = ("queued", "running", "retrying", "interrupted")
+
+
+def _utcnow() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def is_transient(error: Exception) -> bool:
+    """Rate limits, server errors and unexpected exceptions are worth retrying."""
+    if isinstance(error, HTTPException):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+class JobQueue:
+    """
+    Run long gcp.py operations (node pool resizes, maintenance windows) in the
+    background so their Pub/Sub push is answered with 202 in milliseconds
+    instead of outlasting the ack deadline and being redelivered.
+
+    A job's id is the Pub/Sub messageId. Its record, including the route and
+    payload, is created in the `collection` Firestore collection before the
+    202 is returned; creation fails if the document exists, so a redelivered
+    message, on this or any other instance, gets the existing job instead of
+    running it again. `workers` jobs run at once; at most `max_queued` wait,
+    beyond which messages are answered with 429 for Pub/Sub to retry later.
+
+    The message is acked before the work runs, so the job record is what
+    makes it durable:
+    - each unfinished job carries an `owner` and a `lease_expires` that its
+      instance renews every lease/3 seconds;
+    - at startup and every `lease` seconds, unfinished jobs whose lease has
+      expired (their instance died, or stopped and released them) are
+      claimed in a transaction and run here;
+    - transient failures (429, 5xx, unexpected errors) are retried with
+      backoff, up to `max_attempts` runs in total.
+
+    `runner(path, payload, job_id)` runs a job from its stored route and
+    payload.
+    """
+
+    def __init__(self, runner, workers: int = 4, max_queued: int = 1000, collection: str = "jobs",
+                 history: int = 10000, lease: float = 60.0, max_attempts: int = 5):
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.collection = collection
+        self.history = history
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        self.stats = {"submitted": 0, "duplicates": 0, "succeeded": 0, "failed": 0, "rejected": 0,
+                      "retried": 0, "reclaimed": 0}
+
+    # --- Firestore ---------------------------------------------------------
+
+    def _create(self, job: dict):
+        """Create the job document; returns the stored job if it already exists."""
+        from google.api_core import exceptions
+        with clients.limited("firestore", "create") as db:
+            document = db.collection(self.collection).document(job["job_id"])
+            try:
+                document.create(job)
+            except exceptions.Conflict:
+                metrics.count_firestore("read", self.collection)
+                return document.get().to_dict()
+        metrics.count_firestore("write", self.collection)
+        return None
+
+    def _read(self, job_id: str):
+        with clients.limited("firestore", "get") as db:
+            snapshot = db.collection(self.collection).document(job_id).get()
+        metrics.count_firestore("read", self.collection)
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def _update(self, job_id: str, fields: dict):
+        with clients.limited("firestore", "update") as db:
+            db.collection(self.collection).document(job_id).update(fields)
+        metrics.count_firestore("write", self.collection)
+
+    def _renew(self, job_ids, lease_expires: float):
+        with clients.limited("firestore", "batch_commit") as db:
+            batch = db.batch()
+            for job_id in job_ids:
+                batch.update(db.collection(self.collection).document(job_id), {"lease_expires": lease_expires})
+            batch.commit()
+        metrics.count_firestore("write", self.collection, len(job_ids))
+
+    def _expired(self) -> list:
+        """Ids of unfinished jobs whose lease has run out."""
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        now = time.time()
+        with clients.limited("firestore", "run_query") as db:
+            query = db.collection(self.collection).where(filter=FieldFilter("status", "in", list(UNFINISHED)))
+            docs = list(query.select(["lease_expires"]).stream())
+        metrics.count_firestore("read", self.collection, len(docs))
+        return [doc.id for doc in docs if (doc.to_dict().get("lease_expires") or 0) < now]
+
+    def _claim(self, job_id: str):
+        """Take over an expired job in a transaction; None if another instance got it first."""
+        from google.cloud import firestore
+
+        @firestore.transactional
+        def claim(transaction, ref):
+            snapshot = ref.get(transaction=transaction)
+            job = snapshot.to_dict() if snapshot.exists else None
+            if job is None or job["status"] not in UNFINISHED or (job.get("lease_expires") or 0) >= time.time():
+                return None
+            fields = {"status": "queued", "owner": self.owner, "lease_expires": time.time() + self.lease}
+            transaction.update(ref, fields)
+            return {**job, **fields}
+
+        with clients.limited("firestore", "transaction") as db:
+            job = claim(db.transaction(), db.collection(self.collection).document(job_id))
+        metrics.count_firestore("read", self.collection)
+        if job is not None:
+            metrics.count_firestore("write", self.collection)
+        return job
+
+    # --- Submitting and reading ---------------------------------------------
+
+    async def submit(self, job_id, path: str, payload) -> dict:
+        """
+        Record a job for `path` with `payload` and queue it; returns the job
+        record. An existing job with that id is returned as is.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self.stats["duplicates"] += 1
+            return dict(job)
+        if self._queue is None:
+            self._start()
+        if self._queue.full():
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": "30"})
+
+        job = {
+            "job_id": job_id,
+            "path": path,
+            "status": "queued",
+            "payload": jsonable_encoder(payload),
+            "owner": self.owner,
+            "lease_expires": time.time() + self.lease,
+            "attempts": 0,
+            "created_on": _utcnow(),
+            "started_on": None,
+            "finished_on": None,
+            "next_attempt_on": None,
+            "result": None,
+            "error": None,
+        }
+        existing = await run_blocking(self._create, job)
+        if existing is not None:
+            self.stats["duplicates"] += 1
+            logger.info("job_duplicate", job_id=job_id, path=path, status=existing.get("status"))
+            return existing
+        self._remember(job)
+        self._queue.put_nowait(job)
+        self.stats["submitted"] += 1
+        logger.info("job_queued", job_id=job_id, path=path, queued=self._queue.qsize())
+        return dict(job)
+
+    def _remember(self, job: dict):
+        self._jobs[job["job_id"]] = job
+        self._jobs.move_to_end(job["job_id"])
+        while len(self._jobs) > self.history:
+            self._jobs.popitem(last=False)
+
+    async def get(self, job_id: str):
+        """Return the job record from this instance or Firestore, or None if unknown."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+        return await run_blocking(self._read, job_id)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "owner": self.owner,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": sum(1 for job in self._jobs.values() if job["status"] == "running"),
+            "retrying": sum(1 for job in self._jobs.values() if job["status"] == "retrying"),
+        }
+
+    # --- Running --------------------------------------------------------------
+
+    async def start(self):
+        """Start the workers and the lease loop, and take over expired jobs."""
+        if self._queue is None:
+            self._start()
+
+    def _start(self):
+        self._queue = asyncio.Queue(self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict):
+        job["attempts"] = job.get("attempts", 0) + 1
+        job.update(status="running", started_on=_utcnow(), next_attempt_on=None)
+        await self._persist(job, "status", "started_on", "attempts", "next_attempt_on")
+        try:
+            result = await self.runner(job["path"], job["payload"], job["job_id"])
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                job["error"] = {"status_code": e.status_code, "detail": e.detail}
+            else:
+                job["error"] = {"status_code": 500, "detail": str(e)}
+            if is_transient(e) and job["attempts"] < self.max_attempts:
+                await self._retry(job, e)
+                return
+            job["status"] = "failed"
+            self.stats["failed"] += 1
+        else:
+            job.update(status="succeeded", result=jsonable_encoder(result), error=None)
+            self.stats["succeeded"] += 1
+        job["finished_on"] = _utcnow()
+        logger.info("job_finished", job_id=job["job_id"], path=job["path"], status=job["status"],
+                    attempts=job["attempts"])
+        await self._persist(job, "status", "finished_on", "result", "error")
+
+    async def _retry(self, job: dict, error: Exception):
+        delays = backoff_delays(initial=5.0, maximum=300.0)
+        for _ in range(job["attempts"]):
+            delay = next(delays)
+        retry_after = getattr(error, "retry_after", 0) or 0
+        delay = max(delay, retry_after)
+        job.update(status="retrying", next_attempt_on=(
+            datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay)
+        ).isoformat())
+        self.stats["retried"] += 1
+        logger.warning("job_retrying", job_id=job["job_id"], path=job["path"], attempts=job["attempts"],
+                       delay=round(delay, 1), error=job["error"])
+        await self._persist(job, "status", "next_attempt_on", "error")
+        asyncio.get_running_loop().call_later(delay, self._requeue, job)
+
+    def _requeue(self, job: dict):
+        if job["status"] != "retrying":
+            return
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            # Try again shortly; the lease keeps the job ours meanwhile
+            asyncio.get_running_loop().call_later(5.0, self._requeue, job)
+
+    async def _maintain(self):
+        """Renew the leases of our unfinished jobs and take over expired ones."""
+        last_reclaim = 0.0
+        while True:
+            try:
+                owned = [job_id for job_id, job in self._jobs.items() if job["status"] in UNFINISHED]
+                if owned:
+                    expires = time.time() + self.lease
+                    await run_blocking(self._renew, owned, expires)
+                    for job_id in owned:
+                        self._jobs[job_id]["lease_expires"] = expires
+                if time.monotonic() - last_reclaim >= self.lease:
+                    last_reclaim = time.monotonic()
+                    await self._reclaim()
+            except Exception as e:
+                logger.error("job_lease_failed", error=e)
+            await asyncio.sleep(self.lease / 3)
+
+    async def _reclaim(self):
+        for job_id in await run_blocking(self._expired):
+            if self._queue.full():
+                return
+            job = await run_blocking(self._claim, job_id)
+            if job is None:
+                continue
+            self._remember(job)
+            self._queue.put_nowait(job)
+            self.stats["reclaimed"] += 1
+            logger.warning("job_reclaimed", job_id=job_id, path=job["path"], attempts=job.get("attempts", 0))
+
+    async def _persist(self, job: dict, *fields):
+        try:
+            await run_blocking(self._update, job["job_id"], {field: job[field] for field in fields})
+        except Exception as e:
+            # The in-memory record stays current; GET /jobs/{id} on this instance is still right
+            logger.error("job_persist_failed", job_id=job["job_id"], error=e)
+
+    async def stop(self):
+        """
+        Stop the workers. Unfinished jobs are recorded as interrupted with
+        their lease released, so another instance takes them over at once.
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        unfinished = [job for job in self._jobs.values() if job["status"] in UNFINISHED]
+        for job in unfinished:
+            job.update(status="interrupted", lease_expires=0)
+            await self._persist(job, "status", "lease_expires")
+        if unfinished:
+            logger.warning("jobs_interrupted", count=len(unfinished))
+
+
+async def _run_route(path: str, payload: dict, job_id: str):
+    # Imported here: app.pubsub imports this module
+    import app.pubsub as pubsub
+    route = pubsub.ROUTES[path]
+    return await pubsub.run_handler(route, route.adapter.validate_python(payload), job_id)
+
+
+_queue = None
+
+
+def get_queue() -> JobQueue:
+    """Return the process-wide job queue configured from the environment."""
+    global _queue
+    if _queue is None:
+        load_config()
+        _queue = JobQueue(
+            runner=_run_route,
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", "1000")),
+            collection=os.getenv("JOBS_COLLECTION", "jobs"),
+            history=int(os.getenv("JOB_HISTORY", "10000")),
+            lease=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+            max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "5")),
+        )
+    return _queue
+
+
+def enabled() -> bool:
+    load_config()
+    return os.getenv("JOBS_ENABLED", "false").lower() == "true"
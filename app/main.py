@@ -1,14 +1,27 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Literal
-import json
-import base64
+from typing import Literal, Optional
+import datetime
 import structlog
 import app.gcp as gcp
+import app.jobs as jobs
 import app.dataclass as dataclass
-
+import app.pubsub as pubsub
+import app.scheduler as scheduler
+import app.schedule_index as schedule_index
+import app.subscriber as subscriber
+from app.operations import get_tracker
+from app.utils import clients, log, metrics
+from app.utils.limits import get_limiter
+from app.utils.dedup import get_cache
+from app.utils.executor import run_blocking, shutdown_executor
+from app.utils.ndjson import iter_lines
+
+log.configure()
 logger = structlog.get_logger()
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,217 +31,155 @@ app.add_middleware(
     allow_headers=["*"],  # <- Allow all headers
 )
 
-@app.post("/vm-worker")
-async def vm_handler(request: Request):
-    ### Handle incoming Pub/Sub messages for VM operations
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        try:
-            payload = dataclass.VMOperationPayload(**payload_dict)
-            operation = gcp.perform_vm_operation(
-                project_id=payload.project_id,
-                zone=payload.zone,
-                instance_name=payload.vm_name,
-                action=payload.action
-            )
-            logger.info(f"Requested VM operation '{payload.action}' for '{payload.vm_name}'")
-            return {"status": "VM operation initiated"}
-
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
-    except HTTPException as http_exc:
-        raise http_exc
+@app.on_event("startup")
+async def startup():
+    # Clients are built lazily; optionally pre-build them off the request path
+    clients.start_background_warmup()
+    metrics.setup_otlp()
+    if schedule_index.enabled():
+        # NumPy is only imported when the schedule index is in use
+        from app.fleet import get_fleet
+        get_fleet().attach(schedule_index.get_index())
+        await run_blocking(schedule_index.get_index().start)
+    if scheduler.enabled():
+        await scheduler.get_scheduler().start()
+    if jobs.enabled():
+        # Also takes over jobs left unfinished by instances that stopped or died
+        await jobs.get_queue().start()
+    if subscriber.enabled():
+        # Pull mode; the HTTP routes stay up for stats, metrics and health checks
+        await subscriber.get_subscriber().start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if subscriber.enabled():
+        await subscriber.get_subscriber().stop()
+    if scheduler.enabled():
+        await scheduler.get_scheduler().stop()
+    if jobs.enabled():
+        await jobs.get_queue().stop()
+    await get_tracker().stop()
+    shutdown_executor()
+
+def pubsub_endpoint(route: pubsub.Route):
+    ### Handle incoming Pub/Sub push messages for one registered route
+    async def endpoint(request: Request):
+        message = pubsub.decode_envelope(await request.body())
+        return await pubsub.dispatch(route, message)
+    return endpoint
+
+for path, route in pubsub.ROUTES.items():
+    app.add_api_route(path, pubsub_endpoint(route), methods=["POST"])
+
+@app.post("/pubsub")
+async def pubsub_handler(request: Request):
+    ### Single push endpoint; the route is picked from the message `type`
+    message = pubsub.decode_envelope(await request.body())
+    return await pubsub.dispatch(pubsub.resolve_route(message), message)
+
+@app.get("/dedup/stats")
+async def dedup_stats():
+    ### Hit/miss counters of the messageId deduplication cache
+    return get_cache().snapshot()
+
+@app.get("/subscriber/stats")
+async def subscriber_stats():
+    ### Messages received, acked and nacked by the streaming-pull subscriber (RUN_MODE=pull)
+    if not subscriber.enabled():
+        raise HTTPException(status_code=503, detail="Streaming pull is not enabled")
+    return subscriber.get_subscriber().snapshot()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    ### Prometheus metrics for endpoints, gcp.py handlers, GCP calls and Firestore
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/limits")
+async def limits():
+    ### Rate limiter buckets and circuit breaker states per API and project
+    return get_limiter().snapshot()
+
+@app.get("/operations/stats")
+async def operation_stats():
+    ### In-flight VM operations and per project/zone poll intervals
+    return get_tracker().snapshot()
+
+@app.get("/operations/{message_id}")
+async def operation_status(message_id: str):
+    ### Completion status of the VM operations started by a Pub/Sub message
+    operations = get_tracker().get(message_id)
+    if operations is None:
+        raise HTTPException(status_code=404, detail=f"No operations tracked for message {message_id}")
+    return {"message_id": message_id, "operations": operations}
+
+@app.get("/jobs/stats")
+async def job_stats():
+    ### Background job counters, queue depth and running jobs on this instance
+    return jobs.get_queue().snapshot()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    ### State and result of a background job; the job id is the Pub/Sub messageId
+    job = await jobs.get_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job
+
+@app.post("/schedules/import")
+async def import_schedules(request: Request):
+    ### Bulk import of ScheduleTag / NodePoolSizeTag records as an NDJSON body
+    return await gcp.import_schedules(iter_lines(request.stream()))
+
+@app.get("/export/{name}")
+async def export(
+    name: Literal["vm-schedules", "nodepool-schedules", "tasks", "task-approvals"],
+    request: Request,
+    fields: Optional[str] = None,
+    page_size: int = Query(500, ge=1, le=1000),
+):
+    ### Stream stored schedules, tasks or approvals as NDJSON; other query params are equality filters
+    filters = {k: v for k, v in request.query_params.items() if k not in ("fields", "page_size")}
+    field_list = [f for f in fields.split(",") if f] if fields else None
+    stream = await gcp.export_documents(name, filters, field_list, page_size)
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+@app.get("/schedules/desired-state")
+async def desired_state(at: Optional[datetime.datetime] = None):
+    ### Business-hours state of every scheduled VM and node pool at `at` (default: now)
+    if not schedule_index.enabled():
+        raise HTTPException(status_code=503, detail="Schedule index is not enabled")
+    from app.fleet import get_fleet
+    if at is not None and at.tzinfo is None:
+        at = at.replace(tzinfo=datetime.timezone.utc)
+    state = get_fleet().desired_state(at)
+    in_hours = state.in_hours.tolist()
+    sizes = state.sizes.tolist()
+    return [
+        {"kind": kind, "document_id": doc_id, "business_hours": in_hours[i]}
+        if kind == "vm" else
+        {"kind": kind, "document_id": doc_id, "business_hours": in_hours[i],
+         "min_nodes": sizes[i][0], "max_nodes": sizes[i][1], "desired_node_count": sizes[i][2]}
+        for i, (kind, doc_id) in enumerate(state.keys)
+    ]
 
 @app.post("/vm-worker/debug")
 async def vm_audit_handler(vm_op: dataclass.VMOperationPayload):
     ### Debugging endpoint for VM operations
     try:
         payload_dict = vm_op.dict()
-        logger.info(f"Debugging VM operation: {payload_dict}")
         payload = dataclass.VMOperationPayload(**payload_dict)
-        logger.info(f"Debugging VM operation: {payload.vm_name} with action {payload.action} {payload.zone} {payload.project_id}")
-        operation = gcp.perform_vm_operation(
+        logger.info("debug_vm_operation", vm_name=payload.vm_name, action=payload.action, zone=payload.zone, project_id=payload.project_id)
+        operation = await run_blocking(
+            gcp.perform_vm_operation,
             project_id=payload.project_id,
             zone=payload.zone,
             instance_name=payload.vm_name,
             action=payload.action
         )
-        logger.info(f"Requested VM operation '{operation}'")
+        logger.info("debug_vm_operation_requested", operation=getattr(operation, "name", None))
         # Simulate a successful operation for debugging
         return {"status": "VM operation initiated"}
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        raise HTTPException(status_code=500, detail=str(e)) 
-    
-@app.post("/configure-nodepool")
-async def configure_nodepool(request: Request):
-    ### Handle incoming Pub/Sub messages for GKE node pool configuration
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.NodePoolConfig(**payload_dict)
-        response = gcp.nodepool_setsize(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/nodepool-schedule-tag")
-async def nodepool_schedule_tag(request: Request):
-    ### Handle incoming Pub/Sub messages for GKE node pool scheduling tags
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.NodePoolSizeTag(**payload_dict)
-        response = gcp.store_nodepool_size_tag(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/gke-maintenance-window")
-async def nodepool_schedule_tag(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.MaintenanceWindowRequest(**payload_dict)
-        response = gcp.schedule_maintenance(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/vm-schedule-tag")
-async def vm_schedule_tag(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.ScheduleTag(**payload_dict)
-        response = gcp.store_vm_schedule_tag(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/nodepool-delete-tag")
-async def nodepool_delete_tag(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.NodePoolDelete(**payload_dict)
-        response = gcp.delete_nodepool_tag(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/vm-schedule-delete")
-async def vm_schedule_delete(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.VMScheduleDelete(**payload_dict)
-        response = gcp.delete_vm_schedule(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/task-operations")
-async def task_operations(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.TaskPayload(**payload_dict)
-        response = gcp.task_store_db(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/task-approvals")
-async def task_operations(request: Request):
-    try:
-        envelope = await request.json()
-        if "message" not in envelope or "data" not in envelope["message"]:
-            raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
-
-        # Decode and parse the base64-encoded message
-        message = envelope.get("message", {})
-        message_id = message.get("messageId")
-        payload_data = base64.b64decode(envelope["message"]["data"]).decode("utf-8")
-        logger.info(f"Received message ID: {message_id}, Data: {payload_data}")
-        payload_dict = json.loads(payload_data)
-        payload = dataclass.TaskApprovals(**payload_dict)
-        response = gcp.task_approve(payload)
-        return response
-    except Exception as e:
-        logger.error(f"Error configuring node pool: {e}")
+        logger.error("debug_vm_operation_failed", error=e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,208 @@
+import asyncio
+import datetime
+import os
+import time
+from collections import OrderedDict, defaultdict
+
+import structlog
+
+from app.utils import clients
+from app.utils.executor import run_blocking
+from app.vm_status import get_status_cache
+
+logger = structlog.get_logger()
+
+
+def _utcnow() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class OperationTracker:
+    """
+    Follow compute zone operations started by VM commands until they finish.
+
+    Operations are grouped by (project, zone). Each group is polled with a
+    single ZoneOperationsClient.list call per `batch_size` operations, using a
+    `name eq (op-1|op-2|...)` filter, so thousands of in-flight operations
+    cost a handful of API calls per poll rather than one wait per operation.
+    A group's poll interval starts at `min_interval`, doubles (up to
+    `max_interval`) while nothing in it finishes and drops back once
+    something does.
+
+    Records are kept by Pub/Sub messageId (or operation name when there is
+    no message) for the last `history` messages.
+    """
+
+    def __init__(self, min_interval: float = 2.0, max_interval: float = 30.0, batch_size: int = 50,
+                 timeout: float = 900.0, history: int = 10000):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.history = history
+        self._records = {}
+        self._by_message = OrderedDict()
+        self._pending = defaultdict(dict)
+        self._intervals = {}
+        self._next_poll = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = {"registered": 0, "done": 0, "failed": 0, "timed_out": 0, "list_calls": 0}
+
+    def register(self, message_id, project_id: str, zone: str, vm_name: str, action: str, operation):
+        """
+        Start tracking the operation returned by perform_vm_operation.
+        `action` must be the command that was actually sent (see
+        KeyedExecutor); it decides the status recorded when the operation
+        finishes, so an operation is never tracked under two actions.
+        """
+        name = getattr(operation, "name", None)
+        if not name:
+            return
+        key = (project_id, zone, name)
+        record = self._records.get(key)
+        if record is not None and (record["action"], record["vm_name"]) != (action, vm_name):
+            logger.error("operation_action_mismatch", operation=name, tracked_action=record["action"],
+                         action=action, vm_name=vm_name, message_id=message_id)
+            return
+        if record is None:
+            record = self._records[key] = {
+                "operation": name,
+                "project_id": project_id,
+                "zone": zone,
+                "vm_name": vm_name,
+                "action": action,
+                "status": "RUNNING",
+                "started_at": _utcnow(),
+                "finished_at": None,
+                "duration_seconds": None,
+                "error": None,
+            }
+            group = (project_id, zone)
+            self._pending[group][name] = (record, time.monotonic())
+            self._intervals.setdefault(group, self.min_interval)
+            first_poll = time.monotonic() + self.min_interval
+            self._next_poll[group] = min(self._next_poll.get(group, first_poll), first_poll)
+            self.stats["registered"] += 1
+        self._by_message.setdefault(message_id or name, []).append(key)
+        self._by_message.move_to_end(message_id or name)
+        self._trim()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def get(self, message_id: str):
+        """Return the operation records for a message, or None if unknown."""
+        keys = self._by_message.get(message_id)
+        if keys is None:
+            return None
+        return [dict(self._records[key]) for key in keys if key in self._records]
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": sum(len(ops) for ops in self._pending.values()),
+            "groups": {f"{p}/{z}": self._intervals[(p, z)] for p, z in self._pending},
+        }
+
+    def _trim(self):
+        while len(self._by_message) > self.history:
+            _, keys = self._by_message.popitem(last=False)
+            for key in keys:
+                # Still-running operations keep polling; only the lookup goes
+                self._records.pop(key, None)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [group for group, at in self._next_poll.items() if at <= now]
+            if due:
+                await asyncio.gather(*(self._poll(group) for group in due))
+                continue
+            timeout = min(self._next_poll.values()) - now if self._next_poll else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, group):
+        project_id, zone = group
+        pending = self._pending[group]
+        names = list(pending)
+        finished = 0
+        for i in range(0, len(names), self.batch_size):
+            chunk = names[i:i + self.batch_size]
+            try:
+                operations = await run_blocking(self._list, project_id, zone, chunk)
+            except Exception as e:
+                logger.error("operation_poll_failed", project_id=project_id, zone=zone, error=e)
+                continue
+            for operation in operations:
+                if operation.name in pending and operation.status.name == "DONE":
+                    self._finish(pending.pop(operation.name), operation)
+                    finished += 1
+
+        now = time.monotonic()
+        for name, (record, started) in list(pending.items()):
+            if now - started > self.timeout:
+                logger.error("operation_tracking_timed_out", operation=name, timeout=self.timeout)
+                record.update(status="UNKNOWN", finished_at=_utcnow(), error="Timed out waiting for operation")
+                del pending[name]
+                self.stats["timed_out"] += 1
+
+        if not pending:
+            del self._pending[group], self._intervals[group], self._next_poll[group]
+            return
+        interval = self.min_interval if finished else min(self._intervals[group] * 2, self.max_interval)
+        self._intervals[group] = interval
+        self._next_poll[group] = now + interval
+
+    def _list(self, project_id: str, zone: str, names):
+        from google.cloud import compute_v1
+        self.stats["list_calls"] += 1
+        request = compute_v1.ListZoneOperationsRequest(
+            project=project_id,
+            zone=zone,
+            filter=f"name eq ({'|'.join(names)})",
+            max_results=500,
+        )
+        return list(clients.call("zone_operations", "list", request=request))
+
+    def _finish(self, pending_entry, operation):
+        record, started = pending_entry
+        errors = [e.message for e in operation.error.errors] if operation.error else []
+        record.update(
+            status="FAILED" if errors else "DONE",
+            finished_at=_utcnow(),
+            duration_seconds=round(time.monotonic() - started, 3),
+            error="; ".join(errors) or None,
+        )
+        self.stats["failed" if errors else "done"] += 1
+        if errors:
+            # The optimistic status is wrong; look it up again next time
+            get_status_cache().invalidate(record["project_id"], record["zone"], record["vm_name"])
+        else:
+            get_status_cache().mark_completed(record["project_id"], record["zone"], record["vm_name"], record["action"])
+        logger.info("operation_finished", operation=record["operation"], action=record["action"], vm_name=record["vm_name"], status=record["status"], seconds=record["duration_seconds"])
+
+
+_tracker = None
+
+
+def get_tracker() -> OperationTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = OperationTracker(
+            min_interval=float(os.getenv("OPERATION_POLL_MIN_INTERVAL", "2")),
+            max_interval=float(os.getenv("OPERATION_POLL_MAX_INTERVAL", "30")),
+            batch_size=int(os.getenv("OPERATION_POLL_BATCH", "50")),
+            timeout=float(os.getenv("OPERATION_TRACK_TIMEOUT", "900")),
+            history=int(os.getenv("OPERATION_HISTORY", "10000")),
+        )
+    return _tracker
@@ -0,0 +1,131 @@
+import base64
+import binascii
+import inspect
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+import orjson
+import structlog
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+
+import app.dataclass as dataclass
+import app.gcp as gcp
+import app.jobs as jobs
+from app.utils.dedup import get_cache
+from app.utils.executor import run_blocking
+
+logger = structlog.get_logger()
+
+
+class PubSubMessage(NamedTuple):
+    message_id: Optional[str]
+    data: bytes
+    attributes: Dict[str, str]
+
+
+class Route(NamedTuple):
+    path: str
+    adapter: TypeAdapter
+    handler: Callable[[Any], Any]
+    with_message_id: bool = False
+    background: bool = False
+
+
+# Route path -> payload model and gcp.py handler. The same table backs the
+# per-message-type push endpoints and the single /pubsub endpoint, where the
+# route is picked from a `type` attribute (or payload field) such as
+# "configure-nodepool".
+ROUTES: Dict[str, Route] = {}
+
+
+def register(path: str, model, handler: Callable[[Any], Any], background: bool = False):
+    """
+    Register a Pub/Sub route; the TypeAdapter is built once here, not per request.
+    Handlers that take a `message_id` keyword are passed the Pub/Sub messageId.
+    Background routes run as jobs (app.jobs) and are answered with 202.
+    """
+    ROUTES[path] = Route(
+        path=path,
+        adapter=TypeAdapter(model),
+        handler=handler,
+        with_message_id="message_id" in inspect.signature(handler).parameters,
+        background=background,
+    )
+
+
+register("/vm-worker", dataclass.VMOperationPayload, gcp.vm_operation)
+register("/vm-worker/batch", dataclass.VMOperationBatch, gcp.vm_operation_batch)
+register("/configure-nodepool", dataclass.NodePoolConfig, gcp.nodepool_setsize, background=True)
+register("/nodepool-schedule-tag", dataclass.NodePoolSizeTag, gcp.store_nodepool_size_tag)
+register("/gke-maintenance-window", dataclass.MaintenanceWindowRequest, gcp.schedule_maintenance, background=True)
+register("/gke-maintenance-window/batch", dataclass.MultiClusterMaintenanceWindowRequest, gcp.schedule_maintenance_batch,
+         background=True)
+register("/vm-schedule-tag", dataclass.ScheduleTag, gcp.store_vm_schedule_tag)
+register("/nodepool-delete-tag", dataclass.NodePoolDelete, gcp.delete_nodepool_tag)
+register("/vm-schedule-delete", dataclass.VMScheduleDelete, gcp.delete_vm_schedule)
+register("/task-operations", dataclass.TaskPayload, gcp.task_store_db)
+register("/task-approvals", dataclass.TaskApprovals, gcp.task_approve)
+
+
+def decode_envelope(body: bytes) -> PubSubMessage:
+    """Parse a Pub/Sub push envelope and base64-decode its data."""
+    try:
+        envelope = orjson.loads(body)
+        message = envelope["message"]
+        data = base64.b64decode(message["data"], validate=True)
+    except (orjson.JSONDecodeError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid Pub/Sub message format")
+    return PubSubMessage(
+        message_id=message.get("messageId"),
+        data=data,
+        attributes=message.get("attributes") or {},
+    )
+
+
+def resolve_route(message: PubSubMessage) -> Route:
+    """Pick the route for a message sent to /pubsub from its `type`."""
+    message_type = message.attributes.get("type")
+    if message_type is None:
+        try:
+            message_type = orjson.loads(message.data).get("type")
+        except (orjson.JSONDecodeError, AttributeError):
+            message_type = None
+    route = ROUTES.get(f"/{message_type}") if message_type else None
+    if route is None:
+        raise HTTPException(status_code=400, detail=f"Unknown message type: {message_type}")
+    return route
+
+
+async def run_handler(route: Route, payload, message_id: Optional[str] = None):
+    """Run the route's handler on a validated payload; blocking handlers go to the executor."""
+    kwargs = {"message_id": message_id} if route.with_message_id else {}
+    if inspect.iscoroutinefunction(route.handler):
+        return await route.handler(payload, **kwargs)
+    return await run_blocking(route.handler, payload, **kwargs)
+
+
+async def dispatch(route: Route, message: PubSubMessage):
+    """Validate the message payload and run the route's handler."""
+    logger.info("message_received", message_id=message.message_id, path=route.path, size=len(message.data))
+    try:
+        # Validate straight from the JSON bytes; no intermediate dict
+        payload = route.adapter.validate_json(message.data)
+    except ValidationError as e:
+        logger.error("message_invalid", message_id=message.message_id, path=route.path, errors=e.error_count())
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+    if route.background and jobs.enabled():
+        # The job id is the messageId, so redeliveries return the same job
+        job = await jobs.get_queue().submit(message.message_id, route.path, payload)
+        return JSONResponse(status_code=202, content={
+            "status": "Job accepted", "job_id": job["job_id"], "job_status": job["status"],
+        })
+
+    try:
+        return await get_cache().run(message.message_id, lambda: run_handler(route, payload, message.message_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("message_failed", message_id=message.message_id, path=route.path, error=e)
+        raise HTTPException(status_code=500, detail=str(e))
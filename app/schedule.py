@@ -0,0 +1,113 @@
+import datetime
+from typing import NamedTuple, Optional, Tuple
+
+import pytz
+
+# Short timezone names used in business_hours documents, mapped to IANA zones.
+# Anything not listed here is passed to pytz as-is (e.g. "Asia/Singapore").
+TIMEZONES = {
+    "sgt": "Asia/Singapore",
+    "hkt": "Asia/Hong_Kong",
+    "jst": "Asia/Tokyo",
+    "ist": "Asia/Kolkata",
+    "aest": "Australia/Sydney",
+    "utc": "UTC",
+    "gmt": "Europe/London",
+    "cet": "Europe/Paris",
+    "est": "America/New_York",
+    "cst": "America/Chicago",
+    "pst": "America/Los_Angeles",
+}
+
+
+class BusinessHours(NamedTuple):
+    days: frozenset  # ISO weekdays, 1=Monday .. 7=Sunday
+    start: datetime.time
+    end: datetime.time
+    tz: datetime.tzinfo
+
+
+def parse_time(value: str) -> datetime.time:
+    """Parse "HH:MM" or "HH:MM:SS"."""
+    parts = [int(p) for p in value.split(":")]
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid time: {value}")
+    return datetime.time(*parts)
+
+
+def get_timezone(name: str) -> datetime.tzinfo:
+    try:
+        return pytz.timezone(TIMEZONES.get(name.lower(), name))
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+def parse_business_hours(business_hours: dict) -> BusinessHours:
+    """
+    Parse a business_hours dict such as
+    {"days": [1, 2, 3, 4, 5], "starttime": "06:00:00", "endtime": "18:00:00", "timezone": "sgt"}.
+    Days are ISO weekdays (1=Monday); 0 is accepted for Sunday. An endtime
+    before the starttime means the window runs past midnight.
+    """
+    days = frozenset(7 if d == 0 else int(d) for d in business_hours["days"])
+    if not days or not days <= set(range(1, 8)):
+        raise ValueError(f"Invalid days: {business_hours['days']}")
+    start = parse_time(business_hours["starttime"])
+    end = parse_time(business_hours["endtime"])
+    if start == end:
+        raise ValueError("starttime and endtime must differ")
+    return BusinessHours(days, start, end, get_timezone(business_hours.get("timezone") or "utc"))
+
+
+def parse_size_config(value: str) -> Tuple[int, int, int]:
+    """Parse a node pool "min,max,desired" string such as "3,6,4"."""
+    parts = [int(p) for p in value.split(",")]
+    if len(parts) != 3 or min(parts) < 0:
+        raise ValueError(f"Invalid node pool size config: {value}")
+    return parts[0], parts[1], parts[2]
+
+
+def windows(hours: BusinessHours, around: datetime.datetime):
+    """Yield (start, end) UTC datetimes of business-hours windows near `around`."""
+    local_date = around.astimezone(hours.tz).date()
+    for offset in range(-1, 9):
+        day = local_date + datetime.timedelta(days=offset)
+        if day.isoweekday() not in hours.days:
+            continue
+        start = hours.tz.localize(datetime.datetime.combine(day, hours.start))
+        end_day = day if hours.end > hours.start else day + datetime.timedelta(days=1)
+        end = hours.tz.localize(datetime.datetime.combine(end_day, hours.end))
+        yield start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+
+
+def is_business_hours(hours: BusinessHours, at: datetime.datetime) -> bool:
+    return any(start <= at < end for start, end in windows(hours, at))
+
+
+def next_transition(hours: BusinessHours, after: datetime.datetime) -> Optional[Tuple[datetime.datetime, bool]]:
+    """
+    Return the next time after `after` when business hours start or end, and
+    whether they are in effect from that moment on.
+    """
+    current = is_business_hours(hours, after)
+    boundaries = sorted(
+        b for window in windows(hours, after) for b in window if b > after
+    )
+    for boundary in boundaries:
+        state = is_business_hours(hours, boundary)
+        if state != current:
+            return boundary, state
+    return None
+
+
+def schedule_key(hours: BusinessHours) -> tuple:
+    """Hashable identity of a schedule, so identical schedules compile once."""
+    return (tuple(sorted(hours.days)), hours.start, hours.end, str(hours.tz))
+
+
+def week_start(at: datetime.datetime) -> datetime.datetime:
+    """Monday 00:00 UTC of the week containing `at`."""
+    at = at.astimezone(pytz.utc)
+    monday = at.date() - datetime.timedelta(days=at.weekday())
+    return pytz.utc.localize(datetime.datetime.combine(monday, datetime.time()))
+
@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import defaultdict
+
+import structlog
+
+import app.gcp as gcp
+from app.utils import clients
+from app.utils.config_loader import load_config
+
+logger = structlog.get_logger()
+
+COLLECTIONS = {
+    "vm": gcp.vm_schedule_collection_name,
+    "nodepool": gcp.nodepool_schedule_collection_name,
+}
+
+
+class ScheduleIndex:
+    """
+    Local copy of the vm-instance-schedule and gke-nodepool-scheduler
+    collections.
+
+    Documents are keyed by their existing ids (get_vm_doc_id /
+    get_nodepool_doc_id) with secondary indexes by project, zone and timezone.
+    The initial on_snapshot delivery loads each collection once; after that
+    only change events are applied. This instance's own writes and deletes
+    are applied straight away through gcp.schedule_listeners, so reads never
+    have to go back to Firestore.
+
+    Callbacks in `listeners` get (kind, doc_id, doc) for every real change
+    (doc is None on delete). They may run on Firestore's watch thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {kind: {} for kind in COLLECTIONS}
+        self._indexes = {name: defaultdict(set) for name in ("project_id", "zone", "timezone")}
+        self._watches = []
+        self.listeners = []
+
+    @staticmethod
+    def _index_values(doc: dict) -> dict:
+        business_hours = doc.get("business_hours") or {}
+        return {
+            "project_id": doc.get("project_id"),
+            "zone": doc.get("zone"),
+            "timezone": (business_hours.get("timezone") or "").lower() or None,
+        }
+
+    def _unindex(self, kind: str, doc_id: str, doc: dict):
+        for name, value in self._index_values(doc).items():
+            ids = self._indexes[name].get((kind, value))
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._indexes[name][(kind, value)]
+
+    def apply_change(self, kind: str, doc_id: str, doc):
+        """Insert, replace or (doc=None) remove a document and notify listeners."""
+        with self._lock:
+            previous = self._docs[kind].get(doc_id)
+            if previous == doc:
+                return
+            if previous is not None:
+                self._unindex(kind, doc_id, previous)
+            if doc is None:
+                del self._docs[kind][doc_id]
+            else:
+                self._docs[kind][doc_id] = doc
+                for name, value in self._index_values(doc).items():
+                    self._indexes[name][(kind, value)].add(doc_id)
+        for listener in self.listeners:
+            try:
+                listener(kind, doc_id, doc)
+            except Exception as e:
+                logger.error("schedule_index_listener_failed", error=e)
+
+    def get(self, kind: str, doc_id: str):
+        return self._docs[kind].get(doc_id)
+
+    def items(self, kind: str):
+        with self._lock:
+            return list(self._docs[kind].items())
+
+    def find(self, kind: str, project_id: str = None, zone: str = None, timezone: str = None):
+        """Return {doc_id: doc} matching all the given secondary keys."""
+        filters = {"project_id": project_id, "zone": zone, "timezone": timezone.lower() if timezone else None}
+        with self._lock:
+            ids = None
+            for name, value in filters.items():
+                if value is None:
+                    continue
+                matched = self._indexes[name].get((kind, value), set())
+                ids = set(matched) if ids is None else ids & matched
+            if ids is None:
+                ids = self._docs[kind].keys()
+            return {doc_id: self._docs[kind][doc_id] for doc_id in ids}
+
+    def start(self, timeout: float = 120.0):
+        """Start watching both collections and block until the first snapshot of each."""
+        if self._watches:
+            return
+        gcp.schedule_listeners.append(self.apply_change)
+        db = clients.get("firestore")
+        for kind, collection in COLLECTIONS.items():
+            loaded = threading.Event()
+
+            def on_snapshot(docs, changes, read_time, kind=kind, loaded=loaded):
+                for change in changes:
+                    if change.type.name == "REMOVED":
+                        self.apply_change(kind, change.document.id, None)
+                    else:
+                        self.apply_change(kind, change.document.id, change.document.to_dict())
+                loaded.set()
+
+            self._watches.append(db.collection(collection).on_snapshot(on_snapshot))
+            if not loaded.wait(timeout):
+                raise TimeoutError(f"Timed out loading {collection}")
+            logger.info("schedule_index_loaded", collection=collection, documents=len(self._docs[kind]))
+
+    def stop(self):
+        if self.apply_change in gcp.schedule_listeners:
+            gcp.schedule_listeners.remove(self.apply_change)
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+
+_index = None
+
+
+def get_index() -> ScheduleIndex:
+    global _index
+    if _index is None:
+        _index = ScheduleIndex()
+    return _index
+
+
+def enabled() -> bool:
+    """The index runs when asked for directly or when the scheduler needs it."""
+    load_config()
+    return (
+        os.getenv("SCHEDULE_INDEX_ENABLED", "false").lower() == "true"
+        or os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+    )
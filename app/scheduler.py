@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import os
+
+import structlog
+
+import app.dataclass as dataclass
+import app.gcp as gcp
+from app.schedule import is_business_hours, next_transition, parse_business_hours, parse_size_config
+from app.jobs import is_transient
+from app.schedule_index import get_index
+from app.utils import metrics
+from app.utils.config_loader import load_config
+from app.utils.executor import run_blocking
+from app.utils.retry import backoff_delays
+
+logger = structlog.get_logger()
+
+
+class Scheduler:
+    """
+    In-process business-hours scheduler.
+
+    Every VM and node pool schedule gets its next start/end-of-business-hours
+    transition computed and pushed onto a min-heap. The run loop sleeps until
+    the earliest transition is due (or a schedule changes), applies it by
+    calling gcp.vm_operation / gcp.nodepool_setsize directly, and pushes the
+    following transition. On start every schedule is also brought to its
+    current state once, so a transition missed while no scheduler was running
+    is not lost; resources already in that state are skipped by the handlers.
+    At most `reconcile_concurrency` of those run at once. Transitions that
+    fail transiently (429, 5xx) are retried with backoff, up to
+    `max_attempts` tries, as long as the schedule still calls for them.
+    Schedules come from the local ScheduleIndex, which is loaded once and
+    then kept current from Firestore change events.
+
+    Only enable it on one instance (SCHEDULER_ENABLED), or actions run once
+    per instance.
+    """
+
+    def __init__(self, reconcile_concurrency: int = 10, max_attempts: int = 5):
+        self.reconcile_concurrency = reconcile_concurrency
+        self.max_attempts = max_attempts
+        self._heap = []
+        self._entries = {}
+        self._versions = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._loop = None
+        self._task = None
+        self._running = set()
+
+    def upsert(self, kind: str, doc_id: str, doc: dict):
+        """Add or replace a schedule and queue its next transition."""
+        key = (kind, doc_id)
+        try:
+            hours = parse_business_hours(doc["business_hours"])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("schedule_invalid", document_id=doc_id, error=e)
+            self._entries.pop(key, None)
+            return
+        version = next(self._versions)
+        self._entries[key] = {"doc": doc, "hours": hours, "version": version}
+        self._push(key, version, datetime.datetime.now(datetime.timezone.utc))
+        self._wakeup.set()
+
+    def remove(self, kind: str, doc_id: str):
+        # Heap entries for removed schedules are dropped lazily when popped
+        self._entries.pop((kind, doc_id), None)
+
+    def on_schedule_change(self, kind: str, doc_id: str, doc):
+        """ScheduleIndex listener; called from executor or Firestore watch threads."""
+        if self._loop is None:
+            return
+        if doc is None:
+            self._loop.call_soon_threadsafe(self.remove, kind, doc_id)
+        else:
+            self._loop.call_soon_threadsafe(self.upsert, kind, doc_id, doc)
+
+    def _push(self, key, version: int, after: datetime.datetime):
+        transition = next_transition(self._entries[key]["hours"], after)
+        if transition is not None:
+            when, in_hours = transition
+            heapq.heappush(self._heap, (when, version, key, in_hours))
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        index = get_index()
+        index.listeners.append(self.on_schedule_change)
+        await run_blocking(index.start)
+        for kind in ("vm", "nodepool"):
+            for doc_id, doc in index.items(kind):
+                self.upsert(kind, doc_id, doc)
+        logger.info("scheduler_loaded", schedules=len(self._entries))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        semaphore = asyncio.Semaphore(self.reconcile_concurrency)
+        for key, entry in self._entries.items():
+            self._spawn(key, entry["doc"], is_business_hours(entry["hours"], now), semaphore)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        index = get_index()
+        if self.on_schedule_change in index.listeners:
+            index.listeners.remove(self.on_schedule_change)
+        index.stop()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            while self._heap and self._heap[0][0] <= now:
+                when, version, key, in_hours = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is None or entry["version"] != version:
+                    continue
+                self._spawn(key, entry["doc"], in_hours)
+                self._push(key, version, when)
+
+            timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spawn(self, key, doc: dict, in_hours: bool, semaphore: asyncio.Semaphore = None):
+        task = asyncio.create_task(self._apply_with_retry(key, doc, in_hours, semaphore))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    def _still_due(self, key, doc: dict, in_hours: bool) -> bool:
+        """Whether the schedule is unchanged and still calls for this transition."""
+        entry = self._entries.get(key)
+        return (entry is not None and entry["doc"] == doc
+                and is_business_hours(entry["hours"], datetime.datetime.now(datetime.timezone.utc)) == in_hours)
+
+    async def _apply_with_retry(self, key, doc: dict, in_hours: bool, semaphore: asyncio.Semaphore = None):
+        delays = backoff_delays(initial=5.0, maximum=300.0)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if semaphore is None:
+                    await self._apply(key, doc, in_hours)
+                else:
+                    async with semaphore:
+                        await self._apply(key, doc, in_hours)
+                return
+            except Exception as e:
+                # A malformed schedule document will not fix itself
+                permanent = isinstance(e, (KeyError, ValueError)) or not is_transient(e)
+                if permanent or attempt == self.max_attempts:
+                    logger.error("scheduled_transition_failed", document_id=key[1], attempts=attempt, error=e)
+                    return
+                delay = max(next(delays), getattr(e, "retry_after", 0) or 0)
+                logger.warning("scheduled_transition_retrying", document_id=key[1], attempts=attempt,
+                               delay=round(delay, 1), error=e)
+                metrics.RETRIES.labels(operation="scheduled_transition").inc()
+            await asyncio.sleep(delay)
+            if not self._still_due(key, doc, in_hours):
+                logger.info("scheduled_transition_dropped", document_id=key[1], reason="schedule changed")
+                return
+
+    async def _apply(self, key, doc: dict, in_hours: bool):
+        kind, doc_id = key
+        if kind == "vm":
+            action = "start" if in_hours else "stop"
+            logger.info("scheduled_vm_operation", document_id=doc_id, action=action)
+            await gcp.vm_operation(dataclass.VMOperationPayload(
+                vm_name=doc["vm_name"],
+                action=action,
+                zone=doc["zone"],
+                project_id=doc["project_id"],
+            ))
+        else:
+            size_config = doc["business_hours_config"] if in_hours else doc["off_hours_config"]
+            min_nodes, max_nodes, desired = parse_size_config(size_config)
+            logger.info("scheduled_node_pool_resize", document_id=doc_id, size_config=size_config)
+            await gcp.nodepool_setsize(dataclass.NodePoolConfig(
+                project_id=doc["project_id"],
+                zone=doc["zone"],
+                cluster_id=doc["cluster_id"],
+                nodepool_id=doc["nodepool_id"],
+                enable_autoscaling=doc["enable_autoscaling"],
+                min_nodes=min_nodes,
+                max_nodes=max_nodes,
+                desired_node_count=desired,
+            ))
+
+
+_scheduler = None
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        load_config()
+        _scheduler = Scheduler(
+            reconcile_concurrency=int(os.getenv("SCHEDULER_RECONCILE_CONCURRENCY", "10")),
+            max_attempts=int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "5")),
+        )
+    return _scheduler
+
+
+def enabled() -> bool:
+    load_config()
+    return os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
@@ -0,0 +1,165 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import structlog
+from fastapi import HTTPException
+
+import app.pubsub as pubsub
+from app.utils.config_loader import load_config
+
+logger = structlog.get_logger()
+
+
+def parse_subscriptions(spec: str) -> Dict[str, Optional[str]]:
+    """
+    Parse "subscription[=/route],..." into {subscription: route path or None}.
+    Subscriptions without a route pick it per message from its `type`, like
+    the /pubsub push endpoint.
+    """
+    subscriptions = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        subscription, _, path = item.partition("=")
+        path = path.strip() or None
+        if path is not None and path not in pubsub.ROUTES:
+            raise ValueError(f"Unknown route {path} for subscription {subscription}")
+        subscriptions[subscription.strip()] = path
+    return subscriptions
+
+
+class Subscriber:
+    """
+    Streaming-pull alternative to the push endpoints (RUN_MODE=pull).
+
+    Messages from each subscription are handed from the Pub/Sub client's
+    callback threads to the event loop and run through pubsub.dispatch, so
+    they get the same validation, dedup and handlers as push requests. Flow
+    control bounds the messages and bytes outstanding at once. The client
+    keeps extending the ack deadline of a message until it is acked or
+    nacked, up to max_lease_seconds, which covers node pool resizes that run
+    for many minutes without the message being redelivered.
+
+    A message is acked when its handler succeeds or fails with a 4xx that a
+    retry would not fix (invalid payload, unknown type), and nacked for
+    redelivery on 429 and 5xx.
+    """
+
+    def __init__(self, subscriptions: Dict[str, Optional[str]], max_messages: int, max_bytes: int,
+                 max_lease_seconds: int, min_lease_extension_seconds: int, callback_threads: int,
+                 client=None):
+        self.subscriptions = subscriptions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_lease_seconds = max_lease_seconds
+        self.min_lease_extension_seconds = min_lease_extension_seconds
+        self.callback_threads = callback_threads
+        self._client = client
+        self._loop = None
+        self._futures = {}
+        self.stats = {"received": 0, "acked": 0, "nacked": 0, "in_flight": 0}
+
+    def _get_client(self):
+        if self._client is None:
+            from google.cloud import pubsub_v1
+            from app.utils import clients
+            # PUBSUB_EMULATOR_HOST is honoured by the client itself
+            self._client = pubsub_v1.SubscriberClient(credentials=clients.get_credentials())
+        return self._client
+
+    async def start(self):
+        from google.cloud.pubsub_v1 import types
+        from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+        self._loop = asyncio.get_running_loop()
+        client = self._get_client()
+        flow_control = types.FlowControl(
+            max_messages=self.max_messages,
+            max_bytes=self.max_bytes,
+            max_lease_duration=self.max_lease_seconds,
+            min_duration_per_lease_extension=self.min_lease_extension_seconds,
+        )
+        for subscription, path in self.subscriptions.items():
+            # Callbacks only hand the message to the loop, so few threads are needed
+            scheduler = ThreadScheduler(ThreadPoolExecutor(self.callback_threads, thread_name_prefix="pubsub-callback"))
+            self._futures[subscription] = client.subscribe(
+                subscription, self._callback(path), flow_control=flow_control, scheduler=scheduler,
+            )
+            logger.info("subscription_started", subscription=subscription, route=path,
+                        max_messages=self.max_messages, max_bytes=self.max_bytes)
+
+    def _callback(self, path: Optional[str]):
+        def callback(message):
+            future = asyncio.run_coroutine_threadsafe(self._handle(path, message), self._loop)
+            future.add_done_callback(lambda f: self._settle(message, f))
+        return callback
+
+    async def _handle(self, path: Optional[str], message):
+        self.stats["received"] += 1
+        self.stats["in_flight"] += 1
+        try:
+            msg = pubsub.PubSubMessage(
+                message_id=message.message_id,
+                data=message.data,
+                attributes=dict(message.attributes),
+            )
+            route = pubsub.ROUTES[path] if path else pubsub.resolve_route(msg)
+            return await pubsub.dispatch(route, msg)
+        finally:
+            self.stats["in_flight"] -= 1
+
+    def _settle(self, message, future):
+        # Runs on the event loop thread, which completed the future
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled():
+            retry = True
+        elif isinstance(error, HTTPException):
+            retry = error.status_code == 429 or error.status_code >= 500
+        else:
+            retry = error is not None
+        if retry:
+            self.stats["nacked"] += 1
+            logger.warning("message_nacked", message_id=message.message_id, error=error)
+            message.nack()
+        else:
+            self.stats["acked"] += 1
+            if error is not None:
+                logger.warning("message_rejected", message_id=message.message_id, error=error)
+            message.ack()
+
+    def snapshot(self) -> dict:
+        return {"subscriptions": self.subscriptions, **self.stats}
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop pulling; messages not yet acked are redelivered to another instance."""
+        futures, self._futures = self._futures, {}
+        for subscription, future in futures.items():
+            future.cancel()
+            try:
+                await asyncio.wait_for(asyncio.to_thread(future.result), timeout)
+            except Exception as e:
+                logger.warning("subscription_stop_failed", subscription=subscription, error=e)
+
+
+_subscriber = None
+
+
+def get_subscriber() -> Subscriber:
+    """Return the process-wide subscriber configured from the environment."""
+    global _subscriber
+    if _subscriber is None:
+        load_config()
+        _subscriber = Subscriber(
+            subscriptions=parse_subscriptions(os.getenv("PUBSUB_SUBSCRIPTIONS", "")),
+            max_messages=int(os.getenv("PUBSUB_MAX_MESSAGES", "200")),
+            max_bytes=int(os.getenv("PUBSUB_MAX_BYTES", str(50 * 1024 * 1024))),
+            max_lease_seconds=int(os.getenv("PUBSUB_MAX_LEASE_SECONDS", "3600")),
+            min_lease_extension_seconds=int(os.getenv("PUBSUB_MIN_LEASE_EXTENSION_SECONDS", "60")),
+            callback_threads=int(os.getenv("PUBSUB_CALLBACK_THREADS", "4")),
+        )
+    return _subscriber
+
+
+def enabled() -> bool:
+    load_config()
+    return os.getenv("RUN_MODE", "push").lower() == "pull"
@@ -0,0 +1,275 @@
+import contextlib
+import datetime
+import os
+import threading
+import time
+
+import structlog
+
+from app.utils import limits, metrics
+from app.utils.config_loader import load_config
+
+logger = structlog.get_logger()
+
+# Process-wide registry of GCP clients. Each client is built once and shared by
+# every request; building one per message pays for channel setup, TLS and a
+# credential refresh on the hot path.
+#
+# Nothing is built at import time: config, credentials, clients and even the
+# SDK modules are loaded on first use so a cold start only pays for what the
+# first message needs.
+_clients = {}
+# Calls in progress per client (by id), and replaced clients waiting for
+# theirs to finish before they are closed
+_in_flight = {}
+_retired = {}
+_lock = threading.Lock()
+_credentials = None
+_refresh_thread = None
+
+
+def get_credentials():
+    """Return the shared application default credentials."""
+    global _credentials
+    if _credentials is None:
+        with _lock:
+            if _credentials is None:
+                import google.auth
+                load_config()
+                _credentials, _ = google.auth.default()
+                _start_refresh_thread()
+    return _credentials
+
+
+def _build_container(credentials):
+    from google.cloud import container_v1
+    return container_v1.ClusterManagerClient(credentials=credentials)
+
+
+def _build_compute(credentials):
+    from google.cloud import compute_v1
+    return compute_v1.InstancesClient(credentials=credentials)
+
+
+def _build_zone_operations(credentials):
+    from google.cloud import compute_v1
+    return compute_v1.ZoneOperationsClient(credentials=credentials)
+
+
+def _build_instance_group_managers(credentials):
+    from google.cloud import compute_v1
+    return compute_v1.InstanceGroupManagersClient(credentials=credentials)
+
+
+def _build_firestore(credentials):
+    from google.cloud import firestore
+    return firestore.Client(
+        database=os.getenv("FIRESTORE_DB"),
+        project=os.getenv("PROJECT_ID"),
+        credentials=credentials,
+    )
+
+
+_factories = {
+    "container": _build_container,
+    "compute": _build_compute,
+    "zone_operations": _build_zone_operations,
+    "instance_group_managers": _build_instance_group_managers,
+    "firestore": _build_firestore,
+}
+
+
+def get(name: str):
+    """Return the shared client registered under `name`, creating it on first use."""
+    client = _clients.get(name)
+    if client is None:
+        credentials = get_credentials()
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                start = time.perf_counter()
+                client = _factories[name](credentials)
+                _clients[name] = client
+                logger.info("client_created", client=name, ms=round((time.perf_counter() - start) * 1000, 1))
+    return client
+
+
+def _close(name: str, client):
+    try:
+        transport = getattr(client, "transport", None)
+        if transport is not None:
+            transport.close()
+        elif hasattr(client, "close"):
+            client.close()
+    except Exception as e:
+        logger.error("client_close_failed", client=name, error=e)
+
+
+@contextlib.contextmanager
+def _using(name: str):
+    """Yield the shared client `name`, counting the call so reset() does not close it under us."""
+    while True:
+        client = get(name)
+        with _lock:
+            # Only count the client that is still current; reset() may have just replaced it
+            if _clients.get(name) is client:
+                _in_flight[id(client)] = _in_flight.get(id(client), 0) + 1
+                break
+    try:
+        yield client
+    finally:
+        with _lock:
+            remaining = _in_flight.pop(id(client)) - 1
+            if remaining:
+                _in_flight[id(client)] = remaining
+            retired = _retired.pop(id(client), None) if not remaining else None
+        if retired is not None:
+            _close(name, retired)
+
+
+def reset(name: str, failed):
+    """
+    Replace the client `failed`, whose channel is broken, with a new one.
+
+    Other threads may still be calling through `failed`: the new client is
+    swapped in first and the old one is only closed once its last call has
+    finished. If another thread already replaced `failed`, nothing is done.
+    """
+    credentials = get_credentials()
+    with _lock:
+        if _clients.get(name) is not failed:
+            return
+        start = time.perf_counter()
+        _clients[name] = replacement = _factories[name](credentials)
+        if replacement is failed or _in_flight.get(id(failed)):
+            _retired[id(failed)] = failed
+            failed = None
+    logger.info("client_rebuilt", client=name, ms=round((time.perf_counter() - start) * 1000, 1),
+                deferred_close=failed is None)
+    if failed is not None:
+        _close(name, failed)
+
+
+def _invoke(name: str, method: str, args, kwargs):
+    from google.api_core.exceptions import ServiceUnavailable
+    with _using(name) as client:
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except ServiceUnavailable as e:
+            logger.error("client_unavailable", client=name, method=method, error=e)
+            metrics.RETRIES.labels(operation=f"{name}.{method}").inc()
+            reset(name, client)
+    with _using(name) as client:
+        return getattr(client, method)(*args, **kwargs)
+
+
+def call(name: str, method: str, /, *args, **kwargs):
+    """
+    Call `method` on the shared client `name`.
+    The call first takes a token from the shared rate limiter (which may
+    raise RateLimited). A ServiceUnavailable usually means the underlying
+    channel went away; the client is rebuilt and the call retried once.
+    """
+    limiter = limits.get_limiter()
+    project = limits.project_of(kwargs)
+    started = time.perf_counter()
+    try:
+        limiter.acquire(name, project)
+        try:
+            result = _invoke(name, method, args, kwargs)
+        except Exception as e:
+            limiter.record(name, project, e)
+            raise
+        limiter.record(name, project)
+    except Exception as e:
+        metrics.observe_call(name, method, project, started, e)
+        raise
+    metrics.observe_call(name, method, project, started)
+    return result
+
+
+@contextlib.contextmanager
+def limited(name: str, method: str, project: str = None):
+    """
+    Take a rate limiter token and yield the shared client `name`, for code
+    that uses a client directly (Firestore) instead of through call():
+
+        with clients.limited("firestore", "set") as db:
+            db.collection(...).document(...).set(...)
+
+    The outcome of the block is recorded like a call(): server and quota
+    errors count towards the circuit breaker, quota errors are re-raised as
+    RateLimited, and its latency is observed under `method`. It blocks, so
+    use it from run_blocking.
+    """
+    limiter = limits.get_limiter()
+    project = project or os.getenv("PROJECT_ID")
+    started = time.perf_counter()
+    try:
+        limiter.acquire(name, project)
+        try:
+            with _using(name) as client:
+                yield client
+        except Exception as e:
+            limiter.record(name, project, e)
+            raise
+        limiter.record(name, project)
+    except Exception as e:
+        metrics.observe_call(name, method, project, started, e)
+        raise
+    metrics.observe_call(name, method, project, started)
+
+
+def _refresh_credentials(margin: datetime.timedelta):
+    from google.auth.transport.requests import Request as AuthRequest
+    credentials = get_credentials()
+    expiry = getattr(credentials, "expiry", None)
+    now = datetime.datetime.utcnow()
+    if not credentials.valid or expiry is None or expiry - now < margin:
+        credentials.refresh(AuthRequest())
+        logger.info("credentials_refreshed", expiry=credentials.expiry)
+
+
+def warm():
+    """Create every client and wait for gRPC channels to connect."""
+    _refresh_credentials(datetime.timedelta(minutes=5))
+    for name in _factories:
+        client = get(name)
+        channel = getattr(getattr(client, "transport", None), "grpc_channel", None)
+        if channel is not None:
+            import grpc
+            grpc.channel_ready_future(channel).result(timeout=10)
+        logger.info("client_warmed", client=name)
+
+
+def _refresh_loop(interval: float):
+    while True:
+        try:
+            _refresh_credentials(datetime.timedelta(seconds=interval * 2))
+        except Exception as e:
+            logger.error("credentials_refresh_failed", error=e)
+        time.sleep(interval)
+
+
+def _start_refresh_thread():
+    """Keep OAuth tokens fresh from a daemon thread once credentials exist."""
+    global _refresh_thread
+    if _refresh_thread is not None:
+        return
+    interval = float(os.getenv("CREDENTIAL_REFRESH_INTERVAL", "300"))
+    _refresh_thread = threading.Thread(target=_refresh_loop, args=(interval,), name="gcp-credential-refresh", daemon=True)
+    _refresh_thread.start()
+
+
+def start_background_warmup():
+    """Warm all clients from a daemon thread when WARM_CLIENTS is enabled."""
+    if os.getenv("WARM_CLIENTS", "false").lower() != "true":
+        return
+
+    def run():
+        try:
+            warm()
+        except Exception as e:
+            logger.error("client_warmup_failed", error=e)
+
+    threading.Thread(target=run, name="gcp-client-warmup", daemon=True).start()
@@ -1,7 +1,12 @@
 import os
 from dotenv import load_dotenv
 
+_loaded = False
+
 def load_config():
+    global _loaded
+    if _loaded:
+        return
     env = os.getenv("ENV", "dev")
     env_file = f"app/env/{env}/config.env"
 
@@ -16,3 +21,4 @@ def load_config():
     for var in required_vars:
         if not os.getenv(var):
             raise RuntimeError(f"[ERROR] Missing required config: {var}")
+    _loaded = True
@@ -0,0 +1,141 @@
+import asyncio
+import datetime
+import os
+import time
+from collections import OrderedDict
+
+import structlog
+
+from app.utils import clients, metrics
+from app.utils.config_loader import load_config
+from app.utils.executor import run_blocking
+
+logger = structlog.get_logger()
+
+
+class DedupCache:
+    """
+    Idempotency layer keyed on Pub/Sub messageId.
+
+    Push delivery is at-least-once, so a redelivered message is answered with
+    the result of the first run instead of repeating the GCP call. The first
+    tier is an in-memory TTL/LRU map; the optional second tier is a Firestore
+    collection shared by all instances (configure a TTL policy on `expires_at`
+    to have Firestore clean it up). Failed runs are not cached so Pub/Sub can
+    retry them.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, collection: str = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.collection = collection
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "inflight_hits": 0, "firestore_hits": 0}
+
+    def _get_local(self, message_id: str):
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._entries[message_id]
+            return None
+        self._entries.move_to_end(message_id)
+        return entry
+
+    def _put_local(self, message_id: str, result):
+        self._entries[message_id] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_remote(self, message_id: str):
+        with clients.limited("firestore", "get") as db:
+            doc = db.collection(self.collection).document(message_id).get()
+        metrics.count_firestore("read", self.collection)
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if data["expires_at"] < datetime.datetime.now(datetime.timezone.utc):
+            return None
+        return data
+
+    def _put_remote(self, message_id: str, result):
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl)
+        with clients.limited("firestore", "set") as db:
+            db.collection(self.collection).document(message_id).set({"result": result, "expires_at": expires_at})
+        metrics.count_firestore("write", self.collection)
+
+    async def run(self, message_id: str, func):
+        """Return the cached result for `message_id`, or await `func()` and cache it."""
+        if not message_id:
+            return await func()
+
+        entry = self._get_local(message_id)
+        if entry is not None:
+            self.stats["hits"] += 1
+            logger.info("duplicate_message", message_id=message_id, source="memory")
+            return entry[1]
+
+        inflight = self._inflight.get(message_id)
+        if inflight is not None:
+            self.stats["inflight_hits"] += 1
+            logger.info("duplicate_message", message_id=message_id, source="inflight")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[message_id] = future
+        try:
+            if self.collection:
+                try:
+                    remote = await run_blocking(self._get_remote, message_id)
+                except Exception as e:
+                    logger.error("dedup_read_failed", message_id=message_id, error=e)
+                    remote = None
+                if remote is not None:
+                    self.stats["firestore_hits"] += 1
+                    logger.info("duplicate_message", message_id=message_id, source="firestore")
+                    self._put_local(message_id, remote["result"])
+                    future.set_result(remote["result"])
+                    return remote["result"]
+
+            self.stats["misses"] += 1
+            result = await func()
+            self._put_local(message_id, result)
+            if self.collection:
+                try:
+                    await run_blocking(self._put_remote, message_id, result)
+                except Exception as e:
+                    logger.error("dedup_write_failed", message_id=message_id, error=e)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting on the future; mark the exception retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[message_id]
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self._entries), "inflight": len(self._inflight)}
+
+
+_cache = None
+
+
+def get_cache() -> DedupCache:
+    """Return the process-wide dedup cache configured from the environment."""
+    global _cache
+    if _cache is None:
+        load_config()
+        _cache = DedupCache(
+            ttl=float(os.getenv("DEDUP_TTL_SECONDS", "600")),
+            max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", "10000")),
+            collection=os.getenv("DEDUP_FIRESTORE_COLLECTION") or None,
+        )
+    return _cache
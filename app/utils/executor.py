@@ -0,0 +1,40 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.config_loader import load_config
+
+# The GCP client libraries (compute, container, firestore) are synchronous.
+# Running them directly inside an async handler stalls the whole uvicorn worker
+# for the duration of the gRPC round trip, so every blocking call goes through
+# a bounded thread pool instead.
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the shared thread pool used for blocking GCP calls."""
+    global _executor
+    if _executor is None:
+        load_config()
+        max_workers = int(os.getenv("GCP_EXECUTOR_WORKERS", "16"))
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gcp")
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function on the GCP thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    # Copy the context so contextvars (e.g. structlog bindings) follow the call
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def shutdown_executor():
+    """Stop the thread pool, waiting for calls already in flight."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
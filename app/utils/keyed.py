@@ -0,0 +1,72 @@
+import asyncio
+from collections import deque
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class KeyedExecutor:
+    """
+    Run commands for the same resource one at a time, in arrival order.
+
+    Commands for different keys run in parallel. A command that is still
+    waiting to run is replaced when a newer one for the same key arrives, so
+    a `stop` followed quickly by a `start` only sends the `start`. Every
+    caller gets `(command, result)` for the command that actually ran, so
+    callers whose command was replaced can tell (`command is not theirs`)
+    and report it as superseded rather than as their own result.
+    New work for an idle key waits `window` seconds before starting so
+    near-simultaneous messages can be collapsed.
+    """
+
+    def __init__(self, window: float = 0.25):
+        self.window = window
+        self._queues = {}
+        self._workers = {}
+
+    async def submit(self, key: str, command, factory, coalesce: bool = True):
+        """
+        Queue `factory()` (a coroutine factory running `command`) for `key`.
+        Returns `(command that ran, its result)`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(key, deque())
+        if coalesce and queue and queue[-1]["coalesce"]:
+            superseded = queue[-1]
+            logger.info("command_superseded", key=key)
+            superseded["command"] = command
+            superseded["factory"] = factory
+            superseded["futures"].append(future)
+        else:
+            queue.append({"command": command, "factory": factory, "futures": [future], "coalesce": coalesce})
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return await future
+
+    async def _drain(self, key: str):
+        queue = self._queues[key]
+        try:
+            await asyncio.sleep(self.window)
+            while queue:
+                entry = queue.popleft()
+                *superseded, latest = entry["futures"]
+                try:
+                    result = await entry["factory"]()
+                except Exception as e:
+                    # Only the command that ran failed; the replaced ones were never sent
+                    result = None
+                    if not latest.done():
+                        latest.set_exception(e)
+                        latest.exception()
+                else:
+                    if not latest.done():
+                        latest.set_result((entry["command"], result))
+                for f in superseded:
+                    if not f.done():
+                        f.set_result((entry["command"], result))
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
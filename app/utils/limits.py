@@ -0,0 +1,268 @@
+import math
+import os
+import re
+import threading
+import time
+
+import structlog
+from fastapi import HTTPException
+
+from app.utils.config_loader import load_config
+
+logger = structlog.get_logger()
+
+
+class RateLimited(HTTPException):
+    """
+    Raised instead of calling GCP when our own limits (or a quota error from
+    GCP) say the call should wait. It is an HTTPException, so handlers pass it
+    through and Pub/Sub gets a 429 and backs off instead of redelivering
+    straight away.
+    """
+
+    def __init__(self, key: str, retry_after: float, reason: str):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=429,
+            detail=f"{reason} for {key}, retry after {retry_after:.1f}s",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 when one is available now)."""
+        # `now` may predate a bucket created after the caller read the clock
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def snapshot(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "tokens": round(self.tokens, 2)}
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds; then lets a single probe through and closes
+    again if it succeeds.
+
+    The probe is reserved by the first caller after the timeout (`probing`),
+    so only that caller may proceed while it waits for a rate limit token.
+    The breaker only turns half-open once the probe has its token and is
+    about to call; a probe that gives up before that releases the
+    reservation and the breaker stays open for the next caller to probe.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.probing = False
+
+    def retry_after(self, now: float) -> float:
+        """0 if a call may go ahead, otherwise seconds until the next probe."""
+        if self.state == "closed":
+            return 0.0
+        if self.probing:
+            # Wait for the probe in flight to settle the state
+            return 1.0
+        remaining = self.opened_at + self.reset_timeout - now
+        if remaining <= 0:
+            return 0.0
+        return max(remaining, 1.0)
+
+    def reserve_probe(self) -> bool:
+        """Called when retry_after allowed a call; True if that call is the probe."""
+        if self.state == "closed":
+            return False
+        self.probing = True
+        return True
+
+    def start_probe(self):
+        """The probe got its token and is about to call."""
+        self.state = "half_open"
+
+    def release_probe(self):
+        """The probe gave up before calling."""
+        self.probing = False
+        if self.state == "half_open":
+            self.state = "open"
+
+    def record(self, ok: bool, now: float):
+        self.probing = False
+        if ok:
+            self.state, self.failures = "closed", 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state, self.opened_at = "open", now
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips,
+                "probing": self.probing}
+
+
+def parse_limits(spec: str) -> dict:
+    """Parse "compute=20/40,container=5/10" into {api: (rate per second, burst)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        api, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[api.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+_PROJECT_PATTERN = re.compile(r"projects/([^/]+)")
+
+
+def project_of(kwargs: dict):
+    """Best-effort project id of a GCP client call from its arguments."""
+    if "project" in kwargs:
+        return kwargs["project"]
+    request = kwargs.get("request")
+    if request is not None:
+        project = getattr(request, "project", None) or getattr(request, "project_id", None)
+        if project:
+            return project
+    for value in (kwargs.get("name"), kwargs.get("parent"), getattr(request, "name", None), getattr(request, "parent", None)):
+        if isinstance(value, str):
+            match = _PROJECT_PATTERN.match(value)
+            if match:
+                return match.group(1)
+    return None
+
+
+class Limiter:
+    """
+    Token buckets per API (client registry name) and per (API, project), and
+    a circuit breaker per (API, project).
+
+    A call waits up to `max_wait` seconds for tokens; beyond that, or while
+    the breaker is open, RateLimited is raised with a retry hint. Only
+    server-side and quota errors count towards the breaker: a NotFound or
+    FailedPrecondition is the caller's problem, not the API's.
+    """
+
+    def __init__(self, api_limits: dict, project_limits: dict, max_wait: float,
+                 breaker_threshold: int, breaker_reset: float):
+        self.api_limits = api_limits
+        self.project_limits = project_limits
+        self.max_wait = max_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._breakers = {}
+        self.stats = {"calls": 0, "waited": 0, "rejected": 0, "quota_errors": 0}
+
+    def _bucket(self, key, limits: dict, api: str):
+        if api not in limits:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limits[api])
+        return bucket
+
+    def _breaker(self, key) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return breaker
+
+    def acquire(self, api: str, project: str = None):
+        """Take a token for `api` and `project`, waiting briefly if needed."""
+        key = f"{api}/{project}" if project else api
+        deadline = time.monotonic() + self.max_wait
+        probe = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    breaker = self._breaker(key)
+                    if not probe:
+                        retry_after = breaker.retry_after(now)
+                        if retry_after:
+                            self.stats["rejected"] += 1
+                            raise RateLimited(key, retry_after, "Circuit open")
+                        probe = breaker.reserve_probe()
+                    buckets = [b for b in (
+                        self._bucket(api, self.api_limits, api),
+                        self._bucket(key, self.project_limits, api) if project else None,
+                    ) if b is not None]
+                    wait = max((b.wait_time(now) for b in buckets), default=0.0)
+                    if wait == 0:
+                        for bucket in buckets:
+                            bucket.tokens -= 1
+                        if probe:
+                            breaker.start_probe()
+                        self.stats["calls"] += 1
+                        return
+                    if now + wait > deadline:
+                        self.stats["rejected"] += 1
+                        raise RateLimited(key, wait, "Rate limit reached")
+                    self.stats["waited"] += 1
+                time.sleep(wait)
+        except BaseException:
+            if probe:
+                with self._lock:
+                    self._breaker(key).release_probe()
+            raise
+
+    def record(self, api: str, project: str = None, error: Exception = None):
+        """
+        Record the outcome of a call. Quota errors from GCP are re-raised as
+        RateLimited so they also reach Pub/Sub as a 429.
+        """
+        from google.api_core.exceptions import ServerError, TooManyRequests
+        key = f"{api}/{project}" if project else api
+        # Any answer other than a server or quota error shows the API is healthy
+        healthy = not isinstance(error, (TooManyRequests, ServerError))
+        with self._lock:
+            self._breaker(key).record(healthy, time.monotonic())
+        if isinstance(error, TooManyRequests):
+            self.stats["quota_errors"] += 1
+            logger.error("gcp_quota_exceeded", key=key, error=error)
+            raise RateLimited(key, self.breaker_reset, "GCP quota exceeded") from error
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._buckets.values():
+                bucket.wait_time(now)
+            return {
+                **self.stats,
+                "max_wait_seconds": self.max_wait,
+                "buckets": {key: bucket.snapshot() for key, bucket in self._buckets.items()},
+                "breakers": {key: breaker.snapshot() for key, breaker in self._breakers.items()},
+            }
+
+
+_limiter = None
+
+
+def get_limiter() -> Limiter:
+    global _limiter
+    if _limiter is None:
+        load_config()
+        _limiter = Limiter(
+            api_limits=parse_limits(os.getenv("RATE_LIMITS", "")),
+            project_limits=parse_limits(os.getenv("PROJECT_RATE_LIMITS", "")),
+            max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "1")),
+            breaker_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+            breaker_reset=float(os.getenv("BREAKER_RESET_SECONDS", "30")),
+        )
+    return _limiter
@@ -0,0 +1,206 @@
+import atexit
+import datetime
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import orjson
+import structlog
+
+from app.utils.config_loader import load_config
+
+# Log events are key-value pairs, e.g.
+#     logger.info("message_received", message_id=..., path=..., size=...)
+# Events below LOG_LEVEL are dropped before any processor runs. Kept events
+# are sampled on the calling thread (cheap), then handed to a writer thread as
+# plain dicts; truncation, JSON rendering (orjson) and the stdout write all
+# happen there, so a slow stdout never blocks the event loop.
+#
+# Callers may change a dict or list after logging it, so containers are
+# serialized (orjson, fast) and other objects turned into strings on the
+# calling thread; only immutable values cross to the writer.
+
+
+def parse_rates(spec: str) -> dict:
+    """Parse "event=value,event=value" into {event: float}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, value = item.partition("=")
+        rates[event.strip()] = float(value)
+    return rates
+
+
+class Sampler:
+    """
+    Keep only a fraction of an event type (LOG_SAMPLE_RATES). Warnings and
+    errors are always kept; kept sampled events carry their sample_rate.
+    """
+
+    def __init__(self, rates: dict):
+        self.rates = rates
+
+    def __call__(self, logger, method_name, event_dict):
+        rate = self.rates.get(event_dict.get("event"))
+        if rate is None or method_name in ("warning", "error", "exception", "critical"):
+            return event_dict
+        if random.random() >= rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+
+def _add_time(logger, method_name, event_dict):
+    # A float is cheap here; the writer formats it as ISO 8601
+    event_dict["timestamp"] = time.time()
+    return event_dict
+
+
+class _Serialized(bytes):
+    """JSON of a dict or list, taken when the event was logged."""
+
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def _snapshot(logger, method_name, event_dict):
+    for key, value in event_dict.items():
+        if isinstance(value, _SCALARS):
+            continue
+        if isinstance(value, (dict, list, tuple)):
+            try:
+                value = _Serialized(orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS))
+            except TypeError:
+                value = str(value)
+        else:
+            value = str(value)
+        event_dict[key] = value
+    return event_dict
+
+
+def _enqueue(logger, method_name, event_dict):
+    # Hand the dict itself to the writer; see QueueLogger
+    return (event_dict,), {}
+
+
+class Writer:
+    """Background thread that truncates, renders and writes queued events."""
+
+    def __init__(self, stream, max_length: int, max_lengths: dict, max_queue: int):
+        self.stream = stream
+        self.max_length = max_length
+        self.max_lengths = max_lengths
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, event_dict: dict):
+        try:
+            self.queue.put_nowait(event_dict)
+        except queue.Full:
+            self.dropped += 1
+
+    def _truncate(self, event_dict: dict) -> dict:
+        limit = self.max_lengths.get(event_dict.get("event"), self.max_length)
+        for key, value in event_dict.items():
+            if isinstance(value, _Serialized):
+                if len(value) <= limit:
+                    # Short enough to keep as nested JSON
+                    event_dict[key] = orjson.Fragment(bytes(value))
+                    continue
+                value = value.decode()
+            elif not isinstance(value, _SCALARS):
+                value = str(value)
+            if isinstance(value, str) and len(value) > limit:
+                value = f"{value[:limit]}...[{len(value) - limit} more]"
+            event_dict[key] = value
+        return event_dict
+
+    def render(self, event_dict: dict) -> bytes:
+        event_dict = self._truncate(event_dict)
+        timestamp = event_dict.get("timestamp")
+        if isinstance(timestamp, float):
+            event_dict["timestamp"] = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+        return orjson.dumps(event_dict, option=orjson.OPT_APPEND_NEWLINE)
+
+    def _run(self):
+        while True:
+            events = [self.queue.get()]
+            # Write everything that queued up meanwhile in one go
+            while len(events) < 1000:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in events:
+                events = [e for e in events if e is not None]
+                self._write(events)
+                return
+            if self.dropped:
+                events.append({"event": "log_events_dropped", "level": "warning", "count": self.dropped})
+                self.dropped = 0
+            self._write(events)
+
+    def _write(self, events):
+        try:
+            self.stream.write(b"".join(self.render(e) for e in events))
+            self.stream.flush()
+        except Exception as e:
+            sys.stderr.write(f"Error writing log events: {e}\n")
+
+    def stop(self, timeout: float = 2.0):
+        """Flush queued events; called at exit."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+class QueueLogger:
+    """structlog logger that passes each event dict to the writer thread."""
+
+    def __init__(self, writer: Writer):
+        self._put = writer.put
+
+    def msg(self, event_dict: dict):
+        self._put(event_dict)
+
+    debug = info = warning = warn = error = critical = exception = fatal = log = msg
+
+
+_writer = None
+
+
+def configure():
+    """Configure structlog for the whole process; safe to call more than once."""
+    global _writer
+    if _writer is not None:
+        return
+    load_config()
+    _writer = Writer(
+        stream=sys.stdout.buffer,
+        max_length=int(os.getenv("LOG_MAX_FIELD_LENGTH", "512")),
+        max_lengths={k: int(v) for k, v in parse_rates(os.getenv("LOG_FIELD_LENGTHS", "")).items()},
+        max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    )
+    atexit.register(_writer.stop)
+    level = logging.getLevelName(os.getenv("LOG_LEVEL", "info").upper())
+    structlog.configure(
+        processors=[
+            structlog.contextvars.merge_contextvars,
+            Sampler(parse_rates(os.getenv("LOG_SAMPLE_RATES", ""))),
+            structlog.processors.add_log_level,
+            _add_time,
+            structlog.processors.format_exc_info,
+            _snapshot,
+            _enqueue,
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        logger_factory=lambda *args: QueueLogger(_writer),
+        cache_logger_on_first_use=True,
+    )
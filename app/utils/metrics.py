@@ -0,0 +1,185 @@
+import functools
+import inspect
+import os
+import time
+
+import structlog
+from fastapi import HTTPException
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+logger = structlog.get_logger()
+
+# Endpoint and handler latencies range from a dedup hit (sub-millisecond) to
+# a node pool resize waiting on cluster operations (minutes).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REQUEST_LATENCY = Histogram(
+    "vm_worker_request_duration_seconds", "HTTP request latency by route",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+HANDLER_LATENCY = Histogram(
+    "vm_worker_handler_duration_seconds", "gcp.py entry point latency",
+    ["handler", "action", "project", "outcome"], buckets=LATENCY_BUCKETS,
+)
+GCP_CALL_LATENCY = Histogram(
+    "vm_worker_gcp_call_duration_seconds", "GCP client call latency by API method",
+    ["api", "method", "project", "outcome"], buckets=LATENCY_BUCKETS,
+)
+FIRESTORE_OPERATIONS = Counter(
+    "vm_worker_firestore_operations_total", "Firestore documents read and written",
+    ["operation", "collection"],
+)
+RETRIES = Counter(
+    "vm_worker_retries_total", "Retries of GCP operations", ["operation"],
+)
+
+_otel = None
+
+
+def outcome_of(error: Exception = None) -> str:
+    if error is None:
+        return "success"
+    status_code = getattr(error, "status_code", None) if isinstance(error, HTTPException) else getattr(error, "code", None)
+    if status_code == 429:
+        return "rate_limited"
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return "client_error"
+    return "error"
+
+
+def _record(histogram: Histogram, value: float, **labels):
+    histogram.labels(**labels).observe(value)
+    if _otel is not None:
+        _otel[histogram._name].record(value, labels)
+
+
+def observe_call(api: str, method: str, project, started: float, error: Exception = None):
+    """Record one clients.call; `started` is a time.perf_counter() value."""
+    _record(GCP_CALL_LATENCY, time.perf_counter() - started,
+            api=api, method=method, project=project or "", outcome=outcome_of(error))
+
+
+def count_firestore(operation: str, collection: str, count: int = 1):
+    FIRESTORE_OPERATIONS.labels(operation=operation, collection=collection).inc(count)
+    if _otel is not None:
+        _otel[FIRESTORE_OPERATIONS._name].add(count, {"operation": operation, "collection": collection})
+
+
+def instrument(func):
+    """
+    Record latency and outcome of a gcp.py entry point, labelled with the
+    action and project of its payload where it has them. An entry point that
+    returns an async generator (a streamed response) is measured until the
+    stream ends, not just until it is created.
+    """
+    handler = func.__name__
+
+    def observe(args, started, error):
+        payload = args[0] if args else None
+        _record(HANDLER_LATENCY, time.perf_counter() - started,
+                handler=handler,
+                action=str(getattr(payload, "action", "") or ""),
+                project=str(getattr(payload, "project_id", "") or ""),
+                outcome=outcome_of(error))
+
+    async def timed_stream(stream, args, started):
+        try:
+            async for item in stream:
+                yield item
+        except BaseException as e:
+            # Includes the client going away mid-stream
+            observe(args, started, e)
+            raise
+        observe(args, started, None)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                observe(args, started, e)
+                raise
+            if inspect.isasyncgen(result):
+                return timed_stream(result, args, started)
+            observe(args, started, None)
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                observe(args, started, e)
+                raise
+            observe(args, started, None)
+            return result
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. Requests are labelled with the
+    matched route template (e.g. /operations/{message_id}) so ids in paths do
+    not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            _record(REQUEST_LATENCY, time.perf_counter() - started,
+                    endpoint=getattr(route, "path", "unmatched"),
+                    method=scope["method"],
+                    status=str(status["code"]))
+
+
+def render():
+    """Return (body, content type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def setup_otlp():
+    """
+    Mirror the metrics to an OTLP collector when OTEL_EXPORTER_OTLP_ENDPOINT
+    is set and the OpenTelemetry SDK and OTLP exporter are installed.
+    """
+    global _otel
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or _otel is not None:
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    except ImportError as e:
+        logger.error("otlp_unavailable", error=e)
+        return
+    reader = PeriodicExportingMetricReader(
+        OTLPMetricExporter(),
+        export_interval_millis=int(float(os.getenv("OTEL_EXPORT_INTERVAL_SECONDS", "60")) * 1000),
+    )
+    meter = MeterProvider(metric_readers=[reader]).get_meter("vm-worker")
+    _otel = {
+        histogram._name: meter.create_histogram(histogram._name, unit="s", description=histogram._documentation)
+        for histogram in (REQUEST_LATENCY, HANDLER_LATENCY, GCP_CALL_LATENCY)
+    }
+    _otel[FIRESTORE_OPERATIONS._name] = meter.create_counter(
+        FIRESTORE_OPERATIONS._name, description=FIRESTORE_OPERATIONS._documentation
+    )
+    logger.info("otlp_export_enabled", endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"))
@@ -0,0 +1,22 @@
+import orjson
+
+
+async def iter_lines(chunks):
+    """
+    Split an async stream of byte chunks (e.g. Request.stream()) into lines.
+    Only the current partial line is buffered, so memory stays flat no matter
+    how large the body is.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+def dumps_line(obj) -> bytes:
+    """Serialize one NDJSON record, including the trailing newline."""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_APPEND_NEWLINE)
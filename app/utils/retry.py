@@ -0,0 +1,14 @@
+import random
+
+
+def backoff_delays(initial: float = 1.0, maximum: float = 30.0, multiplier: float = 2.0):
+    """
+    Yield exponentially growing delays with equal jitter.
+
+    Each delay is between half and all of the current backoff step, so callers
+    polling the same resource do not wake up in lockstep.
+    """
+    delay = initial
+    while True:
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * multiplier, maximum)
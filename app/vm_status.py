@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+
+import structlog
+
+from app.utils import clients
+from app.utils.executor import run_blocking
+
+logger = structlog.get_logger()
+
+# Instance states in which a command would not change anything
+NOOP_STATES = {
+    "start": {"PROVISIONING", "STAGING", "RUNNING"},
+    "stop": {"STOPPING", "STOPPED", "TERMINATED"},
+}
+
+# State assumed right after we successfully request an action
+EXPECTED_STATES = {
+    "start": "STAGING",
+    "stop": "STOPPING",
+    "restart": "RUNNING",
+}
+
+# State once the operation for an action has finished successfully
+COMPLETED_STATES = {
+    "start": "RUNNING",
+    "stop": "TERMINATED",
+    "restart": "RUNNING",
+}
+
+
+class VMStatusCache:
+    """
+    Last known status of every VM, per project.
+
+    A project is loaded with one Instances.aggregated_list sweep and swept
+    again once it is older than `ttl`. Our own successful commands update the
+    entry straight away; a sweep that started before such an update does not
+    overwrite it. Failed operations (reported by the operation tracker)
+    drop the entry so the next command goes to the API.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._projects = {}
+        self._locks = {}
+        self.stats = {"sweeps": 0, "sweep_errors": 0, "lookups": 0, "skipped": 0}
+
+    def _sweep(self, project_id: str) -> dict:
+        from google.cloud import compute_v1
+        request = compute_v1.AggregatedListInstancesRequest(
+            project=project_id,
+            max_results=500,
+        )
+        vms = {}
+        for scope, scoped_list in clients.call("compute", "aggregated_list", request=request):
+            zone = scope.rsplit("/", 1)[-1]
+            for instance in scoped_list.instances:
+                vms[(zone, instance.name)] = instance.status
+        return vms
+
+    async def _refresh(self, project_id: str):
+        lock = self._locks.setdefault(project_id, asyncio.Lock())
+        async with lock:
+            entry = self._projects.get(project_id)
+            if entry is not None and time.monotonic() - entry["fetched_at"] < self.ttl:
+                return
+            started = time.monotonic()
+            try:
+                swept = await run_blocking(self._sweep, project_id)
+                self.stats["sweeps"] += 1
+            except Exception as e:
+                # Remember the failure for one TTL so every command does not retry the sweep
+                logger.error("vm_status_sweep_failed", project_id=project_id, error=e)
+                self.stats["sweep_errors"] += 1
+                swept = {}
+            vms = {key: (status, started) for key, status in swept.items()}
+            if entry is not None:
+                vms.update({key: value for key, value in entry["vms"].items() if value[1] > started})
+            self._projects[project_id] = {"fetched_at": started, "vms": vms}
+            logger.info("vm_status_swept", project_id=project_id, vms=len(swept), seconds=round(time.monotonic() - started, 3))
+
+    async def get(self, project_id: str, zone: str, vm_name: str, force_refresh: bool = False):
+        """Return the VM's status, or None when it is not known."""
+        self.stats["lookups"] += 1
+        if force_refresh:
+            instance = await run_blocking(clients.call, "compute", "get", project=project_id, zone=zone, instance=vm_name)
+            self.set(project_id, zone, vm_name, instance.status)
+            return instance.status
+        await self._refresh(project_id)
+        value = self._projects[project_id]["vms"].get((zone, vm_name))
+        return value[0] if value else None
+
+    def set(self, project_id: str, zone: str, vm_name: str, status: str):
+        entry = self._projects.setdefault(project_id, {"fetched_at": float("-inf"), "vms": {}})
+        entry["vms"][(zone, vm_name)] = (status, time.monotonic())
+
+    def mark_requested(self, project_id: str, zone: str, vm_name: str, action: str):
+        """Optimistically record the state a successful `action` leads to."""
+        self.set(project_id, zone, vm_name, EXPECTED_STATES[action])
+
+    def mark_completed(self, project_id: str, zone: str, vm_name: str, action: str):
+        self.set(project_id, zone, vm_name, COMPLETED_STATES[action])
+
+    def invalidate(self, project_id: str, zone: str, vm_name: str):
+        entry = self._projects.get(project_id)
+        if entry is not None:
+            entry["vms"].pop((zone, vm_name), None)
+
+    async def is_noop(self, project_id: str, zone: str, vm_name: str, action: str, force_refresh: bool = False):
+        """Return the current status if `action` would not change the VM, else None."""
+        if self.ttl <= 0 and not force_refresh:
+            return None
+        status = await self.get(project_id, zone, vm_name, force_refresh)
+        if status in NOOP_STATES.get(action, ()):
+            self.stats["skipped"] += 1
+            return status
+        return None
+
+
+_cache = None
+
+
+def get_status_cache() -> VMStatusCache:
+    global _cache
+    if _cache is None:
+        _cache = VMStatusCache(ttl=float(os.getenv("VM_STATUS_TTL_SECONDS", "60")))
+    return _cache
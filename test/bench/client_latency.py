@@ -0,0 +1,52 @@
+"""
+Compare GKE call latency with a client built per call (the old behaviour)
+against the shared client from app.utils.clients.
+
+Runs against a real cluster:
+
+    PYTHONPATH=. python test/bench/client_latency.py \
+        --project extended-web-339507 --location us-central1-a --cluster my-private-cluster-1
+"""
+import argparse
+import statistics
+import time
+
+from google.cloud import container_v1
+
+from app.utils import clients
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def report(label: str, samples):
+    first, rest = samples[0], samples[1:]
+    print(f"{label:>10}: first={first:.1f}ms steady p50={statistics.median(rest):.1f}ms "
+          f"max={max(rest):.1f}ms")
+
+
+def main(args):
+    name = f"projects/{args.project}/locations/{args.location}/clusters/{args.cluster}"
+
+    per_call = [
+        timed(lambda: container_v1.ClusterManagerClient().get_cluster(name=name))
+        for _ in range(args.calls)
+    ]
+    shared = [
+        timed(lambda: clients.call("container", "get_cluster", name=name))
+        for _ in range(args.calls)
+    ]
+    report("per-call", per_call)
+    report("shared", shared)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--location", required=True)
+    parser.add_argument("--cluster", required=True)
+    parser.add_argument("--calls", type=int, default=20)
+    main(parser.parse_args())
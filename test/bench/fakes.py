@@ -0,0 +1,492 @@
+"""
+In-process stand-ins for the GCP clients used by app/, for offline benchmarks.
+
+Each fake sleeps for a configurable latency per call (like a blocking gRPC
+round trip) and fails a configurable fraction of calls with a google.api_core
+error. install() puts them into the app.utils.clients registry, including its
+factories, so a client rebuilt after ServiceUnavailable is still a fake.
+
+    import fakes  # test/bench is on sys.path for scripts in test/bench
+    fakes.install(fakes.Behaviour(latency=0.02, error_rate=0.01))
+"""
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from google.api_core import exceptions
+from google.cloud import compute_v1, container_v1
+
+from app.utils import clients
+
+
+@dataclass
+class Behaviour:
+    latency: float = 0.02          # seconds per call
+    jitter: float = 0.5            # +/- fraction of latency
+    error_rate: float = 0.0        # fraction of calls that fail
+    error: type = exceptions.InternalServerError
+    operation_seconds: float = 1.0  # time until a VM operation is DONE
+
+    def call(self):
+        if self.latency:
+            time.sleep(self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            raise self.error("Injected failure")
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeInstances:
+    """compute_v1.InstancesClient: start/stop/restart/get/aggregated_list."""
+
+    def __init__(self, behaviour: Behaviour, zone_operations: "FakeZoneOperations"):
+        self.behaviour = behaviour
+        self.zone_operations = zone_operations
+        self.statuses = {}
+
+    def _operation(self, project, zone, instance, status):
+        self.behaviour.call()
+        self.statuses[(project, zone, instance)] = status
+        return self.zone_operations.create(project, zone)
+
+    def start(self, project, zone, instance):
+        return self._operation(project, zone, instance, "RUNNING")
+
+    def stop(self, project, zone, instance):
+        return self._operation(project, zone, instance, "TERMINATED")
+
+    def restart(self, project, zone, instance):
+        return self._operation(project, zone, instance, "RUNNING")
+
+    def get(self, project, zone, instance):
+        self.behaviour.call()
+        return compute_v1.Instance(name=instance, status=self.statuses.get((project, zone, instance), "TERMINATED"))
+
+    def aggregated_list(self, request):
+        self.behaviour.call()
+        by_zone = {}
+        for (project, zone, name), status in list(self.statuses.items()):
+            if project == request.project:
+                by_zone.setdefault(f"zones/{zone}", []).append(compute_v1.Instance(name=name, status=status))
+        return iter([(scope, _Namespace(instances=instances)) for scope, instances in by_zone.items()])
+
+
+class FakeZoneOperations:
+    """compute_v1.ZoneOperationsClient.list with `name eq (a|b)` filters."""
+
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+        self._ids = itertools.count()
+        self._created = {}
+
+    def create(self, project, zone):
+        name = f"operation-{next(self._ids)}"
+        self._created[name] = time.monotonic()
+        return compute_v1.Operation(name=name, status="RUNNING", zone=zone)
+
+    def list(self, request):
+        self.behaviour.call()
+        names = request.filter.split("(", 1)[1].rstrip(")").split("|")
+        now = time.monotonic()
+        return [
+            compute_v1.Operation(
+                name=name,
+                status="DONE" if now - self._created.get(name, now) >= self.behaviour.operation_seconds else "RUNNING",
+            )
+            for name in names
+        ]
+
+
+class FakeClusterManager:
+    """container_v1.ClusterManagerClient for node pools and maintenance policies."""
+
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+        self._lock = threading.Lock()
+        self._versions = itertools.count(1)
+        self.clusters = {}
+        self.node_pools = {}
+
+    def _cluster(self, name):
+        project, location, cluster = name.split("/")[1::2][:3]
+        key = f"projects/{project}/locations/{location}/clusters/{cluster}"
+        if key not in self.clusters:
+            self.clusters[key] = container_v1.Cluster(
+                name=cluster, location=location,
+                maintenance_policy=container_v1.MaintenancePolicy(resource_version=str(next(self._versions))),
+            )
+        return self.clusters[key]
+
+    def _done(self):
+        return container_v1.Operation(name=f"operation-{next(self._versions)}", status=container_v1.Operation.Status.DONE)
+
+    def get_cluster(self, name):
+        self.behaviour.call()
+        return self._cluster(name)
+
+    def list_clusters(self, parent):
+        self.behaviour.call()
+        project = parent.split("/")[1]
+        return container_v1.ListClustersResponse(
+            clusters=[c for key, c in self.clusters.items() if key.split("/")[1] == project]
+        )
+
+    def set_maintenance_policy(self, request):
+        self.behaviour.call()
+        with self._lock:
+            cluster = self._cluster(request.name)
+            if request.maintenance_policy.resource_version != cluster.maintenance_policy.resource_version:
+                raise exceptions.Aborted("resource_version mismatch")
+            policy = container_v1.MaintenancePolicy(request.maintenance_policy)
+            policy.resource_version = str(next(self._versions))
+            cluster.maintenance_policy = policy
+        return self._done()
+
+    def _node_pool(self, name):
+        if name not in self.node_pools:
+            self.node_pools[name] = container_v1.NodePool(
+                name=name.rsplit("/", 1)[-1],
+                autoscaling=container_v1.NodePoolAutoscaling(enabled=False),
+                instance_group_urls=[
+                    f"https://www.googleapis.com/compute/v1/projects/{name.split('/')[1]}/zones/{name.split('/')[3]}-a/instanceGroupManagers/{abs(hash(name))}"
+                ],
+            )
+        return self.node_pools[name]
+
+    def get_node_pool(self, name):
+        self.behaviour.call()
+        return self._node_pool(name)
+
+    def set_node_pool_autoscaling(self, request):
+        self.behaviour.call()
+        self._node_pool(request.name).autoscaling = request.autoscaling
+        return self._done()
+
+    def set_node_pool_size(self, request):
+        self.behaviour.call()
+        url = self._node_pool(request.name).instance_group_urls[0]
+        FakeInstanceGroupManagers.sizes[url.rsplit("/", 1)[-1]] = request.node_count
+        return self._done()
+
+    def get_operation(self, name):
+        self.behaviour.call()
+        return self._done()
+
+
+class FakeInstanceGroupManagers:
+    sizes = {}
+
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+
+    def get(self, project, zone, instance_group_manager):
+        self.behaviour.call()
+        return compute_v1.InstanceGroupManager(target_size=self.sizes.get(instance_group_manager, 0))
+
+
+# --- Firestore -------------------------------------------------------------
+
+class FakeSnapshot:
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self.parent = collection
+        self.id = doc_id
+        self.path = f"{collection.id}/{doc_id}"
+
+    def _docs(self):
+        return self._db.data.setdefault(self.parent.id, {})
+
+    def get(self, transaction=None):
+        self._db.behaviour.call()
+        return FakeSnapshot(self, self._docs().get(self.id))
+
+    def set(self, data):
+        self._db.behaviour.call()
+        self._docs()[self.id] = dict(data)
+
+    def create(self, data):
+        self._db.behaviour.call()
+        if self.id in self._docs():
+            raise exceptions.AlreadyExists(f"Document already exists: {self.path}")
+        self._docs()[self.id] = dict(data)
+
+    def update(self, data):
+        self._db.behaviour.call()
+        if self.id not in self._docs():
+            raise exceptions.NotFound(f"No document to update: {self.path}")
+        self._docs()[self.id].update(data)
+
+    def delete(self):
+        self._db.behaviour.call()
+        self._docs().pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), fields=None, limit=None, after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._fields = fields
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, fields=self._fields, limit=self._limit, after=self._after)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot.id)
+
+    def stream(self):
+        db = self._collection._db
+        db.behaviour.call()
+        docs = sorted(db.data.get(self._collection.id, {}).items())
+        results = []
+        for doc_id, data in docs:
+            if self._after is not None and doc_id <= self._after:
+                continue
+            if not all(data.get(field) in value if op == "in" else data.get(field) == value
+                       for field, op, value in self._filters):
+                continue
+            if self._fields:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            results.append(FakeSnapshot(self._collection.document(doc_id), data))
+            if self._limit and len(results) >= self._limit:
+                break
+        return iter(results)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, name):
+        self._db = db
+        self.id = name
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return FakeDocument(self._db, self, doc_id)
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data):
+        self._writes.append((reference, data, False))
+
+    def update(self, reference, data):
+        self._writes.append((reference, data, True))
+
+    def commit(self):
+        self._db.behaviour.call()
+        for reference, data, merge in self._writes:
+            docs = reference._docs()
+            docs[reference.id] = {**docs[reference.id], **data} if merge else dict(data)
+
+
+class FakeBulkWriter(FakeWriteBatch):
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def flush(self):
+        self.commit()
+        self._writes = []
+
+    def close(self):
+        self.flush()
+
+
+class FakeTransaction:
+    """Enough of firestore.Transaction for the @firestore.transactional decorator."""
+
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, db):
+        self._db = db
+        self._id = None
+        self._updates = []
+
+    def _clean_up(self):
+        self._updates = []
+
+    def _begin(self, retry_id=None):
+        self._id = b"fake"
+
+    def update(self, reference, data):
+        self._updates.append((reference, data))
+
+    def _commit(self):
+        self._db.behaviour.call()
+        for reference, data in self._updates:
+            reference._docs()[reference.id].update(data)
+        return []
+
+    def _rollback(self):
+        self._updates = []
+
+
+class FakeFirestore:
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+        self.data = {}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self):
+        return FakeBulkWriter(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+
+def install(behaviour: Behaviour = None) -> dict:
+    """Replace every client in app.utils.clients with a fake; returns them by name."""
+    behaviour = behaviour or Behaviour()
+    zone_operations = FakeZoneOperations(behaviour)
+    fakes = {
+        "compute": FakeInstances(behaviour, zone_operations),
+        "zone_operations": zone_operations,
+        "container": FakeClusterManager(behaviour),
+        "instance_group_managers": FakeInstanceGroupManagers(behaviour),
+        "firestore": FakeFirestore(behaviour),
+    }
+    clients._credentials = object()
+    clients._clients.clear()
+    clients._clients.update(fakes)
+    for name, fake in fakes.items():
+        clients._factories[name] = lambda credentials, fake=fake: fake
+    return fakes
+
+
+# --- Pub/Sub streaming pull ------------------------------------------------
+
+class FakeMessage:
+    def __init__(self, subscription: "FakeSubscription", message_id: str, data: bytes, attributes: dict):
+        self._subscription = subscription
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.delivery_attempt = 1
+
+    def ack(self):
+        self._subscription.settle(self, acked=True)
+
+    def nack(self):
+        self._subscription.settle(self, acked=False)
+
+
+class FakeSubscription:
+    """
+    One streaming pull: delivers queued messages to the callback through the
+    scheduler, with at most flow_control.max_messages outstanding. Nacked
+    messages are redelivered.
+    """
+
+    def __init__(self, callback, flow_control, scheduler):
+        self._callback = callback
+        self._scheduler = scheduler
+        self._slots = threading.Semaphore(flow_control.max_messages)
+        self._queue = []
+        self._cond = threading.Condition()
+        self._cancelled = False
+        self.acked = 0
+        self.nacked = 0
+        self._thread = threading.Thread(target=self._run, name="fake-streaming-pull", daemon=True)
+        self._thread.start()
+
+    def put(self, message: FakeMessage):
+        with self._cond:
+            self._queue.append(message)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                while not self._queue and not self._cancelled:
+                    self._cond.wait()
+                if self._cancelled:
+                    return
+                message = self._queue.pop(0)
+            self._scheduler.schedule(self._callback, message)
+
+    def settle(self, message: FakeMessage, acked: bool):
+        with self._cond:
+            if acked:
+                self.acked += 1
+            else:
+                self.nacked += 1
+                message.delivery_attempt += 1
+                self._queue.append(message)
+            self._cond.notify_all()
+        self._slots.release()
+
+    def wait_for_acks(self, count: int, timeout: float = 60.0) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.acked >= count, timeout)
+
+    # StreamingPullFuture
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+        self._slots.release()
+
+    def result(self, timeout=None):
+        self._thread.join(timeout)
+
+
+class FakeSubscriberClient:
+    """pubsub_v1.SubscriberClient.subscribe, fed by publish()."""
+
+    def __init__(self):
+        self.subscriptions = {}
+        self._ids = itertools.count()
+
+    def subscribe(self, subscription, callback, flow_control, scheduler):
+        self.subscriptions[subscription] = FakeSubscription(callback, flow_control, scheduler)
+        return self.subscriptions[subscription]
+
+    def publish(self, subscription: str, data: bytes, attributes: dict = None) -> str:
+        message_id = f"pull-{next(self._ids)}"
+        target = self.subscriptions[subscription]
+        target.put(FakeMessage(target, message_id, data, attributes or {}))
+        return message_id
@@ -0,0 +1,59 @@
+"""
+Load test for the async execution layer.
+
+Simulates gRPC round trips with a blocking sleep and compares calling them
+inline from the event loop (the old behaviour) against awaiting them through
+app.utils.executor.run_blocking, at increasing concurrency levels.
+
+    PYTHONPATH=. python test/bench/loadtest.py --latency 0.05 --requests 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.utils import executor
+
+
+def fake_gcp_call(latency: float):
+    time.sleep(latency)
+    return "done"
+
+
+async def inline_handler(latency: float):
+    return fake_gcp_call(latency)
+
+
+async def offloop_handler(latency: float):
+    return await executor.run_blocking(fake_gcp_call, latency)
+
+
+async def run(handler, latency: float, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(latency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed
+
+
+async def main(args):
+    print(f"latency={args.latency}s requests={args.requests} workers={os.getenv('GCP_EXECUTOR_WORKERS', '16')}")
+    print(f"{'concurrency':>12} {'inline req/s':>14} {'off-loop req/s':>16}")
+    for concurrency in args.concurrency:
+        inline = await run(inline_handler, args.latency, args.requests, concurrency)
+        offloop = await run(offloop_handler, args.latency, args.requests, concurrency)
+        print(f"{concurrency:>12} {inline:>14.1f} {offloop:>16.1f}")
+    executor.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated API latency in seconds")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""
+Cost of logging on the request path.
+
+Times the calling-thread cost of a typical `message_received` event and a
+large-payload `node_pool_configure` event under three setups: structlog's
+default console pipeline (the old behaviour), the queue-backed JSON pipeline
+from app.utils.log, and the same with the event sampled at 10%. Output goes
+to /dev/null so only logging itself is measured.
+
+    PYTHONPATH=. python test/bench/logging_overhead.py --events 20000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+import structlog
+
+import app.dataclass as dataclass
+from app.utils import log
+
+CONFIG = dataclass.NodePoolConfig(
+    project_id="my-project",
+    zone="us-central1-a",
+    cluster_id="cluster-1",
+    nodepool_id="pool-1",
+    enable_autoscaling=True,
+    min_nodes=1,
+    max_nodes=10,
+    desired_node_count=3,
+)
+
+
+def measure(logger, events: int) -> dict:
+    results = {}
+    start = time.perf_counter()
+    for i in range(events):
+        logger.info("message_received", message_id=str(i), path="/vm-worker", size=128)
+    results["message_received"] = (time.perf_counter() - start) / events * 1e6
+    start = time.perf_counter()
+    for i in range(events):
+        logger.info("node_pool_configure", node_pool="projects/p/locations/l/clusters/c/nodePools/n", config=CONFIG)
+    results["node_pool_configure"] = (time.perf_counter() - start) / events * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    rows = {}
+    with contextlib.redirect_stdout(devnull):
+        structlog.configure(logger_factory=structlog.PrintLoggerFactory(devnull))
+        rows["default console"] = measure(structlog.get_logger(), args.events)
+
+    structlog.reset_defaults()
+    sys.stdout = open(os.devnull, "w")
+    os.environ["LOG_SAMPLE_RATES"] = ""
+    log.configure()
+    rows["queue + orjson"] = measure(structlog.get_logger(), args.events)
+    log._writer.stop()
+
+    log._writer = None
+    os.environ["LOG_SAMPLE_RATES"] = "message_received=0.1,node_pool_configure=0.1"
+    log.configure()
+    rows["queue + orjson, 10% sampled"] = measure(structlog.get_logger(), args.events)
+    log._writer.stop()
+    sys.stdout = sys.__stdout__
+
+    print(f"{'pipeline':<30} {'message_received':>18} {'node_pool_configure':>20}  (us per event, calling thread)")
+    for name, result in rows.items():
+        print(f"{name:<30} {result['message_received']:>18.2f} {result['node_pool_configure']:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
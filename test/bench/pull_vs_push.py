@@ -0,0 +1,88 @@
+"""
+Sustained throughput of push delivery against streaming pull.
+
+Both modes run /vm-worker messages through the same handlers against the GCP
+fakes. Push posts base64 envelopes through httpx's ASGI transport with
+--concurrency requests in flight; pull publishes the same payloads to
+app.subscriber.Subscriber over a stand-in SubscriberClient with
+max_messages=--concurrency, and waits until all are acked. Push here skips
+the Cloud Run front end and network, so it is the best case for push. With
+real latency both modes end up bound by GCP_EXECUTOR_WORKERS; --latency 0
+shows the per-message overhead of each delivery path.
+
+    PYTHONPATH=. python test/bench/pull_vs_push.py --messages 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+
+os.environ.setdefault("COALESCE_WINDOW_SECONDS", "0")
+os.environ.setdefault("RATE_LIMITS", "")
+os.environ.setdefault("PROJECT_RATE_LIMITS", "")
+os.environ.setdefault("LOG_LEVEL", "critical")
+
+SUBSCRIPTION = "projects/bench/subscriptions/vm-worker"
+
+
+def payload(i: int) -> bytes:
+    return json.dumps({"vm_name": f"vm-{i}", "action": ("start", "stop")[i % 2],
+                       "zone": "us-central1-a", "project_id": f"project-{i % 5}"}).encode()
+
+
+async def push(app, messages: int, concurrency: int) -> float:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(client, i):
+        body = json.dumps({"message": {"data": base64.b64encode(payload(i)).decode(), "messageId": f"push-{i}"}})
+        async with semaphore:
+            await client.post("/vm-worker", content=body, headers={"Content-Type": "application/json"})
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(messages)))
+        return messages / (time.perf_counter() - started)
+
+
+async def pull(messages: int, concurrency: int, threads: int) -> float:
+    import fakes
+    from app.subscriber import Subscriber
+
+    client = fakes.FakeSubscriberClient()
+    subscriber = Subscriber({SUBSCRIPTION: "/vm-worker"}, max_messages=concurrency, max_bytes=100 * 1024 * 1024,
+                            max_lease_seconds=3600, min_lease_extension_seconds=60, callback_threads=threads,
+                            client=client)
+    await subscriber.start()
+    started = time.perf_counter()
+    for i in range(messages):
+        client.publish(SUBSCRIPTION, payload(messages + i))
+    done = await asyncio.to_thread(client.subscriptions[SUBSCRIPTION].wait_for_acks, messages, 300)
+    elapsed = time.perf_counter() - started
+    await subscriber.stop()
+    if not done:
+        raise TimeoutError(f"Only {subscriber.stats['acked']} of {messages} messages acked")
+    return messages / elapsed
+
+
+async def main(args):
+    import fakes
+    from app.main import app
+
+    fakes.install(fakes.Behaviour(latency=args.latency))
+    print(f"messages={args.messages} concurrency={args.concurrency} latency={args.latency}s")
+    print(f"push: {await push(app, args.messages, args.concurrency):>8.1f} msg/s")
+    print(f"pull: {await pull(args.messages, args.concurrency, args.callback_threads):>8.1f} msg/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated GCP call latency in seconds")
+    parser.add_argument("--callback-threads", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
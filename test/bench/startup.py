@@ -0,0 +1,86 @@
+"""
+Cold-start benchmark: time from process launch to the first HTTP response.
+
+Starts uvicorn in a fresh process, polls until it answers a request that needs
+no GCP call (an invalid Pub/Sub envelope, answered with 400), and reports the
+import time of app.main and the import-to-first-response time. Results are
+appended to a JSON lines file so runs can be compared over time.
+
+    PYTHONPATH=. python test/bench/startup.py --runs 5 --max-ms 3000
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time_ms() -> float:
+    code = "import time; t = time.perf_counter(); import app.main; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_response_ms(timeout: float) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/vm-worker"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            request = urllib.request.Request(url, data=b"{}", headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=1)
+                return (time.perf_counter() - start) * 1000
+            except urllib.error.HTTPError:
+                # Any HTTP status means the app is serving
+                return (time.perf_counter() - start) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError("uvicorn did not respond in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(args):
+    imports = [import_time_ms() for _ in range(args.runs)]
+    responses = [first_response_ms(args.timeout) for _ in range(args.runs)]
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": args.runs,
+        "import_ms_p50": round(statistics.median(imports), 1),
+        "first_response_ms_p50": round(statistics.median(responses), 1),
+        "first_response_ms_max": round(max(responses), 1),
+    }
+    print(json.dumps(result))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    if args.max_ms and result["first_response_ms_p50"] > args.max_ms:
+        print(f"Regression: first response p50 {result['first_response_ms_p50']}ms > {args.max_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-ms", type=float, default=0, help="Fail if first-response p50 exceeds this")
+    parser.add_argument("--output", default="test/bench/results/startup.jsonl")
+    main(parser.parse_args())
@@ -0,0 +1,294 @@
+"""
+Offline load test of every endpoint in app.main against in-process GCP fakes.
+
+The app runs in this process behind httpx's ASGI transport, with the compute,
+container, zone operations and Firestore clients replaced by test/bench/fakes.py
+(configurable latency and error injection). Each endpoint in turn receives
+--requests requests at --concurrency; Pub/Sub routes get base64 push envelopes
+with unique messageIds. Reports throughput, p50/p99 latency and status counts
+per endpoint, plus event-loop lag sampled over the whole run.
+
+Each run is appended as one JSON line to --output. With --max-regression, the
+run is compared to the previous line with the same settings and fails if any
+endpoint's p99 or throughput got worse by more than that fraction.
+
+    PYTHONPATH=. python test/bench/suite.py --requests 200 --concurrency 32 --latency 0.02
+    PYTHONPATH=. python test/bench/suite.py --error-rate 0.05 --max-regression 0.2
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+# Benchmark defaults, set before app.main loads its config: no coalescing
+# window or rate limits to wait on, and no log output.
+BENCH_ENV = {
+    "COALESCE_WINDOW_SECONDS": "0",
+    "RATE_LIMITS": "",
+    "PROJECT_RATE_LIMITS": "",
+    "LOG_LEVEL": "critical",
+    "SCHEDULER_ENABLED": "false",
+}
+
+_ids = itertools.count()
+
+
+def envelope(data: dict, attributes: dict = None) -> bytes:
+    message = {
+        "data": base64.b64encode(json.dumps(data).encode()).decode(),
+        "messageId": f"bench-{next(_ids)}",
+        "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "attributes": attributes or {},
+    }
+    return json.dumps({"message": message, "subscription": "projects/bench/subscriptions/vm-worker"}).encode()
+
+
+def vm(i: int) -> dict:
+    return {"vm_name": f"vm-{i % 500}", "action": ("start", "stop", "restart")[i % 3],
+            "zone": "us-central1-a", "project_id": f"project-{i % 5}"}
+
+
+def node_pool(i: int) -> dict:
+    return {"project_id": f"project-{i % 5}", "zone": "us-central1", "cluster_id": f"cluster-{i % 10}",
+            "nodepool_id": f"pool-{i % 20}"}
+
+
+def window(i: int) -> dict:
+    return {"frequency": "WEEKLY", "byday": [("MO", "TU", "WE")[i % 3], "SA"], "start_time": f"{i % 24:02d}:00",
+            "duration_hours": 4 + i % 4}
+
+
+def ndjson(i: int) -> bytes:
+    lines = [json.dumps({"kind": "vm", **schedule(i * 10 + j)}) for j in range(10)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def schedule(i: int) -> dict:
+    return {"days": [1, 2, 3, 4, 5], "starttime": "06:00:00", "endtime": "20:00:00", "timezone": "SGT",
+            "project_id": f"project-{i % 5}", "zone": "us-central1-a", "instance_name": f"vm-{i}"}
+
+
+def task(i: int) -> dict:
+    return {"task_id": f"task-{i}", "task_name": "resize", "parameters": {"size": i % 10},
+            "approvers": [{"name": f"approver-{j}", "email": f"approver-{j}@example.com"} for j in range(3)]}
+
+
+def pubsub(data) -> callable:
+    return lambda i: ("POST", envelope(data(i)), {"Content-Type": "application/json"})
+
+
+def get(i: int):
+    return "GET", None, {}
+
+
+# (name, path for request i, request for i). Endpoints run in this order, so
+# tags and tasks exist before they are deleted or approved.
+SCENARIOS = [
+    ("/vm-worker", lambda i: "/vm-worker", pubsub(vm)),
+    ("/vm-worker/batch", lambda i: "/vm-worker/batch",
+     pubsub(lambda i: {"operations": [vm(i * 10 + j) for j in range(10)]})),
+    ("/configure-nodepool", lambda i: "/configure-nodepool",
+     pubsub(lambda i: {**node_pool(i), "enable_autoscaling": i % 2 == 0, "min_nodes": 1, "max_nodes": 3 + i % 3,
+                       "desired_node_count": 2})),
+    ("/nodepool-schedule-tag", lambda i: "/nodepool-schedule-tag",
+     pubsub(lambda i: {**node_pool(i), "enable_autoscaling": True, "business_hours_config": "3,6,4",
+                       "off_hours_config": "0,0,0",
+                       "business_hours": {"days": [1, 2, 3, 4, 5], "starttime": "06:00:00",
+                                          "endtime": "18:00:00", "timezone": "SGT"}})),
+    ("/nodepool-delete-tag", lambda i: "/nodepool-delete-tag",
+     pubsub(lambda i: {"project_id": f"project-{i % 5}", "location": "us-central1",
+                       "cluster_id": f"cluster-{i % 10}", "nodepool_id": f"pool-{i % 20}"})),
+    ("/gke-maintenance-window", lambda i: "/gke-maintenance-window",
+     pubsub(lambda i: {**window(i), "project_id": f"project-{i % 5}", "location": "us-central1",
+                       "cluster_id": f"cluster-{i % 10}"})),
+    ("/gke-maintenance-window/batch", lambda i: "/gke-maintenance-window/batch",
+     pubsub(lambda i: {**window(i), "clusters": [
+         {"project_id": f"project-{i % 5}", "location": "us-central1", "cluster_id": f"cluster-{j}"}
+         for j in range(10)]})),
+    ("/vm-schedule-tag", lambda i: "/vm-schedule-tag", pubsub(schedule)),
+    ("/vm-schedule-delete", lambda i: "/vm-schedule-delete",
+     pubsub(lambda i: {"project_id": f"project-{i % 5}", "zone": "us-central1-a", "instance_name": f"vm-{i}"})),
+    ("/task-operations", lambda i: "/task-operations", pubsub(task)),
+    ("/task-approvals", lambda i: "/task-approvals",
+     pubsub(lambda i: {"task_id": f"task-{i}", "approver_email": f"approver-{i % 3}@example.com",
+                       "action": ("approved", "rejected")[i % 2]})),
+    ("/pubsub", lambda i: "/pubsub",
+     lambda i: ("POST", envelope(vm(i), {"type": "vm-worker"}), {"Content-Type": "application/json"})),
+    ("/schedules/import", lambda i: "/schedules/import",
+     lambda i: ("POST", ndjson(i), {"Content-Type": "application/x-ndjson"})),
+    ("/export/{name}", lambda i: "/export/vm-schedules?page_size=100", get),
+    ("/schedules/desired-state", lambda i: "/schedules/desired-state", get),
+    ("/vm-worker/debug", lambda i: "/vm-worker/debug",
+     lambda i: ("POST", json.dumps(vm(i)).encode(), {"Content-Type": "application/json"})),
+    ("/operations/{message_id}", lambda i: f"/operations/bench-{i}", get),
+    ("/operations/stats", lambda i: "/operations/stats", get),
+    ("/dedup/stats", lambda i: "/dedup/stats", get),
+    ("/limits", lambda i: "/limits", get),
+    ("/metrics", lambda i: "/metrics", get),
+]
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """Record how late the event loop wakes this task up, in seconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run_endpoint(client, path, build, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = collections.Counter()
+
+    async def one(i):
+        method, body, headers = build(i)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path(i), content=body, headers=headers)
+                await response.aread()
+                statuses[str(response.status_code)] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    import fakes
+    from app.main import app
+
+    fakes.install(fakes.Behaviour(latency=args.latency, error_rate=args.error_rate,
+                                  operation_seconds=args.operation_seconds))
+    for handler in app.router.on_startup:
+        await handler()
+
+    lag = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    endpoints = {}
+    # Unhandled app errors count as 500s, as they would behind uvicorn
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, path, build in SCENARIOS:
+            if args.endpoints and name not in args.endpoints:
+                continue
+            endpoints[name] = await run_endpoint(client, path, build, args.requests, args.concurrency)
+            print(f"{name:<32} {endpoints[name]['throughput_rps']:>9.1f} {endpoints[name]['p50_ms']:>9.2f} "
+                  f"{endpoints[name]['p99_ms']:>9.2f}  {endpoints[name]['statuses']}")
+    monitor.cancel()
+
+    for handler in app.router.on_shutdown:
+        await handler()
+    return {
+        "endpoints": endpoints,
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 0.50) * 1000, 2),
+            "p99": round(percentile(lag, 0.99) * 1000, 2),
+            "max": round(max(lag, default=0.0) * 1000, 2),
+            "mean": round(statistics.fmean(lag) * 1000, 2) if lag else 0.0,
+        },
+    }
+
+
+def previous_run(path: str, settings: dict):
+    """The last run in `path` made with the same settings, if any."""
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("settings") == settings:
+                previous = entry
+    return previous
+
+
+def regressions(current: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for name, result in current["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        if before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            found.append(f"{name}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            found.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+    before, after = baseline["loop_lag_ms"]["p99"], current["loop_lag_ms"]["p99"]
+    if before and after > before * (1 + tolerance):
+        found.append(f"event loop lag p99 {before}ms -> {after}ms")
+    return found
+
+
+def main(args):
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    settings = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "operation_seconds": args.operation_seconds,
+        "endpoints": sorted(args.endpoints or []),
+        "env": sorted(args.env),
+    }
+    print(f"{'endpoint':<32} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  statuses")
+    result = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": settings, **asyncio.run(run(args))}
+    lag = result["loop_lag_ms"]
+    print(f"event loop lag: p50 {lag['p50']}ms p99 {lag['p99']}ms max {lag['max']}ms")
+
+    baseline = previous_run(args.output, settings)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    if args.max_regression and baseline is not None:
+        found = regressions(result, baseline, args.max_regression)
+        if found:
+            print(f"Regressions against the run of {baseline['timestamp']}:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated GCP call latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of GCP calls that fail")
+    parser.add_argument("--operation-seconds", type=float, default=1.0, help="Time until a VM operation is DONE")
+    parser.add_argument("--endpoints", nargs="*", help="Only run these endpoints (names as printed)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the app, e.g. --env GCP_EXECUTOR_WORKERS=64")
+    parser.add_argument("--max-regression", type=float, default=0,
+                        help="Fail if p99 or throughput is this fraction worse than the previous matching run")
+    parser.add_argument("--output", default="test/bench/results/suite.jsonl")
+    main(parser.parse_args())
@@ -0,0 +1,13 @@
+import pytest
+
+import fakes
+from app.utils import limits
+
+
+@pytest.fixture
+def fake_gcp():
+    """Fake GCP clients with no latency, and a fresh rate limiter."""
+    installed = fakes.install(fakes.Behaviour(latency=0))
+    limits._limiter = None
+    yield installed
+    limits._limiter = None
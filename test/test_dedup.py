@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.utils.dedup import DedupCache
+
+
+def test_duplicate_while_first_run_is_in_flight_waits_for_it():
+    calls = 0
+
+    async def handler():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"status": "done"}
+
+    async def main():
+        cache = DedupCache(ttl=60, max_entries=10)
+        first = asyncio.create_task(cache.run("message-1", handler))
+        await asyncio.sleep(0.01)
+        second = await cache.run("message-1", handler)
+        return await first, second, cache
+
+    first, second, cache = asyncio.run(main())
+    assert calls == 1
+    assert first == second == {"status": "done"}
+    assert cache.stats["inflight_hits"] == 1
+    assert cache.snapshot()["inflight"] == 0
+
+
+def test_duplicate_after_completion_is_served_from_memory():
+    calls = 0
+
+    async def handler():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        cache = DedupCache(ttl=60, max_entries=10)
+        return [await cache.run("message-1", handler) for _ in range(3)], cache
+
+    results, cache = asyncio.run(main())
+    assert results == [1, 1, 1]
+    assert cache.stats["hits"] == 2
+
+
+def test_failed_run_is_not_cached_and_duplicate_in_flight_sees_the_error():
+    calls = 0
+
+    async def handler():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        if calls == 1:
+            raise RuntimeError("boom")
+        return "retried"
+
+    async def main():
+        cache = DedupCache(ttl=60, max_entries=10)
+        first = asyncio.create_task(cache.run("message-1", handler))
+        await asyncio.sleep(0.005)
+        duplicate = await asyncio.gather(cache.run("message-1", handler), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await first
+        return duplicate[0], await cache.run("message-1", handler)
+
+    duplicate, retried = asyncio.run(main())
+    assert isinstance(duplicate, RuntimeError)
+    assert retried == "retried"
+
+
+def test_firestore_tier_is_shared_between_instances(fake_gcp):
+    def count(operation):
+        labels = {"operation": operation, "collection": "dedup"}
+        return REGISTRY.get_sample_value("vm_worker_firestore_operations_total", labels) or 0
+
+    reads, writes = count("read"), count("write")
+
+    async def handler():
+        return {"status": "done"}
+
+    async def main():
+        first = DedupCache(ttl=60, max_entries=10, collection="dedup")
+        await first.run("message-1", handler)
+        # A new instance (empty memory tier) finds the result in Firestore
+        second = DedupCache(ttl=60, max_entries=10, collection="dedup")
+        result = await second.run("message-1", lambda: pytest.fail("must not run again"))
+        return result, second
+
+    result, second = asyncio.run(main())
+    assert result == {"status": "done"}
+    assert second.stats["firestore_hits"] == 1
+    assert (count("read") - reads, count("write") - writes) == (2, 1)
+
+
+def test_messages_without_id_are_not_deduplicated():
+    calls = 0
+
+    async def handler():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        cache = DedupCache(ttl=60, max_entries=10)
+        return [await cache.run(None, handler) for _ in range(2)]
+
+    assert asyncio.run(main()) == [1, 2]
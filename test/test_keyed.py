@@ -0,0 +1,99 @@
+import asyncio
+
+from app.utils.keyed import KeyedExecutor
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_queued_command_is_replaced_by_newer_one():
+    ran = []
+
+    def command(name):
+        async def factory():
+            ran.append(name)
+            return f"{name} done"
+        return factory
+
+    async def main():
+        executor = KeyedExecutor(window=0.01)
+        return await asyncio.gather(
+            executor.submit("vm-1", "stop", command("stop")),
+            executor.submit("vm-1", "start", command("start")),
+        )
+
+    stopped, started = run(main())
+    assert ran == ["start"]
+    # The replaced caller learns which command ran instead of its own
+    assert stopped == ("start", "start done")
+    assert started == ("start", "start done")
+
+
+def test_keys_run_independently_and_in_order():
+    ran = []
+
+    def command(name):
+        async def factory():
+            ran.append(name)
+            await asyncio.sleep(0.01)
+            return name
+        return factory
+
+    async def main():
+        executor = KeyedExecutor(window=0)
+        first = asyncio.create_task(executor.submit("vm-1", "a", command("a")))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0.001)
+        # "a" is running, so "b" queues behind it; "c" is for another key
+        results = await asyncio.gather(
+            first,
+            executor.submit("vm-1", "b", command("b")),
+            executor.submit("vm-2", "c", command("c")),
+        )
+        return results, executor
+
+    results, executor = run(main())
+    assert results == [("a", "a"), ("b", "b"), ("c", "c")]
+    assert ran.index("a") < ran.index("b")
+    assert not executor._queues and not executor._workers
+
+
+def test_uncoalesced_commands_all_run():
+    ran = []
+
+    def command(name):
+        async def factory():
+            ran.append(name)
+            return name
+        return factory
+
+    async def main():
+        executor = KeyedExecutor(window=0.01)
+        return await asyncio.gather(
+            executor.submit("pool-1", 3, command(3), coalesce=False),
+            executor.submit("pool-1", 5, command(5), coalesce=False),
+        )
+
+    assert run(main()) == [(3, 3), (5, 5)]
+    assert ran == [3, 5]
+
+
+def test_failure_goes_to_the_command_that_ran_only():
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def never():
+        raise AssertionError("replaced command must not run")
+
+    async def main():
+        executor = KeyedExecutor(window=0.01)
+        return await asyncio.gather(
+            executor.submit("vm-1", "stop", never),
+            executor.submit("vm-1", "start", fail),
+            return_exceptions=True,
+        )
+
+    superseded, failed = run(main())
+    assert superseded == ("start", None)
+    assert isinstance(failed, RuntimeError)
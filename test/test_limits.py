@@ -0,0 +1,120 @@
+import pytest
+from google.api_core import exceptions
+
+from app.utils.limits import CircuitBreaker, Limiter, RateLimited, TokenBucket, parse_limits
+
+
+def limiter(**overrides):
+    settings = dict(api_limits={}, project_limits={}, max_wait=0.0, breaker_threshold=2, breaker_reset=30.0)
+    settings.update(overrides)
+    return Limiter(**settings)
+
+
+def test_parse_limits():
+    assert parse_limits("compute=20/40, container=5") == {"compute": (20.0, 40.0), "container": (5.0, 5.0)}
+    assert parse_limits("") == {}
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, burst=2)
+    start = bucket.updated
+    bucket.tokens = 0
+    assert bucket.wait_time(start) == pytest.approx(0.5)
+    assert bucket.wait_time(start + 0.5) == 0
+    # Never refills past the burst
+    bucket.wait_time(start + 60)
+    assert bucket.tokens == 2
+
+
+def test_limiter_rejects_when_bucket_is_empty():
+    lim = limiter(api_limits={"compute": (0.001, 2)})
+    lim.acquire("compute")
+    lim.acquire("compute")
+    with pytest.raises(RateLimited) as error:
+        lim.acquire("compute")
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+    assert lim.stats["rejected"] == 1
+
+
+def test_project_buckets_are_separate():
+    lim = limiter(project_limits={"compute": (0.001, 1)})
+    lim.acquire("compute", "project-a")
+    lim.acquire("compute", "project-b")
+    with pytest.raises(RateLimited):
+        lim.acquire("compute", "project-a")
+
+
+def test_breaker_closed_open_half_open_closed():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+    breaker.record(False, now=0)
+    assert breaker.state == "closed"
+    breaker.record(False, now=1)
+    assert breaker.state == "open" and breaker.trips == 1
+    assert breaker.retry_after(now=5) == pytest.approx(6)
+
+    # After the timeout one caller reserves the probe; others wait for it
+    assert breaker.retry_after(now=11) == 0
+    assert breaker.reserve_probe()
+    assert breaker.retry_after(now=11) == 1.0
+    breaker.start_probe()
+    assert breaker.state == "half_open"
+    breaker.record(True, now=12)
+    assert breaker.state == "closed" and not breaker.probing
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record(False, now=0)
+    breaker.reserve_probe()
+    breaker.start_probe()
+    breaker.record(False, now=11)
+    assert breaker.state == "open" and breaker.opened_at == 11
+    assert breaker.retry_after(now=12) == pytest.approx(9)
+
+
+def test_probe_that_gives_up_leaves_breaker_open_for_next_caller():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record(False, now=0)
+    breaker.reserve_probe()
+    breaker.release_probe()
+    assert breaker.state == "open" and not breaker.probing
+    assert breaker.retry_after(now=11) == 0
+    assert breaker.reserve_probe()
+
+
+def test_limiter_opens_breaker_on_server_errors_only():
+    lim = limiter()
+    lim.acquire("compute", "p")
+    lim.record("compute", "p", exceptions.NotFound("gone"))
+    lim.acquire("compute", "p")
+    lim.record("compute", "p", exceptions.NotFound("gone"))
+    assert lim.snapshot()["breakers"]["compute/p"]["state"] == "closed"
+
+    for _ in range(2):
+        lim.acquire("compute", "p")
+        lim.record("compute", "p", exceptions.InternalServerError("down"))
+    with pytest.raises(RateLimited, match="Circuit open"):
+        lim.acquire("compute", "p")
+    # Other projects are unaffected
+    lim.acquire("compute", "q")
+
+
+def test_probe_rejected_by_rate_limit_releases_the_probe():
+    lim = limiter(api_limits={"compute": (0.001, 1)}, breaker_threshold=1, breaker_reset=0.0)
+    lim.acquire("compute")
+    lim.record("compute", None, exceptions.InternalServerError("down"))
+    # The breaker lets a probe through, but the bucket is empty
+    with pytest.raises(RateLimited, match="Rate limit"):
+        lim.acquire("compute")
+    breaker = lim._breakers["compute"]
+    assert breaker.state == "open" and not breaker.probing
+
+
+def test_quota_error_is_reraised_as_rate_limited():
+    lim = limiter(breaker_reset=15.0)
+    lim.acquire("firestore", "p")
+    with pytest.raises(RateLimited) as error:
+        lim.record("firestore", "p", exceptions.TooManyRequests("quota"))
+    assert error.value.retry_after == 15.0
+    assert lim.stats["quota_errors"] == 1
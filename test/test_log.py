@@ -0,0 +1,42 @@
+import io
+
+import orjson
+
+from app.utils import log
+
+
+def render(event_dict, max_length=40):
+    writer = log.Writer(io.BytesIO(), max_length=max_length, max_lengths={}, max_queue=10)
+    event_dict = log._snapshot(None, "info", {"event": "test", **event_dict})
+    return orjson.loads(writer.render(event_dict))
+
+
+def test_dicts_and_lists_stay_json():
+    event = render({"labels": {"env": "dev"}, "zones": ["a", "b"], "pair": (1, 2), "count": 3})
+    assert event["labels"] == {"env": "dev"}
+    assert event["zones"] == ["a", "b"]
+    assert event["pair"] == [1, 2]
+    assert event["count"] == 3
+
+
+def test_long_values_are_truncated():
+    event = render({"text": "x" * 50, "items": list(range(30))})
+    assert event["text"] == "x" * 40 + "...[10 more]"
+    serialized = orjson.dumps(list(range(30))).decode()
+    assert event["items"] == f"{serialized[:40]}...[{len(serialized) - 40} more]"
+
+
+def test_values_are_snapshotted_when_logged():
+    payload = {"status": "before"}
+    event_dict = log._snapshot(None, "info", {"event": "test", "payload": payload, "error": ValueError("bad")})
+    payload["status"] = "after"
+    writer = log.Writer(io.BytesIO(), max_length=100, max_lengths={}, max_queue=10)
+    event = orjson.loads(writer.render(event_dict))
+    assert event["payload"] == {"status": "before"}
+    assert event["error"] == "bad"
+
+
+def test_objects_inside_containers_are_rendered_as_strings():
+    event = render({"errors": [ValueError("bad")], "by_id": {1: "one"}}, max_length=100)
+    assert event["errors"] == ["bad"]
+    assert event["by_id"] == {"1": "one"}
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions
+from prometheus_client import REGISTRY
+
+from app.utils import clients, metrics
+
+
+def samples(name, **labels):
+    return REGISTRY.get_sample_value(f"{name}_count", labels) or 0
+
+
+def test_streamed_results_are_timed_until_the_stream_ends():
+    @metrics.instrument
+    async def export_stream(payload):
+        async def stream():
+            for i in range(3):
+                await asyncio.sleep(0.02)
+                yield i
+        return stream()
+
+    labels = dict(handler="export_stream", action="", project="", outcome="success")
+
+    async def main():
+        before = samples("vm_worker_handler_duration_seconds", **labels)
+        stream = await export_stream(None)
+        assert samples("vm_worker_handler_duration_seconds", **labels) == before
+        assert [item async for item in stream] == [0, 1, 2]
+        return before
+
+    before = asyncio.run(main())
+    assert samples("vm_worker_handler_duration_seconds", **labels) == before + 1
+    total = REGISTRY.get_sample_value("vm_worker_handler_duration_seconds_sum", labels)
+    assert total >= 0.06
+
+
+def test_limited_blocks_are_timed_per_method(fake_gcp):
+    success = dict(api="firestore", method="set", project="test-project", outcome="success")
+    error = dict(api="firestore", method="get", project="test-project", outcome="error")
+    before = samples("vm_worker_gcp_call_duration_seconds", **success), \
+        samples("vm_worker_gcp_call_duration_seconds", **error)
+
+    with clients.limited("firestore", "set", project="test-project") as db:
+        db.collection("things").document("a").set({"x": 1})
+    with pytest.raises(exceptions.InternalServerError):
+        with clients.limited("firestore", "get", project="test-project"):
+            raise exceptions.InternalServerError("down")
+
+    assert samples("vm_worker_gcp_call_duration_seconds", **success) == before[0] + 1
+    assert samples("vm_worker_gcp_call_duration_seconds", **error) == before[1] + 1
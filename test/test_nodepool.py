@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from google.api_core import exceptions
+
+import app.dataclass as dataclass
+import app.gcp as gcp
+from app.utils.limits import RateLimited
+
+
+@pytest.fixture
+def container(fake_gcp, monkeypatch):
+    monkeypatch.setattr(gcp, "_node_pool_cache", {})
+    calls = []
+    container = fake_gcp["container"]
+    for method in ("set_node_pool_autoscaling", "set_node_pool_size"):
+        original = getattr(container, method)
+
+        def record(*args, method=method, original=original, **kwargs):
+            calls.append(method)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(container, method, record)
+    container.calls = calls
+    return container
+
+
+CONFIG = dataclass.NodePoolConfig(project_id="project-a", zone="zone-a", cluster_id="cluster-1",
+                                  nodepool_id="pool-1", enable_autoscaling=False, desired_node_count=2)
+
+
+def test_rate_limited_state_read_does_not_apply_changes(container, monkeypatch):
+    def get_node_pool(**kwargs):
+        raise RateLimited("container", 5, "Rate limit reached")
+
+    monkeypatch.setattr(container, "get_node_pool", get_node_pool)
+    with pytest.raises(RateLimited):
+        asyncio.run(gcp._nodepool_setsize(CONFIG))
+    assert container.calls == []
+
+
+def test_failed_state_read_applies_every_change(container, monkeypatch):
+    def get_node_pool(**kwargs):
+        raise exceptions.NotFound("no such node pool view")
+
+    monkeypatch.setattr(container, "get_node_pool", get_node_pool)
+    result = asyncio.run(gcp._nodepool_setsize(CONFIG))
+    assert container.calls == ["set_node_pool_autoscaling", "set_node_pool_size"]
+    assert result["skipped"] == []
+
+
+def test_resize_error_is_reported_without_retrying(container, monkeypatch):
+    def set_node_pool_size(**kwargs):
+        container.calls.append("set_node_pool_size")
+        raise exceptions.PermissionDenied("missing container.clusters.update")
+
+    monkeypatch.setattr(container, "set_node_pool_size", set_node_pool_size)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(gcp.set_nodepool_desired_size("projects/p/locations/z/clusters/c/nodePools/n", 3))
+    assert container.calls == ["set_node_pool_size"]
+    assert "missing container.clusters.update" in error.value.detail
+    assert "multiple attempts" not in error.value.detail
+
+
+def test_busy_cluster_is_retried_until_attempts_run_out(container, monkeypatch):
+    def set_node_pool_size(**kwargs):
+        container.calls.append("set_node_pool_size")
+        raise exceptions.FailedPrecondition("operation in progress")
+
+    monkeypatch.setattr(container, "set_node_pool_size", set_node_pool_size)
+    monkeypatch.setattr(gcp, "backoff_delays", lambda **kwargs: iter([0] * 10))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(gcp.set_nodepool_desired_size("projects/p/locations/z/clusters/c/nodePools/n", 3))
+    assert container.calls == ["set_node_pool_size"] * 3
+    assert error.value.detail == "Failed to resize node pool after multiple attempts"
@@ -0,0 +1,78 @@
+import datetime
+
+import pytest
+import pytz
+
+from app.schedule import is_business_hours, next_transition, parse_business_hours, parse_size_config
+
+
+def utc(*args):
+    return pytz.utc.localize(datetime.datetime(*args))
+
+
+def hours(days, start, end, timezone="utc"):
+    return parse_business_hours({"days": days, "starttime": start, "endtime": end, "timezone": timezone})
+
+
+def test_next_transition_within_a_day():
+    weekdays = hours([1, 2, 3, 4, 5], "06:00:00", "18:00:00")
+    # Monday 2026-03-02
+    assert next_transition(weekdays, utc(2026, 3, 2, 3, 0)) == (utc(2026, 3, 2, 6, 0), True)
+    assert next_transition(weekdays, utc(2026, 3, 2, 6, 0)) == (utc(2026, 3, 2, 18, 0), False)
+
+
+def test_next_transition_skips_the_weekend():
+    weekdays = hours([1, 2, 3, 4, 5], "06:00:00", "18:00:00")
+    # Friday evening -> Monday morning
+    assert next_transition(weekdays, utc(2026, 3, 6, 19, 0)) == (utc(2026, 3, 9, 6, 0), True)
+
+
+def test_window_across_midnight():
+    night = hours([1], "22:00", "02:00")
+    assert is_business_hours(night, utc(2026, 3, 2, 23, 0))
+    # Still in Monday's window after midnight, on a Tuesday
+    assert is_business_hours(night, utc(2026, 3, 3, 1, 0))
+    assert not is_business_hours(night, utc(2026, 3, 3, 23, 0))
+    assert next_transition(night, utc(2026, 3, 2, 23, 0)) == (utc(2026, 3, 3, 2, 0), False)
+    assert next_transition(night, utc(2026, 3, 3, 2, 0)) == (utc(2026, 3, 9, 22, 0), True)
+
+
+def test_next_transition_across_dst_change():
+    # New York moves from EST (UTC-5) to EDT (UTC-4) on Sunday 2026-03-08
+    every_day = hours([1, 2, 3, 4, 5, 6, 7], "09:00", "17:00", "est")
+    assert next_transition(every_day, utc(2026, 3, 7, 23, 0)) == (utc(2026, 3, 8, 13, 0), True)
+    assert next_transition(every_day, utc(2026, 3, 8, 13, 0)) == (utc(2026, 3, 8, 21, 0), False)
+    # Before the change, 09:00 local was 14:00 UTC
+    assert next_transition(every_day, utc(2026, 3, 6, 23, 0)) == (utc(2026, 3, 7, 14, 0), True)
+
+
+def test_window_across_midnight_and_dst_change():
+    # Europe/Paris goes from UTC+1 to UTC+2 at 02:00 local on Sunday 2026-03-29
+    night = hours([6], "22:00", "06:00", "cet")
+    assert next_transition(night, utc(2026, 3, 28, 12, 0)) == (utc(2026, 3, 28, 21, 0), True)
+    # 06:00 on Sunday is already summer time
+    assert next_transition(night, utc(2026, 3, 28, 21, 0)) == (utc(2026, 3, 29, 4, 0), False)
+
+
+def test_sunday_may_be_given_as_zero():
+    assert hours([0], "06:00", "18:00").days == frozenset({7})
+
+
+@pytest.mark.parametrize("business_hours", [
+    {"days": [], "starttime": "06:00", "endtime": "18:00"},
+    {"days": [8], "starttime": "06:00", "endtime": "18:00"},
+    {"days": [1], "starttime": "06:00", "endtime": "06:00"},
+    {"days": [1], "starttime": "6", "endtime": "18:00"},
+    {"days": [1], "starttime": "06:00", "endtime": "18:00", "timezone": "Mars/Olympus"},
+])
+def test_invalid_business_hours(business_hours):
+    with pytest.raises(ValueError):
+        parse_business_hours(business_hours)
+
+
+def test_parse_size_config():
+    assert parse_size_config("3,6,4") == (3, 6, 4)
+    with pytest.raises(ValueError):
+        parse_size_config("3,6")
+    with pytest.raises(ValueError):
+        parse_size_config("-1,6,4")
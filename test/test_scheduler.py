@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+
+import pytest
+from fastapi import HTTPException
+
+import app.scheduler as scheduler
+from app.schedule import parse_business_hours
+from app.utils.limits import RateLimited
+
+ALWAYS = {"days": [1, 2, 3, 4, 5, 6, 7], "starttime": "00:00", "endtime": "23:59:59", "timezone": "utc"}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "backoff_delays", lambda **kwargs: itertools.repeat(0))
+
+
+def add(s: scheduler.Scheduler, doc_id: str, doc: dict):
+    s._entries[("vm", doc_id)] = {"doc": doc, "hours": parse_business_hours(doc["business_hours"]), "version": 0}
+
+
+def run_transition(s, doc_id, errors):
+    calls = []
+
+    async def apply(key, doc, in_hours):
+        calls.append(key)
+        if errors:
+            raise errors.pop(0)
+
+    s._apply = apply
+
+    async def main():
+        await s._apply_with_retry(("vm", doc_id), s._entries[("vm", doc_id)]["doc"], True)
+
+    asyncio.run(main())
+    return calls
+
+
+def test_transient_failures_are_retried():
+    s = scheduler.Scheduler(max_attempts=5)
+    add(s, "vm-1", {"business_hours": ALWAYS})
+    calls = run_transition(s, "vm-1", [RateLimited("compute", 0, "test"), HTTPException(503, "down")])
+    assert len(calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    s = scheduler.Scheduler(max_attempts=5)
+    add(s, "vm-1", {"business_hours": ALWAYS})
+    assert len(run_transition(s, "vm-1", [HTTPException(404, "no such VM")])) == 1
+    assert len(run_transition(s, "vm-1", [KeyError("vm_name")])) == 1
+
+
+def test_retries_stop_at_max_attempts():
+    s = scheduler.Scheduler(max_attempts=3)
+    add(s, "vm-1", {"business_hours": ALWAYS})
+    assert len(run_transition(s, "vm-1", [HTTPException(500, "down")] * 10)) == 3
+
+
+def test_retry_is_dropped_when_the_schedule_changes():
+    s = scheduler.Scheduler(max_attempts=5)
+    add(s, "vm-1", {"business_hours": ALWAYS})
+    calls = []
+
+    async def apply(key, doc, in_hours):
+        calls.append(key)
+        # The schedule is deleted while the first attempt fails
+        s._entries.pop(key, None)
+        raise HTTPException(500, "down")
+
+    s._apply = apply
+    asyncio.run(s._apply_with_retry(("vm", "vm-1"), {"business_hours": ALWAYS}, True))
+    assert len(calls) == 1
+
+
+def test_startup_reconcile_is_capped(monkeypatch):
+    s = scheduler.Scheduler(reconcile_concurrency=3)
+    for i in range(10):
+        add(s, f"vm-{i}", {"business_hours": ALWAYS})
+    running, peak = 0, 0
+
+    async def apply(key, doc, in_hours):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    s._apply = apply
+
+    class Index:
+        listeners = []
+
+        def start(self):
+            pass
+
+        def items(self, kind):
+            return []
+
+    monkeypatch.setattr(scheduler, "get_index", Index)
+
+    async def main():
+        await s.start()
+        await asyncio.gather(*s._running)
+        s._task.cancel()
+
+    asyncio.run(main())
+    assert peak == 3
@@ -0,0 +1,75 @@
+import concurrent.futures
+
+import pytest
+from fastapi import HTTPException
+
+import app.dataclass as dataclass
+import app.gcp as gcp
+
+
+def store_task(approvers):
+    gcp.task_store_db(dataclass.TaskPayload(
+        task_id="task-1",
+        task_name="Resize",
+        parameters={"size": 3},
+        approvers=[{"name": email.split("@")[0], "email": email} for email in approvers],
+    ))
+
+
+def approve(email, action="approved"):
+    return gcp.task_approve(dataclass.TaskApprovals(task_id="task-1", approver_email=email, action=action))
+
+
+def task(fakes):
+    return fakes["firestore"].data["tasks"]["task-1"]
+
+
+def approval_id(email):
+    return gcp.get_approval_doc_id("task-1", email)
+
+
+def test_task_is_stored_with_counters(fake_gcp):
+    store_task(["a@example.com", "b@example.com"])
+    assert task(fake_gcp) == {
+        "TaskID": "task-1", "TaskName": "Resize", "Parameters": {"size": 3}, "Status": "Pending Approval",
+        "ApproverCount": 2, "PendingCount": 2, "ApprovedCount": 0, "RejectedCount": 0,
+    }
+    assert len(fake_gcp["firestore"].data["taskApproval"]) == 2
+
+
+def test_task_is_approved_when_every_approver_approves(fake_gcp):
+    store_task(["a@example.com", "b@example.com"])
+    approve("a@example.com")
+    assert task(fake_gcp)["ApprovedCount"] == 1
+    assert task(fake_gcp)["Status"] == "Pending Approval"
+    approve("B@example.com")
+    assert task(fake_gcp)["Status"] == "Approved"
+    assert (task(fake_gcp)["PendingCount"], task(fake_gcp)["ApprovedCount"]) == (0, 2)
+
+
+def test_repeated_and_changed_decisions_keep_counters_consistent(fake_gcp):
+    store_task(["a@example.com", "b@example.com"])
+    approve("a@example.com")
+    approve("a@example.com")
+    assert (task(fake_gcp)["PendingCount"], task(fake_gcp)["ApprovedCount"]) == (1, 1)
+    approve("a@example.com", "rejected")
+    assert (task(fake_gcp)["PendingCount"], task(fake_gcp)["ApprovedCount"], task(fake_gcp)["RejectedCount"]) == (1, 0, 1)
+    approval = fake_gcp["firestore"].data["taskApproval"][approval_id("a@example.com")]
+    assert approval["Status"] == "Rejected"
+
+
+def test_concurrent_approvals_are_all_counted(fake_gcp):
+    approvers = [f"user{i}@example.com" for i in range(20)]
+    store_task(approvers)
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        list(pool.map(approve, approvers))
+    assert task(fake_gcp)["ApprovedCount"] == 20
+    assert task(fake_gcp)["PendingCount"] == 0
+    assert task(fake_gcp)["Status"] == "Approved"
+
+
+def test_unknown_task_is_404(fake_gcp):
+    fake_gcp["firestore"].data["taskApproval"] = {approval_id("a@example.com"): {"Status": "Pending"}}
+    with pytest.raises(HTTPException) as error:
+        approve("a@example.com")
+    assert error.value.status_code == 404
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app.dataclass as dataclass
+import app.gcp as gcp
+from app.utils import dedup, limits
+from app.vm_status import get_status_cache
+
+
+@pytest.fixture
+def restarts(fake_gcp, monkeypatch):
+    """Record the VMs restarted through the fake compute client."""
+    monkeypatch.setattr(gcp, "_resource_executor", gcp.KeyedExecutor(window=0))
+    monkeypatch.setattr(dedup, "_cache", dedup.DedupCache(ttl=60, max_entries=100))
+    monkeypatch.setattr(get_status_cache(), "ttl", 0)
+    compute = fake_gcp["compute"]
+    calls = []
+    restart = compute.restart
+
+    def record(project, zone, instance):
+        calls.append(instance)
+        return restart(project, zone, instance)
+
+    monkeypatch.setattr(compute, "restart", record)
+    return calls
+
+
+def limit_compute(burst: int):
+    limits._limiter = limits.Limiter(api_limits={"compute": (0.001, burst)}, project_limits={}, max_wait=0,
+                                     breaker_threshold=5, breaker_reset=30)
+
+
+def test_redelivered_batch_only_reruns_rate_limited_items(restarts):
+    batch = dataclass.VMOperationBatch(operations=[
+        {"vm_name": f"vm-{i}", "zone": "zone-a", "project_id": "project-a", "action": "restart"} for i in range(3)
+    ])
+
+    async def main():
+        limit_compute(burst=2)
+        with pytest.raises(HTTPException) as error:
+            await gcp.vm_operation_batch(batch, message_id="message-1")
+        assert error.value.status_code == 429
+        assert error.value.detail["rate_limited"] == 1
+        # Pub/Sub redelivers the same message once tokens are available again
+        limit_compute(burst=10)
+        return await gcp.vm_operation_batch(batch, message_id="message-1")
+
+    response = asyncio.run(main())
+    assert sorted(restarts) == ["vm-0", "vm-1", "vm-2"]
+    assert response["succeeded"] == 3
+    assert [r["status"] for r in response["results"]] == ["initiated"] * 3